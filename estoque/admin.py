@@ -1,27 +1,251 @@
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode
+
 from django.contrib import admin
 from django.contrib import messages
-from django.core.exceptions import ValidationError
-from .models import Equipamento, EstoqueTecnico, Movimentacao, OrdemMovimentacao, ItemOrdem
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Max, Min, QuerySet, Value
+from django.http import JsonResponse
+from django.shortcuts import redirect, render
+from django.urls import path, reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from .autocompletar import indice as indice_autocompletar
+from .busca import buscar_equipamentos, buscar_movimentacoes
+from .filiais import anotar_saldo, filial_pedida
+from .forms import ImportarPlanilhaForm
+from .previsao import dias_restantes
+from .reservas import reservar
+from .models import (
+    MATRIZ, AlertaEstoque, ArquivoMovimentacao, Equipamento, EstoqueBaixo, EstoqueFilial, EstoqueTecnico,
+    Fechamento, Filial, Movimentacao, OrdemMovimentacao, ItemOrdem,
+)
+
+# ==============================================================================
+# 0. PEÇAS PARA LISTAS GRANDES (Histórico com muitas linhas)
+# ==============================================================================
+
+# Filtro de Técnico/Equipamento com busca digitando (select2 + autocomplete do admin).
+# O filtro padrão carrega TODOS os usuários/itens na tela; este só carrega o escolhido.
+class FiltroAutocomplete(admin.RelatedFieldListFilter):
+    template = 'admin/estoque/filtro_autocomplete.html'
+
+    def __init__(self, field, request, params, model, model_admin, field_path):
+        self.modelo_origem = model
+        super().__init__(field, request, params, model, model_admin, field_path)
+
+    def field_choices(self, field, request, model_admin):
+        if not self.lookup_val:
+            return []
+        escolhidos = field.remote_field.model._default_manager.filter(pk__in=self.lookup_val)
+        return [(obj.pk, str(obj)) for obj in escolhidos]
+
+    def has_output(self):
+        return True
+
+    def url_autocomplete(self):
+        return reverse('admin:autocomplete') + '?' + urlencode({
+            'app_label': self.modelo_origem._meta.app_label,
+            'model_name': self.modelo_origem._meta.model_name,
+            'field_name': self.field_path,
+        })
+
+
+# Sem filtro, a contagem da lista é estimada pela chave primária (instantâneo)
+# em vez de COUNT(*) no histórico inteiro. Com filtro, a contagem é exata.
+class PaginadorEstimado(Paginator):
+    LIMITE_CONTAGEM = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimativa = _estimar_linhas(queryset.model)
+            if estimativa > self.LIMITE_CONTAGEM:
+                return estimativa
+        return super().count
+
+
+# Navegação por data (date_hierarchy): anos/meses/dias saem do primeiro e do último
+# registro (MIN/MAX pelo índice) em vez de um SELECT DISTINCT no histórico inteiro.
+# Um período sem nenhuma movimentação aparece na barra e só abre a lista vazia.
+class HistoricoPorDataQuerySet(QuerySet):
+    def datetimes(self, field_name, kind, order='ASC', tzinfo=None):
+        limites = self.aggregate(primeiro=Min(field_name), ultimo=Max(field_name))
+        if limites['primeiro'] is None:
+            return []
+        fuso = tzinfo or timezone.get_current_timezone()
+        primeiro = timezone.localtime(limites['primeiro'], fuso)
+        ultimo = timezone.localtime(limites['ultimo'], fuso)
+
+        def inicio_do_periodo(momento):
+            return date(momento.year, 1 if kind == 'year' else momento.month, momento.day if kind == 'day' else 1)
+
+        periodos, atual, fim = [], inicio_do_periodo(primeiro), inicio_do_periodo(ultimo)
+        while atual <= fim:
+            periodos.append(datetime(atual.year, atual.month, atual.day, tzinfo=fuso))
+            if kind == 'day':
+                atual += timedelta(days=1)
+            elif kind == 'month':
+                atual = date(atual.year + atual.month // 12, atual.month % 12 + 1, 1)
+            else:
+                atual = date(atual.year + 1, 1, 1)
+        return periodos[::-1] if order == 'DESC' else periodos
+
+
+def _estimar_linhas(model):
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [model._meta.db_table])
+            linha = cursor.fetchone()
+        return linha[0] if linha else 0
+    # Ids só crescem: o intervalo entre o primeiro e o último é uma boa estimativa
+    limites = model._default_manager.aggregate(primeiro=Min('pk'), ultimo=Max('pk'))
+    if limites['ultimo'] is None:
+        return 0
+    return limites['ultimo'] - limites['primeiro'] + 1
+
+
+# Filtro "Por filial" das listas de itens. Quem troca o saldo pelo da filial é o
+# get_queryset do admin (anotar_saldo, em filiais.py); aqui só aparecem as opções.
+class FiltroFilial(admin.SimpleListFilter):
+    title = "filial"
+    parameter_name = 'filial'
+
+    def lookups(self, request, model_admin):
+        return [(str(pk), nome) for pk, nome in Filial.objects.values_list('pk', 'nome')]
+
+    def queryset(self, request, queryset):
+        return queryset
+
 
 # ==============================================================================
 # 1. CONFIGURAÇÕES ANTIGAS (MANTIDAS EXATAMENTE IGUAIS)
 # ==============================================================================
 
+# Saldo de cada filial na tela do item (só leitura: muda por movimentação ou no "Estoque por filial")
+class EstoqueFilialInline(admin.TabularInline):
+    model = EstoqueFilial
+    fields = ('filial', 'quantidade')
+    readonly_fields = ('filial', 'quantidade')
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 @admin.register(Equipamento)
 class EquipamentoAdmin(admin.ModelAdmin):
-    list_display = ('nome', 'tipo', 'quantidade', 'status_estoque')
-    list_filter = ('tipo',)
+    list_display = ('nome', 'tipo', 'estoque', 'status_estoque')
+    list_filter = ('tipo', FiltroFilial)
     search_fields = ('nome',)
+    ordering = ('nome', 'id') # Mesma ordem do índice de nome (sem desempate invertido)
+    inlines = [EstoqueFilialInline]
+
+    # Sem ?filial= é o total da empresa; com ele, o saldo daquela filial (um LEFT JOIN pelo índice)
+    def get_queryset(self, request):
+        return anotar_saldo(super().get_queryset(request), filial_pedida(request.GET))
+
+    # Item já cadastrado: o total é a soma das filiais (gatilho do banco), não se digita
+    def get_readonly_fields(self, request, obj=None):
+        if obj is not None:
+            return ('quantidade',)
+        return ()
+
+    # Busca pelo índice de palavras (nome, especificações, observação), ver busca.py
+    def get_search_results(self, request, queryset, search_term):
+        return buscar_equipamentos(queryset, search_term), False
+
+    @admin.display(description="Quantidade", ordering='saldo')
+    def estoque(self, obj):
+        return obj.saldo
 
     def status_estoque(self, obj):
-        if obj.quantidade <= obj.minimo:
+        if obj.baixo:
             return "⚠️ BAIXO ESTOQUE"
         return "OK"
 
+    # --- Importar planilha (botão "Importar planilha" na lista) ---
+    change_list_template = 'admin/estoque/equipamento/change_list.html'
+    ERROS_NA_TELA = 500
+
+    def get_urls(self):
+        return [
+            path('importar/', self.admin_site.admin_view(self.importar_planilha), name='estoque_equipamento_importar'),
+            path('autocompletar/', self.admin_site.admin_view(self.autocompletar), name='estoque_equipamento_autocompletar'),
+        ] + super().get_urls()
+
+    # --- Autocompletar do lote (índice em memória, ver autocompletar.py) ---
+    # Mesmo formato do autocomplete do admin (Select2), com o estoque junto no texto
+    def autocompletar(self, request):
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        try:
+            pagina = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
+            pagina = 1
+        itens, mais = indice_autocompletar.buscar(request.GET.get('term', ''), pagina)
+        return JsonResponse({
+            'results': [
+                {'id': str(pk), 'text': f"{nome} (Qtd: {quantidade})", 'tipo': tipo, 'quantidade': quantidade}
+                for pk, nome, tipo, quantidade in itens
+            ],
+            'pagination': {'more': mais},
+        })
+
+    def importar_planilha(self, request):
+        from .importacao import importar_planilha
+
+        if not (self.has_add_permission(request) and self.has_change_permission(request)):
+            raise PermissionDenied
+
+        form = ImportarPlanilhaForm(request.POST or None, request.FILES or None)
+        resultado = None
+        if request.method == 'POST' and form.is_valid():
+            arquivo = form.cleaned_data['arquivo']
+            try:
+                filial = form.cleaned_data['filial']
+                resultado = importar_planilha(arquivo.file, arquivo.name, request.user,
+                                              filial.pk if filial else MATRIZ)
+            except ValueError as erro:
+                form.add_error('arquivo', str(erro))
+            else:
+                messages.success(request, (
+                    f"✅ {resultado['criados']} itens novos, {resultado['atualizados']} atualizados e "
+                    f"{resultado['entradas']} unidades lançadas como ENTRADA."
+                ))
+                if resultado['interrompido']:
+                    linha, motivo = resultado['interrompido']
+                    messages.error(request, (
+                        f"⛔ A leitura parou na linha {linha}: {motivo} As linhas de cima já foram importadas: "
+                        f"corrija o arquivo e envie só da linha {linha} em diante."
+                    ))
+                elif not resultado['erros']:
+                    return redirect('admin:estoque_equipamento_changelist')
+                messages.warning(request, f"⚠️ {len(resultado['erros'])} linhas não foram importadas (lista abaixo).")
+
+        return render(request, 'admin/estoque/equipamento/importar.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': "Importar planilha de equipamentos",
+            'form': form,
+            'erros': resultado['erros'][:self.ERROS_NA_TELA] if resultado else [],
+            'erros_escondidos': max(0, len(resultado['erros']) - self.ERROS_NA_TELA) if resultado else 0,
+        })
+
 @admin.register(EstoqueTecnico)
 class EstoqueTecnicoAdmin(admin.ModelAdmin):
     list_display = ('tecnico', 'equipamento', 'quantidade', 'alerta_pendencia')
-    list_filter = ('tecnico', 'equipamento')
+    list_filter = (('tecnico', FiltroAutocomplete), ('equipamento', FiltroAutocomplete))
+    list_select_related = ('tecnico', 'equipamento') # Nome do técnico e do item no mesmo SELECT
+    paginator = PaginadorEstimado
+    show_full_result_count = False
     
     def alerta_pendencia(self, obj):
         if obj.quantidade > 0:
@@ -30,10 +254,32 @@ class EstoqueTecnicoAdmin(admin.ModelAdmin):
 
 @admin.register(Movimentacao)
 class MovimentacaoAdmin(admin.ModelAdmin):
-    list_display = ('data', 'tipo', 'tecnico', 'equipamento', 'quantidade', 'obs', 'autor_movimento')
-    list_filter = ('tipo', 'tecnico', 'data')
+    list_display = ('data', 'tipo', 'filial', 'tecnico', 'equipamento', 'quantidade', 'obs', 'autor_movimento')
+    list_filter = ('tipo', 'filial', ('tecnico', FiltroAutocomplete), ('equipamento', FiltroAutocomplete), 'data')
     search_fields = ('obs', 'equipamento__nome', 'tecnico__username')
+    ordering = ('-data',) # Mais recentes primeiro (índice de data)
+    list_select_related = ('filial', 'tecnico', 'equipamento', 'autor_movimento') # Sem 1 consulta extra por linha
+    date_hierarchy = 'data'
+    paginator = PaginadorEstimado
+    show_full_result_count = False # Não faz um segundo COUNT(*) do histórico inteiro ao filtrar
     
+    def get_queryset(self, request):
+        queryset = HistoricoPorDataQuerySet(self.model, using=Movimentacao.objects.db)
+        return queryset.order_by(*self.get_ordering(request))
+
+    # "OS 1040" vai pelo índice de palavras da OBS em vez de LIKE no histórico inteiro
+    def get_search_results(self, request, queryset, search_term):
+        return buscar_movimentacoes(queryset, search_term), False
+
+    # Transferência só em lote (tipo "Transferência entre filiais"): uma perna
+    # sozinha sumiria com o estoque de uma filial sem aparecer na outra
+    def formfield_for_choice_field(self, db_field, request, **kwargs):
+        if db_field.name == 'tipo':
+            kwargs['choices'] = [
+                (valor, nome) for valor, nome in db_field.choices if valor not in ('TRANSF_SAIDA', 'TRANSF_ENTRADA')
+            ]
+        return super().formfield_for_choice_field(db_field, request, **kwargs)
+
     # Salva automaticamente quem é a secretária/usuário logado
     def save_model(self, request, obj, form, change):
         if not obj.autor_movimento:
@@ -45,15 +291,27 @@ class MovimentacaoAdmin(admin.ModelAdmin):
 # 2. NOVO SISTEMA DE LOTE (COM A TRAVA DE SEGURANÇA)
 # ==============================================================================
 
+# Mesmo campo de busca do admin, mas consultando o autocompletar em memória do EquipamentoAdmin
+class AutocompleteComEstoque(AutocompleteSelect):
+    def get_url(self):
+        return reverse(f'{self.admin_site.name}:estoque_equipamento_autocompletar')
+
+
 class ItemOrdemInline(admin.TabularInline):
     model = ItemOrdem
     extra = 5 # Mostra 5 linhas vazias para preencher rápido
     autocomplete_fields = ['equipamento'] # Permite buscar digitando o nome
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'equipamento':
+            kwargs['widget'] = AutocompleteComEstoque(db_field, self.admin_site, using=kwargs.get('using'))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
 @admin.register(OrdemMovimentacao)
 class OrdemMovimentacaoAdmin(admin.ModelAdmin):
-    list_display = ('id', 'tecnico', 'tipo', 'data', 'lancado')
-    list_filter = ('tipo', 'data')
+    list_display = ('id', 'tecnico', 'tipo', 'filial', 'filial_destino', 'data', 'rascunho', 'lancado')
+    list_select_related = ('tecnico', 'filial', 'filial_destino')
+    list_filter = ('tipo', 'filial', 'rascunho', 'data')
     search_fields = ('tecnico__username',)
     inlines = [ItemOrdemInline]
     
@@ -63,45 +321,168 @@ class OrdemMovimentacaoAdmin(admin.ModelAdmin):
         
         ordem = form.instance
         
+        # Rascunho: só segura os itens (reservas.py); lança quando desmarcar e salvar
+        if ordem.rascunho and not ordem.lancado:
+            try:
+                reservas = reservar(ordem)
+            except ValidationError as e:
+                for erro in e.messages:
+                    messages.error(request, f"❌ RESERVA CANCELADA: {erro}")
+                return
+            if reservas:
+                validade = timezone.localtime(reservas[0].expira_em)
+                messages.success(request, (
+                    f"🔒 {len(reservas)} itens reservados até {validade:%H:%M}. "
+                    "Desmarque \"Só reservar\" e salve para lançar."
+                ))
+            return
+
         # Só executa a lógica se o lote ainda não foi processado (lancado=False)
         if not ordem.lancado:
-            itens = ordem.itemordem_set.all()
-            
-            # --- FASE 1: TESTE DE SEGURANÇA (SIMULAÇÃO) ---
-            # O sistema verifica item por item SE vai dar erro.
-            # Se UM item falhar (ex: saldo insuficiente), ele cancela TUDO.
-            for item in itens:
-                # Cria uma movimentação "fantasma" na memória só para testar
-                mov_teste = Movimentacao(
-                    tecnico=ordem.tecnico,
-                    equipamento=item.equipamento,
-                    tipo=ordem.tipo,
-                    quantidade=item.quantidade
-                )
-                try:
-                    # Chama aquela validação que criamos no models.py (clean)
-                    mov_teste.clean()
-                except ValidationError as e:
-                    # SE DER ERRO: Para tudo imediatamente!
-                    # O usuário recebe um aviso e nada é gravado no estoque.
-                    messages.error(request, f"❌ ERRO CANCELADO: O item '{item.equipamento.nome}' falhou. {e.message}")
-                    return # Sai da função. O lote fica salvo, mas não processado.
-
-            # --- FASE 2: EXECUÇÃO REAL (SÓ SE PASSOU NO TESTE) ---
-            # Se chegou aqui, todos os itens são válidos. Pode gravar!
-            n_criados = 0
-            for item in itens:
-                Movimentacao.objects.create(
-                    tecnico=ordem.tecnico,
-                    equipamento=item.equipamento,
-                    tipo=ordem.tipo,
-                    quantidade=item.quantidade,
-                    obs=f"Lote #{ordem.id} | {ordem.obs or ''}",
-                    autor_movimento=request.user
-                )
-                n_criados += 1
-            
+            # O lote inteiro é conferido em memória (saldos carregados numa consulta só)
+            # e gravado numa única transação. Se UM item falhar, nada é gravado.
+            try:
+                movimentacoes = ordem.lancar(autor=request.user)
+            except ValidationError as e:
+                # O usuário recebe um aviso por item e o lote fica salvo, mas não processado.
+                for erro in e.messages:
+                    messages.error(request, f"❌ ERRO CANCELADO: {erro}")
+                return
+
             # Marca como lançado (Check verde) e avisa sucesso
-            ordem.lancado = True
-            ordem.save()
-            messages.success(request, f"✅ Sucesso! {n_criados} movimentações foram geradas e o estoque foi atualizado.")
+            messages.success(request, f"✅ Sucesso! {len(movimentacoes)} movimentações foram geradas e o estoque foi atualizado.")
+
+
+# ==============================================================================
+# 3. FECHAMENTOS (Só consulta: quem grava é o comando "gerar_fechamento")
+# ==============================================================================
+
+@admin.register(Fechamento)
+class FechamentoAdmin(admin.ModelAdmin):
+    list_display = ('data', 'ultima_movimentacao')
+    date_hierarchy = 'data'
+    ordering = ('-data',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+# Meses que saíram do banco (comando "arquivar_movimentacoes"). Apagar aqui não
+# traz as linhas de volta: só esconderia o mês dos relatórios.
+@admin.register(ArquivoMovimentacao)
+class ArquivoMovimentacaoAdmin(admin.ModelAdmin):
+    list_display = ('mes', 'linhas', 'primeira_movimentacao', 'ultima_movimentacao', 'arquivo', 'data')
+    ordering = ('-mes',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+# ==============================================================================
+# 4. ESTOQUE BAIXO (Itens no mínimo e alertas gravados pelo banco)
+# ==============================================================================
+
+@admin.register(EstoqueBaixo)
+class EstoqueBaixoAdmin(admin.ModelAdmin):
+    list_display = ('nome', 'tipo', 'estoque', 'minimo', 'previsao')
+    list_filter = ('tipo', FiltroFilial)
+    search_fields = ('nome',)
+    ordering = ('nome', 'id') # Lida pelo índice parcial (só os itens no mínimo)
+    show_full_result_count = False
+
+    # Empresa toda: índice parcial do estoque_baixo. Uma filial: saldo dela <= mínimo do item.
+    def get_queryset(self, request):
+        filial = filial_pedida(request.GET)
+        queryset = anotar_saldo(super().get_queryset(request), filial)
+        if filial is None:
+            return queryset.filter(estoque_baixo=True)
+        return queryset.filter(baixo=True).annotate(da_filial=Value(filial))
+
+    @admin.display(description="Quantidade", ordering='saldo')
+    def estoque(self, obj):
+        return obj.saldo
+
+    def get_search_results(self, request, queryset, search_term):
+        return buscar_equipamentos(queryset, search_term), False
+
+    # Previsão do catálogo inteiro vem do cache (previsao.py): nenhuma consulta por linha
+    @admin.display(description="Dura (dias)")
+    def previsao(self, obj):
+        dias = dias_restantes(getattr(obj, 'da_filial', None)).get(obj.pk)
+        return "-" if dias is None else f"≈ {dias:.0f}"
+
+    # Mesma linha de Equipamento: edição é lá (aqui só a lista)
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+# ==============================================================================
+# 5. FILIAIS (Locais de estoque e o saldo de cada um)
+# ==============================================================================
+
+@admin.register(Filial)
+class FilialAdmin(admin.ModelAdmin):
+    list_display = ('nome',)
+    search_fields = ('nome',)
+
+    # A Matriz recebe tudo que não diz a filial (API antiga, arquivos, planilha)
+    def has_delete_permission(self, request, obj=None):
+        if obj is not None and obj.pk == MATRIZ:
+            return False
+        return super().has_delete_permission(request, obj)
+
+
+# Ajuste de inventário de uma filial: mudar a quantidade aqui corrige o total da empresa junto (gatilho)
+@admin.register(EstoqueFilial)
+class EstoqueFilialAdmin(admin.ModelAdmin):
+    list_display = ('filial', 'equipamento', 'quantidade')
+    list_filter = ('filial', ('equipamento', FiltroAutocomplete))
+    list_select_related = ('filial', 'equipamento')
+    search_fields = ('equipamento__nome',)
+    ordering = ('filial', 'equipamento__nome')
+    readonly_fields = ('filial', 'equipamento')
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+
+    # Linha nasce sozinha na primeira entrada da filial
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(AlertaEstoque)
+class AlertaEstoqueAdmin(admin.ModelAdmin):
+    list_display = ('data', 'tipo', 'equipamento', 'quantidade', 'minimo')
+    list_filter = ('tipo', ('equipamento', FiltroAutocomplete))
+    list_select_related = ('equipamento',)
+    date_hierarchy = 'data'
+    ordering = ('-data',)
+    paginator = PaginadorEstimado
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        queryset = HistoricoPorDataQuerySet(self.model, using=AlertaEstoque.objects.db)
+        return queryset.order_by(*self.get_ordering(request))
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
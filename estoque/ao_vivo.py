@@ -0,0 +1,161 @@
+import asyncio
+import json
+import threading
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
+from django.db.models import OuterRef
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .filiais import filial_pedida
+from .models import Equipamento, EstoqueFilial
+from .reservas import expressao_reservado
+from .signals import versao_estoque
+
+# ==============================================================================
+# PAINEL AO VIVO (Server-Sent Events)
+# ==============================================================================
+# O painel abre /eventos/estoque/ e fica escutando. Quando um lançamento (avulso
+# ou lote) é confirmado no banco, sai um evento "saldos" só com os itens mexidos:
+#   {"versao": 1760000000.5, "itens": [{"id": 12, "quantidade": 6, "reservado": 2, "baixo": false}]}
+# (quantidade = disponível, já sem o reservado pelos lotes em rascunho)
+# e o painel_ao_vivo.js troca o número desses cards, sem recarregar a página.
+# Painel de uma filial (/eventos/estoque/?filial=2) recebe os números daquela
+# filial; o evento de cada filial é montado uma vez só, para quem está nela.
+#
+# Entrega: cada conexão é uma asyncio.Queue no laço de eventos do servidor ASGI
+# (uvicorn/daphne: "uvicorn setup.asgi:application"). Conexão parada não ocupa
+# thread, só a fila, então um processo aguenta centenas de painéis abertos.
+# O lançamento acontece numa thread comum: o evento é montado uma vez só e
+# entregue em cada fila com loop.call_soon_threadsafe.
+#
+# Atenção: a entrega é dentro do processo (como o cache LocMem). Com vários
+# processos, o painel só recebe os lançamentos feitos no mesmo processo; ao
+# reconectar, o evento "versao" avisa se perdeu algo e o painel recarrega.
+# No WSGI (runserver/gunicorn comum) a conexão prenderia uma thread: a resposta é
+# 204 e o navegador não tenta de novo (o painel continua como sempre foi).
+BATIDA_SEGUNDOS = 25    # comentário vazio para o proxy não derrubar a conexão parada
+RECONECTAR_MS = 5000
+TAMANHO_FILA = 100      # cliente que ficou para trás recebe "recarregar"
+MAX_CONEXOES = 1000
+
+
+def _evento(nome, dados):
+    return f"event: {nome}\ndata: {json.dumps(dados, separators=(',', ':'))}\n\n"
+
+
+RECARREGAR = _evento('recarregar', {})
+
+
+def _entregar(fila, evento):
+    # Roda no laço de eventos (chamado pelo call_soon_threadsafe)
+    try:
+        fila.put_nowait(evento)
+    except asyncio.QueueFull:
+        while not fila.empty():
+            fila.get_nowait()
+        fila.put_nowait(RECARREGAR)
+
+
+# Publicar para todos os painéis, de qualquer filial
+TODAS = object()
+
+
+class Canal:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self._assinantes = {}  # (laço de eventos, fila): filial (None = empresa toda)
+
+    def __len__(self):
+        return len(self._assinantes)
+
+    def assinar(self, filial=None):
+        assinante = (asyncio.get_running_loop(), asyncio.Queue(TAMANHO_FILA))
+        with self._trava:
+            self._assinantes[assinante] = filial
+        return assinante
+
+    def cancelar(self, assinante):
+        with self._trava:
+            self._assinantes.pop(assinante, None)
+
+    # Filiais com alguém ouvindo (None = painel da empresa toda)
+    def filiais(self):
+        with self._trava:
+            return set(self._assinantes.values())
+
+    # Pode ser chamado de qualquer thread
+    def publicar(self, evento, filial=TODAS):
+        with self._trava:
+            assinantes = [a for a, f in self._assinantes.items() if filial is TODAS or f == filial]
+        for laco, fila in assinantes:
+            try:
+                laco.call_soon_threadsafe(_entregar, fila, evento)
+            except RuntimeError:
+                # Laço de eventos já encerrado (servidor parando)
+                self.cancelar((laco, fila))
+
+
+canal = Canal()
+
+
+def _item(pk, quantidade, reservado, baixo):
+    return {'id': pk, 'quantidade': quantidade - reservado, 'reservado': reservado, 'baixo': baixo}
+
+
+# Chamado depois do COMMIT do lançamento (signals.py). Sem ninguém ouvindo, nem consulta o banco.
+# Uma consulta para a empresa toda e outra para todas as filiais com painel aberto.
+def publicar_saldos(equipamento_ids):
+    if not len(canal) or not equipamento_ids:
+        return
+    filiais = canal.filiais()
+    por_filial = {}
+    if None in filiais:
+        por_filial[None] = [
+            _item(*linha) for linha in Equipamento.objects.filter(pk__in=equipamento_ids)
+            .order_by('id').values_list('id', 'quantidade', expressao_reservado(), 'estoque_baixo')
+        ]
+    if filiais - {None}:
+        saldos = EstoqueFilial.objects.filter(
+            filial_id__in=filiais - {None}, equipamento_id__in=equipamento_ids
+        ).order_by('equipamento_id').values_list(
+            'filial_id', 'equipamento_id', 'quantidade',
+            expressao_reservado(item='equipamento_id', filial=OuterRef('filial_id')), 'equipamento__minimo',
+        )
+        for filial, pk, quantidade, reservado, minimo in saldos:
+            por_filial.setdefault(filial, []).append(_item(pk, quantidade, reservado, quantidade <= minimo))
+
+    versao = versao_estoque()
+    for filial, itens in por_filial.items():
+        canal.publicar(_evento('saldos', {'versao': versao, 'itens': itens}), filial=filial)
+
+
+async def _transmitir(filial=None):
+    assinante = canal.assinar(filial)
+    _, fila = assinante
+    try:
+        yield f"retry: {RECONECTAR_MS}\n\n"
+        # Versão atual logo na conexão: se o painel está mais velho que isso, recarrega
+        yield _evento('versao', {'versao': await sync_to_async(versao_estoque)()})
+        while True:
+            try:
+                yield await asyncio.wait_for(fila.get(), BATIDA_SEGUNDOS)
+            except TimeoutError:
+                yield ": ping\n\n"
+    finally:
+        # Navegador fechou (o servidor cancela a transmissão) ou servidor parando
+        canal.cancelar(assinante)
+
+
+@login_required(login_url='/admin/login/')
+async def eventos_estoque(request):
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    if len(canal) >= MAX_CONEXOES:
+        return HttpResponse("Painel ao vivo lotado, tente mais tarde.", status=503, headers={'Retry-After': '60'})
+
+    response = StreamingHttpResponse(_transmitir(filial_pedida(request.GET)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # nginx: não segura os eventos no buffer
+    return response
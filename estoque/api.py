@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import json
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition, require_POST, require_safe
+
+from .filiais import anotar_saldo, filial_pedida
+from .forms import FiltroMovimentacaoForm, filtrar_movimentacoes
+from .models import MATRIZ, AlertaEstoque, Equipamento, EstoqueTecnico, Movimentacao
+from .signals import versao_estoque
+from .sincronizacao import sincronizar
+
+# ==============================================================================
+# API JSON (Somente leitura: app de campo e BI)
+# ==============================================================================
+#   /api/equipamentos/     ?tipo=FIBRA  ?baixo=1  ?filial=2 (quantidade/baixo daquela filial)
+#   /api/carteiras/        ?tecnico=natan  ?equipamento=12  ?pendentes=1
+#   /api/movimentacoes/    ?inicio= ?fim= ?tecnico= ?tipo= ?filial=  (mesmos filtros do relatório)
+#   /api/alertas/          ?tipo=ENTROU|SAIU  ?equipamento=12  (itens que cruzaram o mínimo)
+#
+# Em todas:
+#   ?campos=id,nome,quantidade   só as colunas pedidas
+#   ?limite=100                  itens por página (máximo LIMITE_MAXIMO)
+#   ?cursor=...                  valor de "proximo" da página anterior (continua pelo id,
+#                                sem OFFSET: a página 500 custa o mesmo que a primeira)
+#
+# Quem consulta a cada poucos segundos manda If-None-Match com o ETag recebido:
+# enquanto o estoque não mudar, a resposta é um 304 sem tocar no banco. Sem o
+# If-None-Match, a mesma consulta sai do cache (CACHE_SEGUNDOS) e não do SQLite.
+LIMITE_PADRAO = 100
+LIMITE_MAXIMO = 1000
+CACHE_SEGUNDOS = 60
+
+# Nome na API -> caminho no ORM (os nomes de técnico/item vêm no mesmo SELECT)
+CAMPOS_EQUIPAMENTO = {
+    'id': 'id', 'nome': 'nome', 'tipo': 'tipo', 'quantidade': 'quantidade', 'minimo': 'minimo',
+    'estoque_baixo': 'estoque_baixo', 'especificacoes': 'especificacoes', 'observacao': 'observacao',
+}
+CAMPOS_CARTEIRA = {
+    'id': 'id', 'tecnico': 'tecnico__username', 'equipamento': 'equipamento_id',
+    'equipamento_nome': 'equipamento__nome', 'quantidade': 'quantidade',
+}
+CAMPOS_MOVIMENTACAO = {
+    'id': 'id', 'data': 'data', 'tipo': 'tipo', 'quantidade': 'quantidade', 'tecnico': 'tecnico__username',
+    'equipamento': 'equipamento_id', 'equipamento_nome': 'equipamento__nome', 'obs': 'obs',
+    'autor': 'autor_movimento__username', 'filial': 'filial_id',
+}
+CAMPOS_ALERTA = {
+    'id': 'id', 'data': 'data', 'tipo': 'tipo', 'equipamento': 'equipamento_id',
+    'equipamento_nome': 'equipamento__nome', 'quantidade': 'quantidade', 'minimo': 'minimo',
+}
+
+
+class ErroDaApi(Exception):
+    pass
+
+
+def _erro(mensagem, status=400):
+    return JsonResponse({'erro': mensagem}, status=status, json_dumps_params={'ensure_ascii': False})
+
+
+# --- ETag / cache: saem da versão do estoque (muda a cada alteração) ---
+def _etag_api(request):
+    consulta = '&'.join(sorted(request.GET.urlencode().split('&')))
+    return hashlib.sha1(f"{versao_estoque()}|{request.path}|{consulta}".encode()).hexdigest()
+
+
+def _ultima_alteracao(request):
+    return datetime.fromtimestamp(versao_estoque(), tz=dt_timezone.utc)
+
+
+def _api(view):
+    @condition(etag_func=_etag_api, last_modified_func=_ultima_alteracao)
+    def resposta_em_cache(request):
+        chave = f"api:{_etag_api(request)}"
+        conteudo = cache.get(chave)
+        if conteudo is not None:
+            return HttpResponse(conteudo, content_type='application/json')
+        try:
+            response = view(request)
+        except ErroDaApi as erro:
+            return _erro(str(erro))
+        cache.set(chave, response.content, CACHE_SEGUNDOS)
+        return response
+
+    @require_safe
+    @wraps(view)
+    def protegida(request):
+        # Mesma sessão do painel/admin; sem login é 401 (não redireciona para a tela de login)
+        if not request.user.is_authenticated:
+            return _erro("Faça login em /admin/login/ para usar a API.", status=401)
+        response = resposta_em_cache(request)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    return protegida
+
+
+# --- Paginação por cursor (keyset no id) e escolha de campos ---
+def _cursor_para_id(cursor):
+    if not cursor:
+        return 0
+    try:
+        return int(base64.urlsafe_b64decode(cursor.encode() + b'==').decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ErroDaApi("Cursor inválido.")
+
+
+def _id_para_cursor(ultimo_id):
+    return base64.urlsafe_b64encode(str(ultimo_id).encode()).decode().rstrip('=')
+
+
+def _listar(request, queryset, campos_disponiveis):
+    pedidos = [campo for campo in request.GET.get('campos', '').split(',') if campo] or list(campos_disponiveis)
+    desconhecidos = [campo for campo in pedidos if campo not in campos_disponiveis]
+    if desconhecidos:
+        raise ErroDaApi(f"Campos desconhecidos: {', '.join(desconhecidos)}. Use: {', '.join(campos_disponiveis)}.")
+
+    try:
+        limite = min(max(int(request.GET.get('limite', LIMITE_PADRAO)), 1), LIMITE_MAXIMO)
+    except ValueError:
+        raise ErroDaApi("'limite' precisa ser um número.")
+    apos = _cursor_para_id(request.GET.get('cursor'))
+
+    # values_list: tuplas direto do banco, sem montar objetos. Pede 1 a mais para saber se tem próxima página.
+    linhas = list(
+        queryset.filter(id__gt=apos).order_by('id')
+        .values_list('id', *[campos_disponiveis[campo] for campo in pedidos])[:limite + 1]
+    )
+    tem_mais = len(linhas) > limite
+    linhas = linhas[:limite]
+
+    return JsonResponse({
+        'resultados': [dict(zip(pedidos, linha[1:])) for linha in linhas],
+        'proximo': _id_para_cursor(linhas[-1][0]) if tem_mais else None,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+# --- Recursos ---
+@_api
+def api_equipamentos(request):
+    equipamentos = Equipamento.objects.all()
+    campos = CAMPOS_EQUIPAMENTO
+    if request.GET.get('filial'):
+        filial = filial_pedida(request.GET)
+        if filial is None:
+            raise ErroDaApi("'filial' precisa ser o id da filial.")
+        # Mesmos nomes de campo, com os números da filial
+        equipamentos = anotar_saldo(equipamentos, filial)
+        campos = {**CAMPOS_EQUIPAMENTO, 'quantidade': 'saldo', 'estoque_baixo': 'baixo'}
+    if request.GET.get('tipo'):
+        equipamentos = equipamentos.filter(tipo=request.GET['tipo'])
+    if request.GET.get('baixo') == '1':
+        equipamentos = equipamentos.filter(**{campos['estoque_baixo']: True})
+    return _listar(request, equipamentos, campos)
+
+
+@_api
+def api_carteiras(request):
+    carteiras = EstoqueTecnico.objects.all()
+    if request.GET.get('tecnico'):
+        carteiras = carteiras.filter(tecnico__username=request.GET['tecnico'])
+    if request.GET.get('equipamento'):
+        if not request.GET['equipamento'].isdigit():
+            raise ErroDaApi("'equipamento' precisa ser o id do item.")
+        carteiras = carteiras.filter(equipamento_id=request.GET['equipamento'])
+    if request.GET.get('pendentes') == '1':
+        carteiras = carteiras.filter(quantidade__gt=0)
+    return _listar(request, carteiras, CAMPOS_CARTEIRA)
+
+
+@_api
+def api_movimentacoes(request):
+    form = FiltroMovimentacaoForm(request.GET)
+    if not form.is_valid():
+        raise ErroDaApi("Filtro inválido: " + "; ".join(erro for lista in form.errors.values() for erro in lista))
+    return _listar(request, filtrar_movimentacoes(Movimentacao.objects.all(), form.filtros()), CAMPOS_MOVIMENTACAO)
+
+
+@_api
+def api_alertas(request):
+    # Com ?cursor= o app só busca os alertas novos desde a última consulta
+    alertas = AlertaEstoque.objects.all()
+    if request.GET.get('tipo'):
+        alertas = alertas.filter(tipo=request.GET['tipo'])
+    if request.GET.get('equipamento'):
+        if not request.GET['equipamento'].isdigit():
+            raise ErroDaApi("'equipamento' precisa ser o id do item.")
+        alertas = alertas.filter(equipamento_id=request.GET['equipamento'])
+    return _listar(request, alertas, CAMPOS_ALERTA)
+
+
+# ==============================================================================
+# SINCRONIZAÇÃO (POST do app de campo, ver sincronizacao.py)
+# ==============================================================================
+# Corpo JSON: {"token": <da última sincronização>, "filial": <id, opcional>, "movimentos": [...]}. Mesma sessão
+# do painel, então o app manda o cabeçalho X-CSRFToken com o cookie csrftoken.
+@require_POST
+def api_sincronizar(request):
+    if not request.user.is_authenticated:
+        return _erro("Faça login em /admin/login/ para usar a API.", status=401)
+    try:
+        corpo = json.loads(request.body)
+    except (ValueError, UnicodeDecodeError):
+        return _erro("Corpo precisa ser JSON.")
+    if not isinstance(corpo, dict):
+        return _erro("Corpo precisa ser um objeto JSON.")
+
+    try:
+        resultado = sincronizar(request.user, corpo.get('movimentos', []), corpo.get('token') or 0,
+                                corpo.get('filial') or MATRIZ)
+    except ValidationError as erro:
+        # Nada foi gravado: o celular guarda o lote e tenta de novo depois de corrigir
+        return JsonResponse({'erro': "Nenhum movimento foi lançado.", 'detalhes': erro.messages}, status=409,
+                            json_dumps_params={'ensure_ascii': False})
+    return JsonResponse(resultado, json_dumps_params={'ensure_ascii': False})
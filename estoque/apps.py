@@ -3,3 +3,14 @@ from django.apps import AppConfig
 
 class EstoqueConfig(AppConfig):
     name = 'estoque'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from .banco import configurar_sqlite
+
+        # Liga os sinais (cache do painel, etc.)
+        from . import signals  # noqa: F401
+
+        # PRAGMAs do SQLite (WAL, busy timeout...) em toda conexão nova
+        connection_created.connect(configurar_sqlite, dispatch_uid='configurar_sqlite')
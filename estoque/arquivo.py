@@ -0,0 +1,156 @@
+import gzip
+import json
+import os
+from datetime import datetime, time
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from .conciliacao import conciliar
+from .fechamentos import gerar_fechamento
+from .historico import CAMPOS_BANCO, Linha, caminho
+from .models import ArquivoMovimentacao, Movimentacao, SaldoArquivado
+from .saldos import EFEITOS, TECNICO
+from .signals import invalidar_estoque
+
+# ==============================================================================
+# ARQUIVAMENTO DO HISTÓRICO (Meses antigos saem do banco)
+# ==============================================================================
+# A tabela de movimentações só cresce: admin, busca e backup do db.sqlite3 ficam
+# mais lentos a cada ano. arquivar() tira do banco os meses inteiros mais velhos
+# que settings.ARQUIVO_MESES e grava cada um em ARQUIVO_ROOT/AAAA-MM_<ids>.ndjson.gz
+# (uma movimentação por linha, já com os nomes de técnico/item/autor).
+#
+# Ordem, tudo numa transação só:
+#   1. conciliar(): o SaldoConciliado passa a incluir as linhas que vão sair
+#   2. gerar_fechamento(): foto dos saldos, base do saldos_em dali para frente
+#   3. grava os arquivos (.parcial) e soma o lado do técnico em SaldoArquivado
+#   4. apaga as linhas com SQL direto (sem sinal por linha; os gatilhos da busca
+#      textual tiram as observações do índice) e renomeia os arquivos
+# Os saldos atuais (Equipamento.quantidade e carteiras) não mudam.
+#
+# Leitura do histórico inteiro: historico.py. O consumo diário (previsão) fica no
+# banco, já somado por dia.
+TAMANHO_PEDACO = 2000
+
+
+# Primeiro dia (fuso local) do mês que fica no banco: "meses" meses antes do mês atual
+def corte(meses=None, hoje=None):
+    meses = settings.ARQUIVO_MESES if meses is None else meses
+    hoje = hoje or timezone.localdate()
+    total = hoje.year * 12 + hoje.month - 1 - meses
+    return datetime.combine(hoje.replace(year=total // 12, month=total % 12 + 1, day=1), time.min,
+                            tzinfo=timezone.get_current_timezone())
+
+
+def _texto(linha):
+    dados = linha._asdict()
+    dados['data'] = dados['data'].isoformat()  # UTC, como vem do banco
+    return json.dumps(dados, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+class _Mes:
+    def __init__(self, mes):
+        self.mes = mes
+        self.primeira = self.ultima = None
+        self.linhas = 0
+        Path(settings.ARQUIVO_ROOT).mkdir(parents=True, exist_ok=True)
+        self.parcial = Path(settings.ARQUIVO_ROOT) / f"{mes:%Y-%m}_{timezone.now():%Y%m%d%H%M%S%f}.parcial"
+        self.saida = gzip.open(self.parcial, 'wt', encoding='utf-8', compresslevel=6)
+
+    def gravar(self, linha):
+        self.saida.write(_texto(linha))
+        if self.primeira is None:
+            self.primeira = linha.id
+        self.ultima = linha.id
+        self.linhas += 1
+
+    def fechar(self):
+        self.saida.close()
+        self.arquivo = f"{self.mes:%Y-%m}_{self.primeira}-{self.ultima}.ndjson.gz"
+
+
+# Um arquivo por mês em "meses" ({mes: _Mes}); devolve a soma do lado do técnico por carteira
+def _gravar_meses(movimentacoes, meses):
+    somas = {}
+    for valores in movimentacoes.order_by('id').values_list(*CAMPOS_BANCO).iterator(chunk_size=TAMANHO_PEDACO):
+        linha = Linha(*valores)
+        mes = timezone.localtime(linha.data).date().replace(day=1)
+        if mes not in meses:
+            meses[mes] = _Mes(mes)
+        meses[mes].gravar(linha)
+
+        efeito = EFEITOS[linha.tipo][TECNICO] * linha.quantidade
+        if efeito:
+            chave = (linha.tecnico_id, linha.equipamento_id)
+            somas[chave] = somas.get(chave, 0) + efeito
+
+    for mes in meses.values():
+        mes.fechar()
+    return somas
+
+
+def _somar_no_arquivado(somas):
+    existentes = {
+        (t, e): q for t, e, q in SaldoArquivado.objects.values_list('tecnico_id', 'equipamento_id', 'quantidade')
+    }
+    SaldoArquivado.objects.bulk_create(
+        [SaldoArquivado(tecnico_id=t, equipamento_id=e, quantidade=existentes.get((t, e), 0) + total)
+         for (t, e), total in somas.items()],
+        update_conflicts=True, unique_fields=['tecnico', 'equipamento'], update_fields=['quantidade'],
+        batch_size=500,
+    )
+
+
+def _apagar(movimentacoes):
+    # Movimentacao.delete() carregaria cada linha e dispararia os sinais (conciliação,
+    # consumo) uma vez por linha: aqui é um DELETE só, com o filtro montado pelo ORM
+    consulta, parametros = movimentacoes.values('id').query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {Movimentacao._meta.db_table} WHERE id IN ({consulta})", parametros)
+        return cursor.rowcount
+
+
+# Devolve {'movimentacoes': n, 'arquivos': [ArquivoMovimentacao], 'fechamento': Fechamento ou None}
+def arquivar(meses=None):
+    limite = corte(meses)
+    gravados = {}
+    try:
+        with transaction.atomic():
+            # Conciliação primeiro: ela escreve logo no começo, então no SQLite a
+            # transação pega a vez de escrever e ninguém lança nada no meio
+            conciliar()
+            ultima = Movimentacao.objects.filter(data__lt=limite).aggregate(ultima=Max('id'))['ultima']
+            if ultima is None:
+                return {'movimentacoes': 0, 'arquivos': [], 'fechamento': None}
+
+            fechamento = gerar_fechamento()
+            antigas = Movimentacao.objects.filter(data__lt=limite, id__lte=ultima)
+            somas = _gravar_meses(antigas, gravados)
+            _somar_no_arquivado(somas)
+
+            agora = timezone.now()
+            arquivos = ArquivoMovimentacao.objects.bulk_create([
+                ArquivoMovimentacao(
+                    mes=mes.mes, arquivo=mes.arquivo, primeira_movimentacao=mes.primeira,
+                    ultima_movimentacao=mes.ultima, linhas=mes.linhas, data=agora, fechamento=fechamento,
+                )
+                for mes in gravados.values()
+            ])
+            apagadas = _apagar(antigas)
+
+            # Por último, ainda dentro da transação: se o COMMIT falhar, sobra um
+            # arquivo a mais no disco (gravado de novo na próxima vez), nunca o contrário
+            for mes, arquivo in zip(gravados.values(), arquivos):
+                os.replace(mes.parcial, caminho(arquivo))
+            transaction.on_commit(invalidar_estoque)
+    except BaseException:
+        for mes in gravados.values():
+            mes.saida.close()
+            mes.parcial.unlink(missing_ok=True)
+        raise
+
+    return {'movimentacoes': apagadas, 'arquivos': arquivos, 'fechamento': fechamento}
@@ -0,0 +1,114 @@
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+
+from .models import Equipamento
+from .signals import versao_catalogo, versao_estoque
+
+# ==============================================================================
+# AUTOCOMPLETAR DE ITENS (Índice de prefixos em memória, por processo)
+# ==============================================================================
+# A cada letra digitada no lote, a busca vai numa lista ordenada em memória
+# (bisect), sem consulta no banco. Acha pelo começo de qualquer palavra do nome,
+# sem acento e sem maiúscula: "hua" acha "ONU Huawei".
+#
+# Quando o índice é refeito:
+#   - cadastro mudou (versao_catalogo: Equipamento salvo/apagado ou importação)
+#   - passou TTL_SEGUNDOS (garante que nada fica velho para sempre)
+# Só o estoque mudou (versao_estoque)? Recarrega só as quantidades (1 SELECT de id+quantidade).
+# As versões ficam no cache do Django, então vale para todos os processos do servidor.
+TTL_SEGUNDOS = 300
+MAX_CONSULTAS = 512     # respostas guardadas (as menos usadas saem primeiro)
+MAX_RESULTADOS = 200    # mais que isso o usuário digita mais uma letra
+POR_PAGINA = 20
+
+
+def normalizar(texto):
+    texto = unicodedata.normalize('NFKD', texto)
+    texto = ''.join(letra for letra in texto if not unicodedata.combining(letra))
+    return ' '.join(texto.casefold().split())
+
+
+class IndicePrefixo:
+    def __init__(self, ttl=TTL_SEGUNDOS, max_consultas=MAX_CONSULTAS):
+        self.ttl = ttl
+        self.max_consultas = max_consultas
+        self._trava = threading.Lock()
+        self._criado = None
+        self._catalogo = self._estoque = None
+        # (chaves ordenadas, id de cada chave, ids em ordem de nome, {id: (nome, tipo)}, respostas guardadas):
+        # trocado inteiro de uma vez, quem está buscando nunca vê metade velha e metade nova
+        self._indice = ([], [], [], {}, OrderedDict())
+        self._quantidades = {}
+
+    def _montar(self):
+        itens = {pk: (nome, tipo) for pk, nome, tipo in Equipamento.objects.values_list('id', 'nome', 'tipo')}
+        normalizados = {pk: normalizar(nome) for pk, (nome, _) in itens.items()}
+        entradas = []
+        for pk, chave in normalizados.items():
+            # Uma entrada para cada palavra: "onu huawei" e "huawei"
+            entradas.extend((chave[inicio.start():], pk) for inicio in re.finditer(r'\w+', chave))
+        entradas.sort()
+        por_nome = sorted(itens, key=lambda pk: (normalizados[pk], pk))
+        self._indice = ([chave for chave, _ in entradas], [pk for _, pk in entradas], por_nome, itens, OrderedDict())
+
+    def _carregar_quantidades(self):
+        self._quantidades = dict(Equipamento.objects.values_list('id', 'quantidade'))
+
+    def _atualizar(self):
+        catalogo, estoque = versao_catalogo(), versao_estoque()
+        vencido = self._criado is None or time.monotonic() - self._criado > self.ttl
+        if not vencido and catalogo == self._catalogo and estoque == self._estoque:
+            return
+        with self._trava:
+            vencido = self._criado is None or time.monotonic() - self._criado > self.ttl
+            if vencido or catalogo != self._catalogo:
+                # Versões lidas ANTES do banco: se algo mudar no meio, a próxima busca refaz
+                self._montar()
+                self._carregar_quantidades()
+                self._catalogo, self._estoque, self._criado = catalogo, estoque, time.monotonic()
+            elif estoque != self._estoque:
+                self._carregar_quantidades()
+                self._estoque = estoque
+
+    def _ids(self, indice, termo):
+        chaves, ids_das_chaves, por_nome, _, consultas = indice
+        if not termo:
+            return por_nome[:MAX_RESULTADOS]
+        with self._trava:
+            if termo in consultas:
+                consultas.move_to_end(termo)
+                return consultas[termo]
+
+        ids, vistos = [], set()
+        posicao = bisect_left(chaves, termo)
+        while posicao < len(chaves) and chaves[posicao].startswith(termo) and len(ids) < MAX_RESULTADOS:
+            pk = ids_das_chaves[posicao]
+            if pk not in vistos:
+                vistos.add(pk)
+                ids.append(pk)
+            posicao += 1
+
+        with self._trava:
+            consultas[termo] = ids
+            if len(consultas) > self.max_consultas:
+                consultas.popitem(last=False)
+        return ids
+
+    # Devolve ([(id, nome, tipo, quantidade)], tem_mais)
+    def buscar(self, termo, pagina=1):
+        self._atualizar()
+        indice, quantidades = self._indice, self._quantidades
+        ids = self._ids(indice, normalizar(termo))
+        inicio = (pagina - 1) * POR_PAGINA
+        itens = indice[3]
+        return (
+            [(pk, *itens[pk], quantidades.get(pk, 0)) for pk in ids[inicio:inicio + POR_PAGINA]],
+            len(ids) > inicio + POR_PAGINA,
+        )
+
+
+indice = IndicePrefixo()
@@ -0,0 +1,214 @@
+from django.conf import settings
+
+# ==============================================================================
+# AJUSTES DO SQLITE (Aplicados em cada conexão nova)
+# ==============================================================================
+# Os PRAGMAs vêm de settings.SQLITE_PRAGMAS (vazio no desenvolvimento, ajustado
+# no perfil de produção). Ligado no EstoqueConfig.ready via connection_created.
+
+
+def aplicar_pragmas(cursor, pragmas):
+    for nome, valor in pragmas.items():
+        cursor.execute(f"PRAGMA {nome} = {valor}")
+
+
+def configurar_sqlite(sender, connection, **kwargs):
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', None)
+    if connection.vendor != 'sqlite' or not pragmas:
+        return
+    with connection.cursor() as cursor:
+        aplicar_pragmas(cursor, pragmas)
+
+
+# ==============================================================================
+# GATILHO DOS ALERTAS DE ESTOQUE BAIXO
+# ==============================================================================
+# Grava um AlertaEstoque quando Equipamento.estoque_baixo (coluna calculada) muda.
+# Fica no banco porque o motor de saldos atualiza o estoque com SQL direto, sem
+# passar por save/sinal. Atenção: no SQLite, migração que recria a tabela de
+# Equipamento apaga o gatilho; rode criar_gatilho_alertas de novo no fim dela.
+GATILHO_ALERTAS = {
+    'sqlite': [
+        "DROP TRIGGER IF EXISTS estoque_alerta_baixo",
+        """
+        CREATE TRIGGER estoque_alerta_baixo
+        AFTER UPDATE OF quantidade, minimo ON estoque_equipamento
+        WHEN OLD.estoque_baixo IS NOT NEW.estoque_baixo
+        BEGIN
+            INSERT INTO estoque_alertaestoque (equipamento_id, tipo, quantidade, minimo, data)
+            VALUES (NEW.id, CASE WHEN NEW.estoque_baixo THEN 'ENTROU' ELSE 'SAIU' END,
+                    NEW.quantidade, NEW.minimo, strftime('%Y-%m-%d %H:%M:%f', 'now'));
+        END
+        """,
+    ],
+    'postgresql': [
+        """
+        CREATE OR REPLACE FUNCTION estoque_alerta_baixo() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO estoque_alertaestoque (equipamento_id, tipo, quantidade, minimo, data)
+            VALUES (NEW.id, CASE WHEN NEW.estoque_baixo THEN 'ENTROU' ELSE 'SAIU' END,
+                    NEW.quantidade, NEW.minimo, now());
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS estoque_alerta_baixo ON estoque_equipamento",
+        """
+        CREATE TRIGGER estoque_alerta_baixo
+        AFTER UPDATE OF quantidade, minimo ON estoque_equipamento
+        FOR EACH ROW WHEN (OLD.estoque_baixo IS DISTINCT FROM NEW.estoque_baixo)
+        EXECUTE FUNCTION estoque_alerta_baixo()
+        """,
+    ],
+}
+REMOVER_GATILHO_ALERTAS = {
+    'sqlite': ["DROP TRIGGER IF EXISTS estoque_alerta_baixo"],
+    'postgresql': [
+        "DROP TRIGGER IF EXISTS estoque_alerta_baixo ON estoque_equipamento",
+        "DROP FUNCTION IF EXISTS estoque_alerta_baixo()",
+    ],
+}
+
+
+def _executar(schema_editor, comandos):
+    for sql in comandos.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql, params=None)
+
+
+def criar_gatilho_alertas(apps, schema_editor):
+    _executar(schema_editor, GATILHO_ALERTAS)
+
+
+def remover_gatilho_alertas(apps, schema_editor):
+    _executar(schema_editor, REMOVER_GATILHO_ALERTAS)
+
+
+# ==============================================================================
+# TOTAL DA EMPRESA (Equipamento.quantidade = soma do EstoqueFilial)
+# ==============================================================================
+# O motor de saldos mexe no EstoqueFilial (estoque de cada filial, SQL direto e
+# UPDATE agrupado); o gatilho leva a diferença para o total do item na mesma
+# instrução. Assim o gatilho de alertas acima continua valendo para a empresa toda.
+# Sem gatilho de INSERT: a linha nasce zerada (motor de saldos) ou copiando um
+# total que o item já tem (cadastro com quantidade, ver signals.py, e a migração 0017).
+# Nem de DELETE: a linha só some junto com o item (a filial é PROTECT), e mexer no
+# total de um item que está sendo apagado geraria alerta para item que não existe.
+GATILHO_TOTAL_FILIAIS = {
+    'sqlite': [
+        "DROP TRIGGER IF EXISTS estoque_filial_total",
+        """
+        CREATE TRIGGER estoque_filial_total
+        AFTER UPDATE OF quantidade ON estoque_estoquefilial
+        WHEN OLD.quantidade <> NEW.quantidade
+        BEGIN
+            UPDATE estoque_equipamento SET quantidade = quantidade + NEW.quantidade - OLD.quantidade
+            WHERE id = NEW.equipamento_id;
+        END
+        """,
+    ],
+    'postgresql': [
+        """
+        CREATE OR REPLACE FUNCTION estoque_filial_total() RETURNS trigger AS $$
+        BEGIN
+            UPDATE estoque_equipamento SET quantidade = quantidade + NEW.quantidade - OLD.quantidade
+            WHERE id = NEW.equipamento_id;
+            RETURN NULL;
+        END $$ LANGUAGE plpgsql
+        """,
+        "DROP TRIGGER IF EXISTS estoque_filial_total ON estoque_estoquefilial",
+        """
+        CREATE TRIGGER estoque_filial_total
+        AFTER UPDATE OF quantidade ON estoque_estoquefilial
+        FOR EACH ROW WHEN (OLD.quantidade IS DISTINCT FROM NEW.quantidade)
+        EXECUTE FUNCTION estoque_filial_total()
+        """,
+    ],
+}
+REMOVER_GATILHO_TOTAL_FILIAIS = {
+    'sqlite': ["DROP TRIGGER IF EXISTS estoque_filial_total"],
+    'postgresql': [
+        "DROP TRIGGER IF EXISTS estoque_filial_total ON estoque_estoquefilial",
+        "DROP FUNCTION IF EXISTS estoque_filial_total()",
+    ],
+}
+
+
+def criar_gatilho_total_filiais(apps, schema_editor):
+    _executar(schema_editor, GATILHO_TOTAL_FILIAIS)
+
+
+def remover_gatilho_total_filiais(apps, schema_editor):
+    _executar(schema_editor, REMOVER_GATILHO_TOTAL_FILIAIS)
+
+
+# ==============================================================================
+# BUSCA TEXTUAL (Índices FTS5 do SQLite, usados por busca.py)
+# ==============================================================================
+# Tabelas de "conteúdo externo": o FTS guarda só o índice das palavras e lê o texto
+# da própria tabela. Os gatilhos mantêm o índice em dia em qualquer INSERT/UPDATE/
+# DELETE (admin, lote, importação). O UPDATE só dispara quando muda o texto: mexer
+# na quantidade não toca no índice. Mesmo aviso do gatilho de alertas: migração
+# que recria a tabela de Equipamento/Movimentacao apaga os gatilhos; rode
+# criar_busca_textual de novo no fim dela.
+# Sem acento e sem maiúscula: "botao" acha "Botão"
+TOKENIZADOR_FTS = "unicode61 remove_diacritics 2"
+INDICES_FTS = {
+    # tabela: colunas com texto
+    'estoque_equipamento': ('nome', 'especificacoes', 'observacao'),
+    'estoque_movimentacao': ('obs',),
+}
+
+
+def _sql_busca_textual(tabela, colunas):
+    fts = f"{tabela}_fts"
+    lista = ', '.join(colunas)
+    novos = ', '.join(f"NEW.{coluna}" for coluna in colunas)
+    antigos = ', '.join(f"OLD.{coluna}" for coluna in colunas)
+    # Linha sem texto nenhum (movimentação sem OBS, a maioria) nem entra no índice
+    tem_novo = ' OR '.join(f"NEW.{coluna} IS NOT NULL" for coluna in colunas)
+    tem_antigo = ' OR '.join(f"OLD.{coluna} IS NOT NULL" for coluna in colunas)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({lista}, content='{tabela}', content_rowid='id', "
+        f"tokenize='{TOKENIZADOR_FTS}')",
+        f"DROP TRIGGER IF EXISTS {fts}_ai",
+        f"DROP TRIGGER IF EXISTS {fts}_ad",
+        f"DROP TRIGGER IF EXISTS {fts}_au",
+        f"""CREATE TRIGGER {fts}_ai AFTER INSERT ON {tabela} WHEN {tem_novo} BEGIN
+            INSERT INTO {fts}(rowid, {lista}) VALUES (NEW.id, {novos});
+        END""",
+        f"""CREATE TRIGGER {fts}_ad AFTER DELETE ON {tabela} WHEN {tem_antigo} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {lista}) VALUES ('delete', OLD.id, {antigos});
+        END""",
+        f"""CREATE TRIGGER {fts}_au AFTER UPDATE OF {lista} ON {tabela} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {lista}) SELECT 'delete', OLD.id, {antigos} WHERE {tem_antigo};
+            INSERT INTO {fts}(rowid, {lista}) SELECT NEW.id, {novos} WHERE {tem_novo};
+        END""",
+        # O que já está na tabela (só as linhas com texto, igual aos gatilhos)
+        f"INSERT INTO {fts}({fts}) VALUES ('delete-all')",
+        f"INSERT INTO {fts}(rowid, {lista}) SELECT id, {lista} FROM {tabela} WHERE {tem_novo.replace('NEW.', '')}",
+    ]
+
+
+def fts5_disponivel(conexao):
+    if conexao.vendor != 'sqlite':
+        return False
+    with conexao.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any(opcao == 'ENABLE_FTS5' for opcao, in cursor.fetchall())
+
+
+def criar_busca_textual(apps, schema_editor):
+    # Outros bancos (ou SQLite sem FTS5) continuam com a busca LIKE de sempre
+    if not fts5_disponivel(schema_editor.connection):
+        return
+    for tabela, colunas in INDICES_FTS.items():
+        for sql in _sql_busca_textual(tabela, colunas):
+            schema_editor.execute(sql, params=None)
+
+
+def remover_busca_textual(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for tabela in INDICES_FTS:
+        for sufixo in ('ai', 'ad', 'au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {tabela}_fts_{sufixo}", params=None)
+        schema_editor.execute(f"DROP TABLE IF EXISTS {tabela}_fts", params=None)
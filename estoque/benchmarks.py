@@ -0,0 +1,477 @@
+import gc
+import os
+from contextlib import nullcontext
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .desempenho import TOLERANCIA_PADRAO, comparar, gravar, ler, resumir, rodada
+from .filiais import saldos_iniciais
+from .models import MATRIZ, Equipamento, EstoqueFilial, ItemOrdem, Movimentacao, OrdemMovimentacao
+
+# ==============================================================================
+# BENCHMARKS (Não rodam no "manage.py test" normal)
+# ==============================================================================
+# Rodar com:  python manage.py test estoque.benchmarks
+# Usa o banco de teste descartável, então pode rodar sem medo no servidor.
+
+
+def medir(funcao):
+    with CaptureQueriesContext(connection) as ctx:
+        inicio = time.perf_counter()
+        funcao()
+        ms = (time.perf_counter() - inicio) * 1000
+    return len(ctx.captured_queries), ms
+
+
+class LoteBenchmark(TestCase):
+    TAMANHOS = (5, 60, 200)
+
+    def setUp(self):
+        self.tecnico = User.objects.create(username='natan')
+        self.secretaria = User.objects.create(username='secretaria')
+
+    def criar_lote(self, n_itens):
+        ordem = OrdemMovimentacao.objects.create(tecnico=self.tecnico, tipo='SAIDA')
+        equipamentos = Equipamento.objects.bulk_create(
+            Equipamento(nome=f'Item {ordem.pk}-{i}', tipo='FIBRA', quantidade=1000) for i in range(n_itens)
+        )
+        saldos_iniciais(equipamentos)
+        ItemOrdem.objects.bulk_create(ItemOrdem(ordem=ordem, equipamento=e, quantidade=1) for e in equipamentos)
+        return ordem
+
+    def item_por_item(self, ordem):
+        # Caminho antigo: valida e grava uma movimentação por vez
+        for item in ordem.itemordem_set.select_related('equipamento'):
+            mov = Movimentacao(tecnico=ordem.tecnico, equipamento=item.equipamento, tipo=ordem.tipo,
+                               quantidade=item.quantidade, autor_movimento=self.secretaria)
+            mov.clean()
+            mov.save()
+
+    def test_lote(self):
+        print("\n\nLançamento em lote (SAIDA)")
+        print(f"{'itens':>6} | {'item a item':>22} | {'lote':>22}")
+        for n_itens in self.TAMANHOS:
+            ordem = self.criar_lote(n_itens)
+            antigo = medir(lambda: self.item_por_item(ordem))
+            ordem = self.criar_lote(n_itens)
+            novo = medir(lambda: ordem.lancar(autor=self.secretaria))
+            print(f"{n_itens:>6} | {antigo[0]:>5} consultas {antigo[1]:>7.1f} ms | "
+                  f"{novo[0]:>5} consultas {novo[1]:>7.1f} ms")
+
+
+class ConciliacaoBenchmark(TestCase):
+    MOVIMENTACOES = 1_000_000
+    TECNICOS = 50
+    ITENS = 400
+
+    def setUp(self):
+        self.tecnicos = User.objects.bulk_create(User(username=f'tecnico{i}') for i in range(self.TECNICOS))
+        self.itens = Equipamento.objects.bulk_create(
+            Equipamento(nome=f'Item {i}', tipo='FIBRA', quantidade=0) for i in range(self.ITENS)
+        )
+
+    def gerar_historico(self, quantas):
+        # Gerado direto no SQLite (CTE recursiva): bulk_create de 1 milhão levaria minutos
+        tecnico, item = self.tecnicos[0].pk, self.itens[0].pk
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {quantas})
+                INSERT INTO estoque_movimentacao (tecnico_id, equipamento_id, tipo, quantidade, obs, data)
+                SELECT {tecnico} + i % {self.TECNICOS}, {item} + i % {self.ITENS},
+                       CASE i % 3 WHEN 0 THEN 'SAIDA' WHEN 1 THEN 'SAIDA' ELSE 'DEVOLUCAO' END,
+                       1, NULL, datetime('now') FROM n
+            """)
+
+    def test_conciliacao(self):
+        from .conciliacao import conciliar
+
+        inicio = time.perf_counter()
+        self.gerar_historico(self.MOVIMENTACOES)
+        print(f"\n\nHistórico de {self.MOVIMENTACOES} movimentações gerado em {time.perf_counter() - inicio:.1f} s")
+
+        consultas, ms = medir(conciliar)
+        print(f"Conciliação completa:    {consultas:>4} consultas {ms:>9.1f} ms")
+
+        self.gerar_historico(1000)
+        consultas, ms = medir(conciliar)
+        print(f"Incremental (+1000):     {consultas:>4} consultas {ms:>9.1f} ms")
+
+        consultas, ms = medir(lambda: conciliar(reparar=True))
+        print(f"Incremental + reparar:   {consultas:>4} consultas {ms:>9.1f} ms")
+
+
+class BuscaTextualBenchmark(TestCase):
+    MOVIMENTACOES = 1_000_000
+    REPETICOES = 5
+
+    def setUp(self):
+        self.tecnico = User.objects.create(username='natan')
+        self.itens = Equipamento.objects.bulk_create(
+            Equipamento(nome=f'Item {i}', tipo='FIBRA', quantidade=0, especificacoes=f'Modelo {i} GPON')
+            for i in range(400)
+        )
+
+    def gerar_historico(self):
+        # OBS diferente em cada linha ("OS 1", "OS 2"...): o pior caso para o LIKE.
+        # Os gatilhos do FTS rodam em cada INSERT, então o tempo aqui inclui manter o índice.
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < {self.MOVIMENTACOES})
+                INSERT INTO estoque_movimentacao (tecnico_id, equipamento_id, tipo, quantidade, obs, data)
+                SELECT {self.tecnico.pk}, {self.itens[0].pk} + i % 400, 'SAIDA', 1,
+                       'OS ' || i || ' - Cliente ' || (i % 997), datetime('now') FROM n
+            """)
+
+    def test_fts_contra_like(self):
+        from unittest import mock
+        from . import busca
+
+        inicio = time.perf_counter()
+        self.gerar_historico()
+        print(f"\n\nHistórico de {self.MOVIMENTACOES} movimentações (com índice FTS) gerado em "
+              f"{time.perf_counter() - inicio:.1f} s")
+
+        # Igual à primeira página da lista do admin: mais recentes primeiro, 100 por página
+        def buscar(termo):
+            movimentacoes = busca.buscar_movimentacoes(Movimentacao.objects.order_by('-data'), termo)
+            return lambda: list(movimentacoes.values_list('id')[:100])
+
+        print(f"{'Busca':<22}{'LIKE (ms)':>12}{'FTS5 (ms)':>12}")
+        for termo in ('OS 104037', 'cliente 996', 'inexistente'):
+            with mock.patch.object(busca, 'busca_textual_ativa', return_value=False):
+                like = min(medir(buscar(termo))[1] for _ in range(self.REPETICOES))
+            fts = min(medir(buscar(termo))[1] for _ in range(self.REPETICOES))
+            print(f"{termo:<22}{like:>12.1f}{fts:>12.1f}")
+
+
+class AutocompletarBenchmark(TestCase):
+    ITENS = 20_000
+    BUSCAS = 2000
+    MARCAS = ('Huawei', 'ZTE', 'Nokia', 'Intelbras', 'Ubiquiti', 'Mikrotik', 'TP-Link', 'Furukawa')
+    PRODUTOS = ('ONU', 'Roteador', 'Conector', 'Cabo Drop', 'Splitter', 'Antena', 'Rádio', 'Caixa CTO')
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+        Equipamento.objects.bulk_create(
+            Equipamento(nome=f'{self.PRODUTOS[i % 8]} {self.MARCAS[i // 8 % 8]} {i}', tipo='FIBRA', quantidade=i % 50)
+            for i in range(self.ITENS)
+        )
+        self.client.force_login(User.objects.create_superuser(username='gestor', password='x'))
+
+    def percentis(self, tempos):
+        tempos = sorted(tempos)
+        return tempos[len(tempos) // 2], tempos[int(len(tempos) * 0.99)]
+
+    def test_latencia(self):
+        import random
+        from .autocompletar import IndicePrefixo
+
+        indice = IndicePrefixo()
+        inicio = time.perf_counter()
+        indice.buscar('')
+        print(f"\n\nÍndice de {self.ITENS} itens montado em {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+        # Como a secretária digita: "r", "ro", "rot"... em palavras variadas
+        sorteio = random.Random(1)
+        palavras = [p.lower() for p in self.PRODUTOS + self.MARCAS] + [str(n) for n in range(100, 999, 7)]
+        termos = []
+        while len(termos) < self.BUSCAS:
+            palavra = sorteio.choice(palavras)
+            termos.extend(palavra[:n] for n in range(1, len(palavra) + 1))
+
+        tempos = []
+        for termo in termos[:self.BUSCAS]:
+            comeco = time.perf_counter()
+            indice.buscar(termo)
+            tempos.append((time.perf_counter() - comeco) * 1000)
+        p50, p99 = self.percentis(tempos)
+        print(f"Índice (função):     p50 {p50:6.3f} ms   p99 {p99:6.3f} ms")
+
+        url = '/admin/estoque/equipamento/autocompletar/'
+        self.client.get(url, {'term': 'onu'})
+        tempos = []
+        for termo in termos[:self.BUSCAS // 4]:
+            comeco = time.perf_counter()
+            self.client.get(url, {'term': termo})
+            tempos.append((time.perf_counter() - comeco) * 1000)
+        p50, p99 = self.percentis(tempos)
+        print(f"Endpoint (admin):    p50 {p50:6.3f} ms   p99 {p99:6.3f} ms")
+
+        tempos = []
+        for termo in termos[:self.BUSCAS // 4]:
+            comeco = time.perf_counter()
+            self.client.get('/admin/autocomplete/', {'term': termo, 'app_label': 'estoque',
+                                                     'model_name': 'itemordem', 'field_name': 'equipamento'})
+            tempos.append((time.perf_counter() - comeco) * 1000)
+        p50, p99 = self.percentis(tempos)
+        print(f"Autocomplete padrão: p50 {p50:6.3f} ms   p99 {p99:6.3f} ms")
+
+
+class MetricasBenchmark(TestCase):
+    CONSULTAS = 20_000
+    REQUISICOES = 300
+
+    def setUp(self):
+        Equipamento.objects.bulk_create(
+            Equipamento(nome=f'Item {i}', tipo='FIBRA', quantidade=i % 50) for i in range(200)
+        )
+        self.client.force_login(User.objects.create_superuser(username='gestor', password='x'))
+
+    def consultas(self):
+        inicio = time.perf_counter()
+        with connection.cursor() as cursor:
+            for i in range(self.CONSULTAS):
+                cursor.execute("SELECT quantidade FROM estoque_equipamento WHERE id = %s", [i % 200 + 1])
+                cursor.fetchone()
+        return (time.perf_counter() - inicio) * 1000
+
+    def mediana(self, url):
+        tempos = []
+        for _ in range(self.REQUISICOES):
+            comeco = time.perf_counter()
+            self.client.get(url)
+            tempos.append((time.perf_counter() - comeco) * 1000)
+        return sorted(tempos)[len(tempos) // 2]
+
+    def test_custo_do_middleware(self):
+        from django.test import modify_settings
+
+        from .metricas import ContadorSql
+
+        sem = min(self.consultas() for _ in range(3))
+        with connection.execute_wrapper(ContadorSql()):
+            com = min(self.consultas() for _ in range(3))
+        print(f"\n\nPor consulta: {sem * 1000 / self.CONSULTAS:.2f} µs sem contador, "
+              f"{com * 1000 / self.CONSULTAS:.2f} µs com contador")
+
+        print(f"{'página':<30}{'sem (ms)':>10}{'com (ms)':>10}")
+        for url in ('/', '/admin/estoque/equipamento/', '/api/equipamentos/'):
+            self.mediana(url)  # aquece
+            with modify_settings(MIDDLEWARE={'remove': 'estoque.metricas.MetricasMiddleware'}):
+                sem = self.mediana(url)
+            com = self.mediana(url)
+            print(f"{url:<30}{sem:>10.2f}{com:>10.2f}")
+
+
+class PainelAoVivoBenchmark(TestCase):
+    CONEXOES = (100, 500)
+
+    def setUp(self):
+        self.gestor = User.objects.create_user(username='gestor', password='x')
+        self.natan = User.objects.create(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=1_000_000)
+
+    def lancar(self):
+        from .saldos import lancar_movimentos
+        with self.captureOnCommitCallbacks(execute=True):
+            lancar_movimentos([Movimentacao(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=1)])
+
+    async def test_conexoes_paradas(self):
+        import asyncio
+        import threading
+
+        from asgiref.sync import sync_to_async
+
+        from .ao_vivo import canal
+
+        await self.async_client.aforce_login(self.gestor)
+        print(f"\n\n{'conexões':>9}{'threads':>9}{'abrir (ms)':>12}{'lançamento até o último painel (ms)':>38}")
+        for total in self.CONEXOES:
+            inicio = time.perf_counter()
+            transmissoes = []
+            for _ in range(total):
+                response = await self.async_client.get('/eventos/estoque/')
+                eventos = aiter(response.streaming_content)
+                await anext(eventos)  # retry
+                await anext(eventos)  # versao
+                transmissoes.append(eventos)
+            abrir = (time.perf_counter() - inicio) * 1000
+            threads = threading.active_count()
+
+            esperando = [asyncio.ensure_future(anext(eventos)) for eventos in transmissoes]
+            await asyncio.sleep(0)
+            inicio = time.perf_counter()
+            await sync_to_async(self.lancar)()
+            await asyncio.gather(*esperando)
+            entrega = (time.perf_counter() - inicio) * 1000
+            print(f"{len(canal):>9}{threads:>9}{abrir:>12.0f}{entrega:>38.1f}")
+
+            # Fecha todas (como o servidor faz quando o navegador sai)
+            esperando = [asyncio.ensure_future(anext(eventos)) for eventos in transmissoes]
+            await asyncio.sleep(0)
+            for tarefa in esperando:
+                tarefa.cancel()
+            await asyncio.gather(*esperando, return_exceptions=True)
+
+
+# ==============================================================================
+# SUÍTE DE DESEMPENHO (Dados sintéticos + linha de base em JSON)
+# ==============================================================================
+# Rodar com:  python manage.py test estoque.benchmarks.SuiteBenchmark
+# Gera o estoque sintético (sinteticos.py, sempre a mesma semente), mede cada cenário
+# REPETICOES vezes e compara com a linha de base (desempenho.py). Piorou: o teste falha.
+#
+# Variáveis de ambiente:
+#   ESTOQUE_BENCH_MOVIMENTACOES=200000  tamanho do histórico
+#   ESTOQUE_BENCH_BASE=arquivo.json     linha de base (padrão: benchmarks_base.json na raiz)
+#   ESTOQUE_BENCH_GRAVAR=1              grava esta rodada como a nova linha de base
+#   ESTOQUE_BENCH_TOLERANCIA=0.25       quanto o p50 pode piorar
+# Sem linha de base ainda, a primeira rodada vira a linha de base. A linha de base vale
+# para a máquina onde foi gravada: compare sempre na mesma máquina.
+class SuiteBenchmark(TestCase):
+    REPETICOES = 30
+    ITENS_DO_LOTE = 60
+    # Medidos com o cache da produção (ESTOQUE_PERFIL=producao: FileBasedCache numa pasta)
+    CACHE_EM_ARQUIVO = ('painel_em_cache_arquivo',)
+
+    @classmethod
+    def setUpTestData(cls):
+        from .sinteticos import PREFIXO_TECNICO, gerar
+
+        cls.escala = {'itens': 2000, 'tecnicos': 200, 'semente': 42,
+                      'movimentacoes': int(os.environ.get('ESTOQUE_BENCH_MOVIMENTACOES', 200_000))}
+        inicio = time.perf_counter()
+        gerar(**cls.escala)
+        print(f"\n\nDados sintéticos ({cls.escala['movimentacoes']} movimentações) em "
+              f"{time.perf_counter() - inicio:.0f} s")
+
+        cls.gestor = User.objects.create_superuser(username='gestor', password='x')
+        cls.tecnico = User.objects.filter(username__startswith=PREFIXO_TECNICO).order_by('id').first()
+        # Itens com saldo de sobra: os lançamentos medidos nunca esbarram em falta de estoque
+        cls.item = Equipamento.objects.create(nome='Item do benchmark', tipo='FIBRA', quantidade=10 ** 9)
+        cls.itens_lote = list(Equipamento.objects.order_by('id')[:cls.ITENS_DO_LOTE])
+        # Pelo saldo da Matriz: o gatilho do banco leva o total da empresa junto
+        EstoqueFilial.objects.bulk_create(
+            [EstoqueFilial(filial_id=MATRIZ, equipamento=item) for item in cls.itens_lote], ignore_conflicts=True
+        )
+        EstoqueFilial.objects.filter(filial_id=MATRIZ, equipamento__in=cls.itens_lote).update(quantidade=10 ** 9)
+
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+        self.addCleanup(cache.clear)
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        ajuste = override_settings(RELATORIO_WORKERS=0, RELATORIOS_ROOT=pasta)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        self.pasta_relatorios = pasta
+        self.pasta_cache = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta_cache)
+        self.client.force_login(self.gestor)
+
+    # --- Cenários: (preparar, executar). Só o executar é medido. ---
+    def movimentacao_avulsa(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Movimentacao(tecnico=self.tecnico, equipamento=self.item, tipo='SAIDA', quantidade=1,
+                         autor_movimento=self.gestor).save()
+
+    def nova_ordem(self):
+        self.ordem = OrdemMovimentacao.objects.create(tecnico=self.tecnico, tipo='SAIDA')
+        ItemOrdem.objects.bulk_create(ItemOrdem(ordem=self.ordem, equipamento=item, quantidade=1)
+                                      for item in self.itens_lote)
+
+    def lancar_ordem(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ordem.lancar(autor=self.gestor)
+
+    def limpar_cache(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def limpar_relatorios(self):
+        for arquivo in Path(self.pasta_relatorios).glob('*.pdf'):
+            arquivo.unlink()
+
+    def pagina(self, url, **parametros):
+        def abrir():
+            response = self.client.get(url, parametros)
+            self.assertEqual(response.status_code, 200, url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+                response.close()
+        return abrir
+
+    def cenarios(self):
+        hoje = timezone.localdate()
+        nada = lambda: None  # noqa: E731
+        return {
+            'movimentacao_avulsa': (nada, self.movimentacao_avulsa),
+            f'lote_{self.ITENS_DO_LOTE}_itens': (self.nova_ordem, self.lancar_ordem),
+            'painel': (self.limpar_cache, self.pagina('/')),
+            'painel_em_cache': (nada, self.pagina('/')),
+            'painel_em_cache_arquivo': (nada, self.pagina('/')),
+            'painel_busca': (self.limpar_cache, self.pagina('/', q='huawei')),
+            'painel_filial': (self.limpar_cache, self.pagina('/', filial=MATRIZ)),
+            'relatorio_pdf_30_dias': (self.limpar_relatorios, self.pagina(
+                '/relatorio-pdf/', inicio=(hoje - timedelta(days=30)).isoformat(), fim=hoje.isoformat())),
+            'admin_equipamentos': (nada, self.pagina('/admin/estoque/equipamento/')),
+            'admin_equipamentos_filial': (nada, self.pagina('/admin/estoque/equipamento/', filial=MATRIZ)),
+            'admin_movimentacoes': (nada, self.pagina('/admin/estoque/movimentacao/')),
+            'admin_movimentacoes_filtro': (nada, self.pagina('/admin/estoque/movimentacao/', tipo__exact='BAIXA')),
+            'admin_carteiras': (nada, self.pagina('/admin/estoque/estoquetecnico/')),
+            'admin_ordens': (nada, self.pagina('/admin/estoque/ordemmovimentacao/')),
+        }
+
+    def cache_do_cenario(self, nome):
+        if nome not in self.CACHE_EM_ARQUIVO:
+            return nullcontext()
+        return override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': self.pasta_cache,
+        }})
+
+    def medir_cenario(self, preparar, executar):
+        preparar()
+        executar()  # aquece (imports, cache de templates)
+        tempos, consultas = [], []
+        for _ in range(self.REPETICOES):
+            preparar()
+            # Coleta de lixo fora da medida (igual ao timeit): senão ela cai num cenário qualquer
+            gc.collect()
+            gc.disable()
+            try:
+                with CaptureQueriesContext(connection) as ctx:
+                    inicio = time.perf_counter()
+                    executar()
+                    tempos.append((time.perf_counter() - inicio) * 1000)
+            finally:
+                gc.enable()
+            consultas.append(len(ctx.captured_queries))
+        return resumir(tempos, consultas)
+
+    def test_suite(self):
+        caminho = os.environ.get('ESTOQUE_BENCH_BASE', str(Path(settings.BASE_DIR) / 'benchmarks_base.json'))
+        tolerancia = float(os.environ.get('ESTOQUE_BENCH_TOLERANCIA', TOLERANCIA_PADRAO))
+
+        medidas = {}
+        print(f"\n{'cenário':<30}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'consultas':>11}")
+        for nome, (preparar, executar) in self.cenarios().items():
+            with self.cache_do_cenario(nome):
+                medidas[nome] = self.medir_cenario(preparar, executar)
+            m = medidas[nome]
+            print(f"{nome:<30}{m['p50_ms']:>9.1f}{m['p95_ms']:>9.1f}{m['p99_ms']:>9.1f}{m['consultas']:>11}")
+        atual = rodada(self.escala, medidas)
+
+        base = ler(caminho)
+        if base is None or os.environ.get('ESTOQUE_BENCH_GRAVAR') == '1':
+            gravar(caminho, atual)
+            print(f"\n📌 Linha de base gravada em {caminho}")
+            return
+
+        pioras = comparar(base, atual, tolerancia)
+        if pioras:
+            self.fail("Desempenho pior que a linha de base:\n" + "\n".join(pioras))
+        print(f"\n✅ Dentro da linha de base ({base['gerado_em']}, tolerância {tolerancia:.0%})")
@@ -0,0 +1,78 @@
+import re
+from functools import cache
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .banco import fts5_disponivel
+
+# ==============================================================================
+# BUSCA TEXTUAL (Admin, busca global do topo e painel)
+# ==============================================================================
+# No SQLite com FTS5 a busca vai pelos índices de palavras criados na migração 0014
+# (ver banco.py): "OS 1040" acha a movimentação sem ler o histórico inteiro.
+# Cada palavra digitada precisa aparecer (começo de palavra, sem acento/maiúscula).
+# Nos outros bancos, a busca é o LIKE '%...%' de sempre, com as mesmas regras.
+CAMPOS_EQUIPAMENTO = ('nome', 'especificacoes', 'observacao')
+
+
+@cache
+def busca_textual_ativa():
+    return fts5_disponivel(connection)
+
+
+def _palavras(texto):
+    return re.findall(r'\w+', texto)
+
+
+def _consulta_fts(palavras, coluna=None):
+    # Cada palavra entre aspas (nada do que foi digitado vira operador do FTS) e com *
+    # para achar pelo começo: "huaw" acha "Huawei"
+    consulta = ' '.join(f'"{palavra}"*' for palavra in palavras)
+    return f"{coluna} : ({consulta})" if coluna else consulta
+
+
+def _ids_fts(tabela, consulta):
+    fts = connection.ops.quote_name(f"{tabela}_fts")
+    return RawSQL(f"SELECT rowid FROM {fts} WHERE {fts} MATCH %s", [consulta])
+
+
+def _todas_as_palavras(palavras, campos):
+    # Mesma regra sem FTS: cada palavra em algum dos campos
+    filtro = Q()
+    for palavra in palavras:
+        filtro &= Q(*[Q(**{f'{campo}__icontains': palavra}) for campo in campos], _connector=Q.OR)
+    return filtro
+
+
+def buscar_equipamentos(queryset, texto):
+    palavras = _palavras(texto)
+    if not palavras:
+        return queryset
+    if not busca_textual_ativa():
+        return queryset.filter(_todas_as_palavras(palavras, CAMPOS_EQUIPAMENTO))
+    return queryset.filter(id__in=_ids_fts('estoque_equipamento', _consulta_fts(palavras)))
+
+
+# Movimentação: pela OBS (nº da OS), pelo nome do item ou pelo usuário do técnico.
+# Cada palavra pode estar num campo diferente ("natan onu" = ONUs do natan).
+def buscar_movimentacoes(queryset, texto):
+    palavras = _palavras(texto)
+    if not palavras:
+        return queryset
+    if not busca_textual_ativa():
+        return queryset.filter(_todas_as_palavras(palavras, ('obs', 'equipamento__nome', 'tecnico__username')))
+
+    # Por palavra, três IN (...) ligados por OR: cada um usa o seu índice (FTS,
+    # item+data, técnico+data). As palavras se juntam com AND, como no LIKE.
+    filtro = Q()
+    for palavra in palavras:
+        tecnicos = User.objects.filter(username__icontains=palavra).values('id')
+        filtro &= (
+            Q(id__in=_ids_fts('estoque_movimentacao', _consulta_fts([palavra])))
+            | Q(equipamento_id__in=_ids_fts('estoque_equipamento', _consulta_fts([palavra], coluna='nome')))
+            | Q(tecnico_id__in=tecnicos)
+        )
+    return queryset.filter(filtro)
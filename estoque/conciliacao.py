@@ -0,0 +1,107 @@
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .models import Conciliacao, EstoqueTecnico, Movimentacao, SaldoArquivado, SaldoConciliado
+from .saldos import TECNICO, expressao_efeito
+from .signals import invalidar_estoque
+
+# ==============================================================================
+# CONCILIAÇÃO (Confere as carteiras contra o histórico)
+# ==============================================================================
+# Saldo esperado de cada carteira = soma do histórico daquele (técnico, item).
+# A soma fica guardada em SaldoConciliado junto com o ponto de parada, então cada
+# rodada só soma (GROUP BY no banco) as movimentações novas desde a última.
+# Se uma movimentação já somada for editada ou apagada, o sinal em signals.py
+# desliga o ponto de parada e a próxima rodada soma o histórico inteiro de novo.
+# Histórico inteiro = SaldoArquivado (meses que já saíram do banco, ver arquivo.py)
+# + as movimentações que estão no banco.
+#
+# O estoque da empresa fica de fora: ele nasce e é ajustado na mão pelo cadastro
+# do Equipamento, sem movimentação, então o histórico não diz quanto deveria ser.
+
+
+def _somar_historico(movimentacoes):
+    somas = movimentacoes.values('tecnico_id', 'equipamento_id').annotate(total=Sum(expressao_efeito(TECNICO)))
+    return {(linha['tecnico_id'], linha['equipamento_id']): linha['total'] or 0 for linha in somas}
+
+
+def _gravar_esperados(esperados, alterados, do_zero):
+    if do_zero:
+        SaldoConciliado.objects.all().delete()
+        alterados = esperados
+    SaldoConciliado.objects.bulk_create(
+        [SaldoConciliado(tecnico_id=t, equipamento_id=e, quantidade=esperados[(t, e)]) for t, e in alterados],
+        update_conflicts=True, unique_fields=['tecnico', 'equipamento'], update_fields=['quantidade'],
+        batch_size=500,
+    )
+
+
+def _reparar(divergencias):
+    # Só carteiras com saldo esperado possível (>= 0): negativo é erro no próprio histórico
+    corrigir = {(t, e): esperado for t, e, esperado, _ in divergencias if esperado >= 0}
+    if not corrigir:
+        return 0
+
+    carteiras = EstoqueTecnico.objects.filter(
+        tecnico_id__in={t for t, _ in corrigir}, equipamento_id__in={e for _, e in corrigir}
+    ).only('id', 'tecnico_id', 'equipamento_id', 'quantidade')
+    existentes = []
+    for carteira in carteiras:
+        chave = (carteira.tecnico_id, carteira.equipamento_id)
+        if chave in corrigir:
+            carteira.quantidade = corrigir.pop(chave)
+            existentes.append(carteira)
+
+    EstoqueTecnico.objects.bulk_update(existentes, ['quantidade'], batch_size=500)
+    EstoqueTecnico.objects.bulk_create(
+        [EstoqueTecnico(tecnico_id=t, equipamento_id=e, quantidade=q) for (t, e), q in corrigir.items()]
+    )
+    invalidar_estoque()
+    return len(existentes) + len(corrigir)
+
+
+# Devolve {'divergencias': [(tecnico_id, equipamento_id, esperado, atual)], 'completa': bool,
+#          'somadas_ate': id, 'reparadas': n}
+def conciliar(reparar=False):
+    agora = timezone.now()
+    with transaction.atomic():
+        # Escreve primeiro: no SQLite a transação pega a vez de escrever aqui,
+        # então ninguém lança nada no meio da conferência
+        if not Conciliacao.objects.filter(pk=1).update(data=agora):
+            Conciliacao.objects.create(pk=1, data=agora)
+        ponto = Conciliacao.objects.get(pk=1)
+
+        ultima = Movimentacao.objects.aggregate(ultima=Max('id'))['ultima'] or 0
+        do_zero = not ponto.valida
+        if do_zero:
+            esperados = {
+                (t, e): q for t, e, q in SaldoArquivado.objects.values_list('tecnico_id', 'equipamento_id', 'quantidade')
+            }
+            novas = Movimentacao.objects.filter(id__lte=ultima)
+        else:
+            esperados = {
+                (t, e): q for t, e, q in SaldoConciliado.objects.values_list('tecnico_id', 'equipamento_id', 'quantidade')
+            }
+            novas = Movimentacao.objects.filter(id__gt=ponto.ultima_movimentacao, id__lte=ultima)
+
+        delta = _somar_historico(novas)
+        for chave, total in delta.items():
+            esperados[chave] = esperados.get(chave, 0) + total
+        _gravar_esperados(esperados, delta, do_zero)
+
+        atuais = {
+            (t, e): q for t, e, q in EstoqueTecnico.objects.values_list('tecnico_id', 'equipamento_id', 'quantidade')
+        }
+        divergencias = sorted(
+            (t, e, esperados.get((t, e), 0), atuais.get((t, e), 0))
+            for t, e in esperados.keys() | atuais.keys()
+            if esperados.get((t, e), 0) != atuais.get((t, e), 0)
+        )
+        reparadas = _reparar(divergencias) if reparar else 0
+
+        ponto.ultima_movimentacao = ultima
+        ponto.valida = True
+        ponto.save(update_fields=['ultima_movimentacao', 'valida'])
+
+    return {'divergencias': divergencias, 'completa': do_zero, 'somadas_ate': ultima, 'reparadas': reparadas}
@@ -0,0 +1,95 @@
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .forms import filtrar_movimentacoes
+from .models import ConsumoDiario, Movimentacao
+
+# ==============================================================================
+# CONSUMO DIÁRIO (Mantido a cada lançamento)
+# ==============================================================================
+# somar_consumo: chamado pelo sinal movimentacoes_lancadas, dentro da mesma
+# transação do lançamento. Junta o lote por (dia, item, técnico, tipo, filial) e soma
+# numa instrução só (INSERT ... ON CONFLICT DO UPDATE), sem ler a tabela antes.
+#
+# refazer_consumo: apaga e soma de novo um período (ou tudo) direto do histórico.
+# Usado pelo comando "recalcular_consumo" e quando uma movimentação é editada/apagada.
+TAMANHO_GRUPO = 140  # 7 parâmetros por linha: cabe no limite do SQLite antigo
+TAMANHO_LOTE = 1000
+
+
+def _agrupar(movimentacoes):
+    fuso = timezone.get_current_timezone()
+    grupos = {}
+    for mov in movimentacoes:
+        chave = (timezone.localtime(mov.data, fuso).date(), mov.equipamento_id, mov.tecnico_id, mov.tipo,
+                 mov.filial_id)
+        quantidade, movimentos = grupos.get(chave, (0, 0))
+        grupos[chave] = (quantidade + mov.quantidade, movimentos + 1)
+    return grupos
+
+
+def somar_consumo(movimentacoes):
+    grupos = list(_agrupar(movimentacoes).items())
+    if not grupos:
+        return
+
+    tabela = connection.ops.quote_name(ConsumoDiario._meta.db_table)
+    for inicio in range(0, len(grupos), TAMANHO_GRUPO):
+        grupo = grupos[inicio:inicio + TAMANHO_GRUPO]
+        parametros = []
+        for (dia, equipamento_id, tecnico_id, tipo, filial_id), (quantidade, movimentos) in grupo:
+            parametros += [connection.ops.adapt_datefield_value(dia), equipamento_id, tecnico_id, tipo, filial_id,
+                           quantidade, movimentos]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {tabela} (dia, equipamento_id, tecnico_id, tipo, filial_id, quantidade, movimentos) "
+                f"VALUES {', '.join(['(%s, %s, %s, %s, %s, %s, %s)'] * len(grupo))} "
+                f"ON CONFLICT (dia, equipamento_id, tecnico_id, tipo, filial_id) DO UPDATE SET "
+                f"quantidade = {tabela}.quantidade + excluded.quantidade, "
+                f"movimentos = {tabela}.movimentos + excluded.movimentos",
+                parametros,
+            )
+
+
+# Refaz os dias de inicio a fim (datas, inclusive; None = sem limite) a partir do histórico.
+# Devolve quantas linhas de consumo foram gravadas.
+def refazer_consumo(inicio=None, fim=None, equipamento_id=None):
+    from .historico import inicio_do_banco
+
+    # Dias já arquivados não estão mais no banco: o consumo deles fica como está
+    arquivado_ate = inicio_do_banco()
+    if arquivado_ate and (inicio is None or inicio < arquivado_ate):
+        inicio = arquivado_ate
+    movimentacoes = filtrar_movimentacoes(Movimentacao.objects.all(), {'inicio': inicio, 'fim': fim})
+    consumos = ConsumoDiario.objects.all()
+    if inicio:
+        consumos = consumos.filter(dia__gte=inicio)
+    if fim:
+        consumos = consumos.filter(dia__lte=fim)
+    if equipamento_id:
+        movimentacoes = movimentacoes.filter(equipamento_id=equipamento_id)
+        consumos = consumos.filter(equipamento_id=equipamento_id)
+
+    # GROUP BY no banco (dia no fuso local, igual ao somar_consumo)
+    somas = (
+        movimentacoes.order_by().annotate(dia_local=TruncDate('data'))
+        .values('dia_local', 'equipamento_id', 'tecnico_id', 'tipo', 'filial_id')
+        .annotate(total=Sum('quantidade'), movimentos=Count('id'))
+    )
+
+    gravadas, lote = 0, []
+    with transaction.atomic():
+        consumos.delete()
+        for linha in somas.iterator(chunk_size=TAMANHO_LOTE):
+            lote.append(ConsumoDiario(
+                dia=linha['dia_local'], equipamento_id=linha['equipamento_id'], tecnico_id=linha['tecnico_id'],
+                tipo=linha['tipo'], filial_id=linha['filial_id'], quantidade=linha['total'],
+                movimentos=linha['movimentos'],
+            ))
+            if len(lote) >= TAMANHO_LOTE:
+                ConsumoDiario.objects.bulk_create(lote)
+                gravadas, lote = gravadas + len(lote), []
+        ConsumoDiario.objects.bulk_create(lote)
+    return gravadas + len(lote)
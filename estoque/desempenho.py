@@ -0,0 +1,76 @@
+import json
+import platform
+from pathlib import Path
+
+import django
+from django.utils import timezone
+
+# ==============================================================================
+# LINHA DE BASE DOS BENCHMARKS (Percentis, consultas e comparação)
+# ==============================================================================
+# Usado pela SuiteBenchmark (benchmarks.py). Cada cenário vira:
+#   {"p50_ms": 3.1, "p95_ms": 4.0, "p99_ms": 5.2, "consultas": 7, "repeticoes": 30}
+# e a rodada inteira vai para um JSON junto com a escala dos dados sintéticos.
+#
+# Piorou = p50 acima de base * (1 + tolerância) + folga (a folga evita falso
+# alarme em cenário de 1 ms, onde qualquer ruído passa de 25%), ou QUALQUER
+# consulta a mais (número de consultas não varia com a máquina).
+# p95/p99 ficam no JSON para leitura: com 30 repetições são a 2ª/1ª pior medida,
+# e um soluço da máquina já passaria da tolerância.
+TOLERANCIA_PADRAO = 0.25
+FOLGA_MS = 2.0
+
+
+def percentil(valores, fracao):
+    ordenados = sorted(valores)
+    posicao = min(int(len(ordenados) * fracao), len(ordenados) - 1)
+    return ordenados[posicao]
+
+
+def resumir(tempos_ms, consultas):
+    return {
+        'p50_ms': round(percentil(tempos_ms, 0.50), 3),
+        'p95_ms': round(percentil(tempos_ms, 0.95), 3),
+        'p99_ms': round(percentil(tempos_ms, 0.99), 3),
+        'consultas': max(consultas),
+        'repeticoes': len(tempos_ms),
+    }
+
+
+def rodada(escala, cenarios):
+    return {
+        'gerado_em': timezone.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'escala': escala,
+        'cenarios': cenarios,
+    }
+
+
+def ler(caminho):
+    caminho = Path(caminho)
+    if not caminho.exists():
+        return None
+    return json.loads(caminho.read_text(encoding='utf-8'))
+
+
+def gravar(caminho, dados):
+    Path(caminho).write_text(json.dumps(dados, indent=2, ensure_ascii=False) + '\n', encoding='utf-8')
+
+
+# Devolve a lista de pioras (texto). Vazia = passou.
+def comparar(base, atual, tolerancia=TOLERANCIA_PADRAO, folga_ms=FOLGA_MS):
+    if base['escala'] != atual['escala']:
+        return [f"Linha de base com outra escala ({base['escala']} x {atual['escala']}): grave uma nova."]
+
+    pioras = []
+    for nome, medida in atual['cenarios'].items():
+        anterior = base['cenarios'].get(nome)
+        if anterior is None:
+            continue
+        limite = anterior['p50_ms'] * (1 + tolerancia) + folga_ms
+        if medida['p50_ms'] > limite:
+            pioras.append(f"{nome}: p50 {medida['p50_ms']:.1f} ms (base {anterior['p50_ms']:.1f}, limite {limite:.1f})")
+        if medida['consultas'] > anterior['consultas']:
+            pioras.append(f"{nome}: {medida['consultas']} consultas (base {anterior['consultas']})")
+    return pioras
@@ -0,0 +1,73 @@
+import csv
+import json
+
+from django.db.models import Max
+from django.utils import timezone
+
+from .historico import linhas_por_id
+from .models import ArquivoMovimentacao, Movimentacao
+
+# ==============================================================================
+# EXPORTAÇÃO DO HISTÓRICO (CSV / NDJSON, linha a linha)
+# ==============================================================================
+# O histórico inteiro sai em pedaços de TAMANHO_PEDACO linhas (.iterator), então a
+# memória fica do mesmo tamanho com 100 ou com 1 milhão de movimentações.
+#
+# Exportação que continua de onde parou: cada exportação vai até a última
+# movimentação que existia quando começou (ultimo_id). Na próxima, passe esse
+# número em "desde" e só vêm as novas.
+#
+# Meses arquivados (arquivo.py) entram na mesma exportação, antes das linhas do
+# banco: o historico.py junta as duas partes na ordem do id.
+TAMANHO_PEDACO = 2000
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+}
+COLUNAS = (
+    'id', 'data', 'tipo', 'quantidade', 'tecnico', 'equipamento', 'equipamento_tipo', 'obs', 'autor', 'filial',
+)
+
+
+def ultimo_id():
+    # Banco vazio logo depois de arquivar tudo: o último id está no arquivo
+    return (Movimentacao.objects.aggregate(ultimo=Max('id'))['ultimo']
+            or ArquivoMovimentacao.objects.aggregate(ultimo=Max('ultima_movimentacao'))['ultimo'] or 0)
+
+
+# Linhas (tuplas na ordem de COLUNAS) de desde_id (exclusive) até ate_id (inclusive),
+# na ordem do id: quem parar no meio continua do último id que recebeu
+def linhas_do_historico(filtros, desde_id=0, ate_id=None):
+    # values_list + JOIN: nomes do técnico/item/autor no mesmo SELECT, sem montar objetos
+    fuso = timezone.get_current_timezone()
+    for linha in linhas_por_id(filtros, desde_id, ate_id, pedaco=TAMANHO_PEDACO):
+        yield (
+            linha.id, timezone.localtime(linha.data, fuso).isoformat(timespec='seconds'), linha.tipo,
+            linha.quantidade, linha.tecnico, linha.equipamento, linha.equipamento_tipo, linha.obs, linha.autor,
+            # Mês arquivado antes das filiais: é da Matriz
+            linha.filial or 'Matriz',
+        )
+
+
+class _Eco:
+    # "Arquivo" que devolve o que recebe: o csv.writer formata, a gente repassa
+    def write(self, valor):
+        return valor
+
+
+def gerar_csv(linhas):
+    escritor = csv.writer(_Eco(), delimiter=';')
+    # BOM: o Excel em português abre com os acentos certos
+    yield '\ufeff' + escritor.writerow(COLUNAS)
+    for linha in linhas:
+        yield escritor.writerow(['' if valor is None else valor for valor in linha])
+
+
+def gerar_ndjson(linhas):
+    for linha in linhas:
+        yield json.dumps(dict(zip(COLUNAS, linha)), ensure_ascii=False) + '\n'
+
+
+def exportar(formato, filtros, desde_id=0, ate_id=None):
+    gerador = gerar_csv if formato == 'csv' else gerar_ndjson
+    return gerador(linhas_do_historico(filtros, desde_id, ate_id))
@@ -0,0 +1,116 @@
+from itertools import chain
+
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from .historico import somar_arquivadas
+from .models import Equipamento, EstoqueTecnico, Fechamento, Movimentacao, SaldoFechamento
+from .saldos import EMPRESA, TECNICO, expressao_efeito
+
+# ==============================================================================
+# SALDOS NO PASSADO (Fechamento mais próximo + movimentações do meio)
+# ==============================================================================
+# saldos_em(momento) parte da foto mais perto do momento pedido:
+#   - fechamento ANTES: soma as movimentações lançadas depois da foto até o momento
+#   - fechamento DEPOIS (ou o saldo atual): desfaz as movimentações entre o momento e a foto
+# São no máximo 5 consultas, e a soma só passa pelas movimentações do intervalo
+# (índice de data), não pelo histórico inteiro.
+#
+# O estoque da empresa também muda na mão (cadastro/edição do Equipamento), e isso
+# não fica no histórico: entre duas fotos só entram as movimentações.
+#
+# Intervalo que cruza meses arquivados (arquivo.py): a parte do arquivo é somada
+# pelo historico.somar_arquivadas, abrindo só os meses do intervalo.
+
+
+def gerar_fechamento():
+    with transaction.atomic():
+        # Grava primeiro: no SQLite a transação pega a vez de escrever aqui, então
+        # ninguém lança nada enquanto a foto é tirada (saldos e "última" batem)
+        fechamento = Fechamento.objects.create(data=timezone.now())
+        fechamento.ultima_movimentacao = Movimentacao.objects.aggregate(ultima=Max('id'))['ultima'] or 0
+        fechamento.save(update_fields=['ultima_movimentacao'])
+
+        empresa = Equipamento.objects.values_list('id', 'quantidade')
+        carteiras = EstoqueTecnico.objects.exclude(quantidade=0).values_list('tecnico_id', 'equipamento_id', 'quantidade')
+        SaldoFechamento.objects.bulk_create(chain(
+            (SaldoFechamento(fechamento=fechamento, equipamento_id=e, quantidade=q) for e, q in empresa.iterator()),
+            (SaldoFechamento(fechamento=fechamento, tecnico_id=t, equipamento_id=e, quantidade=q)
+             for t, e, q in carteiras.iterator()),
+        ), batch_size=1000)
+
+    return fechamento
+
+
+def _somar_movimentacoes(movimentacoes, tecnico):
+    if tecnico is not None:
+        movimentacoes = movimentacoes.filter(tecnico=tecnico)
+    lado = EMPRESA if tecnico is None else TECNICO
+    somas = movimentacoes.values('equipamento_id').annotate(total=Sum(expressao_efeito(lado)))
+    return {linha['equipamento_id']: linha['total'] for linha in somas}
+
+
+def _fechamento_mais_perto(momento):
+    antes = Fechamento.objects.filter(data__lte=momento).order_by('-data').first()
+    depois = Fechamento.objects.filter(data__gt=momento).order_by('data').first()
+    # Sem foto depois do momento, o saldo atual faz o papel dela (None)
+    distancia_depois = (depois.data if depois else timezone.now()) - momento
+    if antes and momento - antes.data <= distancia_depois:
+        return antes, True
+    return depois, False
+
+
+def _saldos_da_foto(fechamento, tecnico, equipamentos):
+    if fechamento is None:
+        # Saldo atual
+        if tecnico is None:
+            saldos = Equipamento.objects.values_list('id', 'quantidade')
+        else:
+            saldos = EstoqueTecnico.objects.filter(tecnico=tecnico).values_list('equipamento_id', 'quantidade')
+        if equipamentos is not None:
+            saldos = saldos.filter(**{'id__in' if tecnico is None else 'equipamento_id__in': equipamentos})
+    else:
+        saldos = fechamento.saldos.filter(tecnico=tecnico).values_list('equipamento_id', 'quantidade')
+        if equipamentos is not None:
+            saldos = saldos.filter(equipamento_id__in=equipamentos)
+    return dict(saldos)
+
+
+# Saldo de cada item num momento do passado: {equipamento_id: quantidade}
+# tecnico=None -> estoque da empresa; tecnico=User -> carteira do técnico
+def saldos_em(momento, tecnico=None, equipamentos=None):
+    fechamento, para_frente = _fechamento_mais_perto(momento)
+    movimentacoes = Movimentacao.objects.all()
+    if equipamentos is not None:
+        movimentacoes = movimentacoes.filter(equipamento_id__in=equipamentos)
+
+    if fechamento is None:
+        # Saldo atual e "última movimentação" lidos juntos
+        with transaction.atomic():
+            ultima = Movimentacao.objects.aggregate(ultima=Max('id'))['ultima'] or 0
+            saldos = _saldos_da_foto(None, tecnico, equipamentos)
+    else:
+        ultima = fechamento.ultima_movimentacao
+        saldos = _saldos_da_foto(fechamento, tecnico, equipamentos)
+
+    lado = EMPRESA if tecnico is None else TECNICO
+    if para_frente:
+        delta = _somar_movimentacoes(movimentacoes.filter(id__gt=ultima, data__lte=momento), tecnico)
+        arquivado = somar_arquivadas(lado, tecnico, equipamentos, id_acima=ultima, data_ate=momento)
+        sinal = 1
+    else:
+        delta = _somar_movimentacoes(movimentacoes.filter(id__lte=ultima, data__gt=momento), tecnico)
+        arquivado = somar_arquivadas(lado, tecnico, equipamentos, id_ate=ultima, data_acima=momento)
+        sinal = -1
+
+    for equipamento_id, total in chain(delta.items(), arquivado.items()):
+        saldos[equipamento_id] = saldos.get(equipamento_id, 0) + sinal * (total or 0)
+
+    if tecnico is not None:
+        saldos = {equipamento_id: quantidade for equipamento_id, quantidade in saldos.items() if quantidade}
+    return saldos
+
+
+def saldo_em(momento, equipamento, tecnico=None):
+    return saldos_em(momento, tecnico, equipamentos=[equipamento.pk]).get(equipamento.pk, 0)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Max
+
+from .metricas import registro
+
+# ==============================================================================
+# FILA DE RELATÓRIOS (Gera o PDF fora da requisição, sem broker externo)
+# ==============================================================================
+# O PDF é montado num pool de processos local. Cada arquivo pronto fica guardado
+# em RELATORIOS_ROOT com o nome = hash de (filtros, parte, última movimentação,
+# versão do estoque). Enquanto nada mudar no estoque, o mesmo clique devolve o
+# mesmo arquivo sem montar nada de novo.
+#
+# RELATORIO_WORKERS = 0 gera na hora, dentro da própria requisição (testes/dev).
+#
+# Atenção: os processos do pool importam este módulo ANTES do django.setup(),
+# por isso os models só são importados dentro das funções.
+
+# Quantos PDFs prontos ficam guardados (os mais antigos são apagados)
+MAXIMO_ARQUIVOS = 50
+
+_pool = None
+_trabalhos = {}  # chave -> Future
+_trava = threading.Lock()
+
+
+def pasta():
+    caminho = Path(settings.RELATORIOS_ROOT)
+    caminho.mkdir(parents=True, exist_ok=True)
+    return caminho
+
+
+def caminho_arquivo(chave):
+    return pasta() / f"{chave}.pdf"
+
+
+def chave_valida(chave):
+    return len(chave) == 40 and all(c in '0123456789abcdef' for c in chave)
+
+
+# Filtros vêm como texto (igual na URL), para poderem viajar até o outro processo
+def calcular_chave(filtros, parte):
+    from .models import Movimentacao
+    from .signals import versao_estoque
+
+    # MAX(id) usa a chave primária: não varre o histórico
+    ultima = Movimentacao.objects.aggregate(ultima=Max('id'))['ultima'] or 0
+    # Movimentação editada/apagada, filial acertada, item renomeado: o MAX(id) não
+    # muda (ou até volta atrás), mas a versão do estoque sim
+    dados = json.dumps({'filtros': filtros, 'parte': parte, 'ultima': ultima, 'versao': versao_estoque()},
+                       sort_keys=True)
+    return hashlib.sha1(dados.encode()).hexdigest()
+
+
+def _iniciar_processo(modulo_settings):
+    # Roda uma vez em cada processo do pool (processo novo, Django do zero)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', modulo_settings)
+    import django
+    django.setup()
+
+
+def renderizar(filtros, parte, destino):
+    from .forms import FiltroMovimentacaoForm
+    from .relatorios import gerar_pdf
+
+    form = FiltroMovimentacaoForm(filtros)
+    form.is_valid()
+    inicio = time.perf_counter()
+    conteudo = gerar_pdf(form.filtros(), parte)
+    segundos = time.perf_counter() - inicio
+
+    # Grava num temporário e troca de nome: quem estiver baixando nunca pega arquivo pela metade
+    temporario = f"{destino}.{os.getpid()}.tmp"
+    with open(temporario, 'wb') as arquivo:
+        arquivo.write(conteudo)
+    os.replace(temporario, destino)
+    # Tempo de montagem (volta para o processo web, que guarda nas métricas)
+    return segundos
+
+
+def _pool_de_processos():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=settings.RELATORIO_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_iniciar_processo,
+            initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'setup.settings'),),
+        )
+    return _pool
+
+
+def _medir_relatorio(trabalho):
+    if not trabalho.cancelled() and trabalho.exception() is None:
+        registro.relatorio(trabalho.result())
+
+
+def _limpar_antigos():
+    arquivos = sorted(pasta().glob('*.pdf'), key=lambda arquivo: arquivo.stat().st_mtime, reverse=True)
+    for arquivo in arquivos[MAXIMO_ARQUIVOS:]:
+        arquivo.unlink(missing_ok=True)
+
+
+# Coloca o relatório na fila (se ainda não estiver pronto nem sendo gerado)
+def enfileirar(chave, filtros, parte):
+    destino = caminho_arquivo(chave)
+    if destino.exists():
+        return
+
+    with _trava:
+        trabalho = _trabalhos.get(chave)
+        if trabalho is not None and not trabalho.done():
+            return
+
+        _limpar_antigos()
+        for antiga in [c for c, t in _trabalhos.items() if t.done()]:
+            del _trabalhos[antiga]
+
+        if not settings.RELATORIO_WORKERS:
+            registro.relatorio(renderizar(filtros, parte, str(destino)))
+            return
+
+        trabalho = _pool_de_processos().submit(renderizar, filtros, parte, str(destino))
+        trabalho.add_done_callback(_medir_relatorio)
+        _trabalhos[chave] = trabalho
+
+
+def situacao(chave):
+    if caminho_arquivo(chave).exists():
+        return 'pronto'
+    trabalho = _trabalhos.get(chave)
+    if trabalho is None:
+        return 'desconhecido'
+    if not trabalho.done():
+        return 'gerando'
+    return 'erro' if trabalho.exception() else 'pronto'
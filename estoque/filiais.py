@@ -0,0 +1,40 @@
+from django.db.models import BooleanField, ExpressionWrapper, F, FilteredRelation, Q
+from django.db.models.functions import Coalesce
+
+from .models import MATRIZ, EstoqueFilial
+
+# ==============================================================================
+# FILIAIS (Estoque de cada local no painel, API e relatórios)
+# ==============================================================================
+# O total da empresa continua em Equipamento.quantidade (e estoque_baixo); o de
+# uma filial vem do EstoqueFilial daquele (filial, item), num LEFT JOIN pelo
+# índice único estoquefilial_unico. O custo da página é o mesmo com 1 ou 20
+# filiais: cada item lê uma linha só, a da filial pedida.
+
+
+# ?filial=<id> da URL: número ou None (= empresa toda). Sem consulta nenhuma,
+# porque o painel monta o ETag com isso antes de tocar no banco.
+def filial_pedida(parametros):
+    valor = str(parametros.get('filial') or '').strip()
+    return int(valor) if valor.isdigit() else None
+
+
+# Anota "saldo" e "baixo" em cada Equipamento: da empresa toda (filial=None) ou de uma filial.
+# Item que nunca entrou na filial sai com saldo 0. O mínimo do cadastro vale por filial.
+def anotar_saldo(equipamentos, filial=None):
+    if filial is None:
+        return equipamentos.annotate(saldo=F('quantidade'), baixo=F('estoque_baixo'))
+    return equipamentos.annotate(
+        na_filial=FilteredRelation('saldos_filial', condition=Q(saldos_filial__filial_id=filial)),
+        saldo=Coalesce(F('na_filial__quantidade'), 0),
+    ).annotate(baixo=ExpressionWrapper(Q(saldo__lte=F('minimo')), output_field=BooleanField()))
+
+
+# Itens gravados com bulk_create (sem post_save) já com quantidade: a filial recebe
+# uma linha com o mesmo número, e a soma das filiais continua batendo com o total
+def saldos_iniciais(equipamentos, filial=MATRIZ):
+    EstoqueFilial.objects.bulk_create(
+        [EstoqueFilial(filial_id=filial, equipamento_id=item.pk, quantidade=item.quantidade)
+         for item in equipamentos if item.quantidade],
+        ignore_conflicts=True, batch_size=500,
+    )
@@ -0,0 +1,76 @@
+from datetime import datetime, time, timedelta
+
+from django import forms
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .models import MATRIZ, Filial, Movimentacao
+
+
+# ==============================================================================
+# FILTROS DO RELATÓRIO (Período, Técnico, Tipo e Filial)
+# ==============================================================================
+class FiltroMovimentacaoForm(forms.Form):
+    inicio = forms.DateField(required=False, label="De", widget=forms.DateInput(
+        attrs={'type': 'date', 'class': 'form-control form-control-sm'}))
+    fim = forms.DateField(required=False, label="Até", widget=forms.DateInput(
+        attrs={'type': 'date', 'class': 'form-control form-control-sm'}))
+    # Campo de texto (nome de usuário): não carrega a lista inteira de técnicos na tela
+    tecnico = forms.ModelChoiceField(
+        queryset=User.objects.all(), to_field_name='username', required=False, label="Técnico",
+        widget=forms.TextInput(attrs={'placeholder': 'usuário (ex: natan)', 'class': 'form-control form-control-sm'}),
+    )
+    tipo = forms.ChoiceField(choices=[('', 'Todos')] + Movimentacao.TIPO_MOVIMENTO, required=False,
+                             widget=forms.Select(attrs={'class': 'form-select form-select-sm'}))
+    # Vazio = empresa toda. Com filial, o PDF também mostra o estoque só dela.
+    filial = forms.ModelChoiceField(queryset=Filial.objects.all(), required=False, label="Filial",
+                                    empty_label="Todas", widget=forms.Select(attrs={'class': 'form-select form-select-sm'}))
+
+    def clean(self):
+        dados = super().clean()
+        if dados.get('inicio') and dados.get('fim') and dados['inicio'] > dados['fim']:
+            raise forms.ValidationError("A data inicial é depois da data final.")
+        return dados
+
+    # Só os filtros preenchidos, prontos para reaproveitar (links, cache, etc.)
+    def filtros(self):
+        return {campo: valor for campo, valor in self.cleaned_data.items() if valor}
+
+
+# Dias do filtro (fuso local) viram o intervalo [de, ate) em data/hora; None = sem limite
+def periodo_dos_filtros(filtros):
+    fuso = timezone.get_current_timezone()
+    de = ate = None
+    if filtros.get('inicio'):
+        de = datetime.combine(filtros['inicio'], time.min, tzinfo=fuso)
+    if filtros.get('fim'):
+        ate = datetime.combine(filtros['fim'] + timedelta(days=1), time.min, tzinfo=fuso)
+    return de, ate
+
+
+# Aplica os filtros no histórico sem usar função na coluna "data"
+# (comparação direta com o intervalo, assim o banco pode usar índice)
+def filtrar_movimentacoes(queryset, filtros):
+    de, ate = periodo_dos_filtros(filtros)
+    if de:
+        queryset = queryset.filter(data__gte=de)
+    if ate:
+        queryset = queryset.filter(data__lt=ate)
+    if filtros.get('tecnico'):
+        queryset = queryset.filter(tecnico=filtros['tecnico'])
+    if filtros.get('tipo'):
+        queryset = queryset.filter(tipo=filtros['tipo'])
+    if filtros.get('filial'):
+        queryset = queryset.filter(filial=filtros['filial'])
+    return queryset
+
+
+# ==============================================================================
+# IMPORTAÇÃO DE PLANILHA (Admin de Equipamentos)
+# ==============================================================================
+class ImportarPlanilhaForm(forms.Form):
+    arquivo = forms.FileField(label="Planilha (.csv ou .xlsx)",
+                              widget=forms.ClearableFileInput(attrs={'accept': '.csv,.xlsx', 'class': 'form-control'}))
+    # Filial que recebe as quantidades (o cadastro dos itens é um só para todas). Sem escolha: Matriz
+    filial = forms.ModelChoiceField(queryset=Filial.objects.all(), initial=MATRIZ, empty_label=None, required=False,
+                                    label="Entrada na filial", widget=forms.Select(attrs={'class': 'form-select'}))
@@ -0,0 +1,170 @@
+import gzip
+import json
+from collections import namedtuple
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .forms import filtrar_movimentacoes, periodo_dos_filtros
+from .models import MATRIZ, ArquivoMovimentacao, Movimentacao
+from .saldos import EFEITOS
+
+# ==============================================================================
+# HISTÓRICO UNIDO (Movimentações do banco + meses arquivados)
+# ==============================================================================
+# As movimentações antigas saem do banco para um .ndjson.gz por mês (arquivo.py).
+# Quem precisa do histórico inteiro (PDF com filtro, exportação, saldos do passado)
+# lê por aqui e recebe as duas partes juntas, sem saber onde cada linha mora.
+# Só os meses que cruzam o período pedido são abertos; com o período inteiro
+# dentro do banco, o custo é uma consulta pequena na lista de arquivos.
+#
+# O corte do arquivo é por data (mês inteiro), e a data é auto_now_add: tudo que
+# está arquivado é mais velho (e de id menor) que tudo que está no banco. Então
+# "mais novas primeiro" = banco e depois arquivo, e "por id" = arquivo e depois banco.
+#
+# Arquivos gravados antes das filiais não têm filial_id/filial: são da Matriz.
+Linha = namedtuple('Linha', (
+    'id', 'data', 'tipo', 'quantidade', 'tecnico_id', 'tecnico', 'equipamento_id', 'equipamento',
+    'equipamento_tipo', 'obs', 'autor_id', 'autor', 'chave_idempotencia', 'filial_id', 'filial',
+), defaults=(MATRIZ, None))
+# Mesma ordem da Linha, lido do banco com JOIN (nomes no mesmo SELECT)
+CAMPOS_BANCO = (
+    'id', 'data', 'tipo', 'quantidade', 'tecnico_id', 'tecnico__username', 'equipamento_id', 'equipamento__nome',
+    'equipamento__tipo', 'obs', 'autor_movimento_id', 'autor_movimento__username', 'chave_idempotencia',
+    'filial_id', 'filial__nome',
+)
+
+
+def caminho(arquivo):
+    return Path(settings.ARQUIVO_ROOT) / arquivo.arquivo
+
+
+def ler_arquivo(arquivo):
+    with gzip.open(caminho(arquivo), 'rt', encoding='utf-8') as entrada:
+        for texto in entrada:
+            dados = json.loads(texto)
+            dados['data'] = datetime.fromisoformat(dados['data'])
+            yield Linha(**dados)
+
+
+def _mes(momento):
+    return timezone.localtime(momento).date().replace(day=1)
+
+
+# Primeiro dia que ainda está inteiro no banco (None = nada arquivado)
+def inicio_do_banco():
+    ultimo = ArquivoMovimentacao.objects.aggregate(ultimo=Max('mes'))['ultimo']
+    if ultimo is None:
+        return None
+    return (ultimo.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _arquivos(de=None, ate=None, id_acima=None, id_ate=None):
+    arquivos = ArquivoMovimentacao.objects.all()
+    if de is not None:
+        arquivos = arquivos.filter(mes__gte=_mes(de))
+    if ate is not None:
+        arquivos = arquivos.filter(mes__lte=_mes(ate))
+    if id_acima is not None:
+        arquivos = arquivos.filter(ultima_movimentacao__gt=id_acima)
+    if id_ate is not None:
+        arquivos = arquivos.filter(primeira_movimentacao__lte=id_ate)
+    return arquivos
+
+
+def _linhas_filtradas(arquivo, filtros, de, ate):
+    tecnico = filtros.get('tecnico')
+    for linha in ler_arquivo(arquivo):
+        if de is not None and linha.data < de:
+            continue
+        if ate is not None and linha.data >= ate:
+            continue
+        if tecnico and linha.tecnico_id != tecnico.pk:
+            continue
+        if filtros.get('tipo') and linha.tipo != filtros['tipo']:
+            continue
+        if filtros.get('filial') and linha.filial_id != filtros['filial'].pk:
+            continue
+        yield linha
+
+
+def _linhas_do_banco(movimentacoes, pedaco=2000):
+    for valores in movimentacoes.values_list(*CAMPOS_BANCO).iterator(chunk_size=pedaco):
+        yield Linha(*valores)
+
+
+# Mesmos filtros do formulário do relatório, na ordem do id (arquivo e depois banco)
+def linhas_por_id(filtros, desde_id=0, ate_id=None, pedaco=2000):
+    de, ate = periodo_dos_filtros(filtros)
+    for arquivo in _arquivos(de, ate, id_acima=desde_id, id_ate=ate_id).order_by('primeira_movimentacao'):
+        for linha in _linhas_filtradas(arquivo, filtros, de, ate):
+            if linha.id > desde_id and (ate_id is None or linha.id <= ate_id):
+                yield linha
+
+    movimentacoes = filtrar_movimentacoes(Movimentacao.objects.all(), filtros).filter(id__gt=desde_id)
+    if ate_id is not None:
+        movimentacoes = movimentacoes.filter(id__lte=ate_id)
+    yield from _linhas_do_banco(movimentacoes.order_by('id'), pedaco)
+
+
+def _arquivadas_mais_novas_primeiro(filtros):
+    de, ate = periodo_dos_filtros(filtros)
+    for arquivo in _arquivos(de, ate).order_by('-mes', '-ultima_movimentacao'):
+        # Um mês por vez na memória
+        linhas = list(_linhas_filtradas(arquivo, filtros, de, ate))
+        linhas.sort(key=lambda linha: (linha.data, linha.id), reverse=True)
+        yield from linhas
+
+
+def contar(filtros):
+    vivas = filtrar_movimentacoes(Movimentacao.objects.all(), filtros).count()
+    return vivas + sum(1 for _ in _arquivadas_mais_novas_primeiro(filtros))
+
+
+# Pedaço [inicio, inicio + quantidade) do histórico, mais novas primeiro (igual ao PDF).
+# "vivas" = as movimentações do banco já com os mesmos filtros, na ordem -data, -id.
+def pagina(vivas, filtros, inicio, quantidade):
+    linhas = list(_linhas_do_banco(vivas[inicio:inicio + quantidade]))
+    falta = quantidade - len(linhas)
+    if not falta:
+        return linhas
+
+    # Banco acabou nesta página: o resto vem do arquivo
+    pular = 0 if linhas else max(inicio - vivas.count(), 0)
+    for linha in _arquivadas_mais_novas_primeiro(filtros):
+        if pular:
+            pular -= 1
+            continue
+        linhas.append(linha)
+        falta -= 1
+        if not falta:
+            break
+    return linhas
+
+
+# Soma das linhas arquivadas num intervalo, por item: {equipamento_id: total}
+# (o pedaço do arquivo na conta do fechamentos.saldos_em)
+def somar_arquivadas(lado, tecnico=None, equipamentos=None, id_acima=None, id_ate=None, data_acima=None,
+                     data_ate=None):
+    somas = {}
+    for arquivo in _arquivos(data_acima, data_ate, id_acima, id_ate):
+        for linha in ler_arquivo(arquivo):
+            if id_acima is not None and linha.id <= id_acima:
+                continue
+            if id_ate is not None and linha.id > id_ate:
+                continue
+            if data_acima is not None and linha.data <= data_acima:
+                continue
+            if data_ate is not None and linha.data > data_ate:
+                continue
+            if tecnico is not None and linha.tecnico_id != tecnico.pk:
+                continue
+            if equipamentos is not None and linha.equipamento_id not in equipamentos:
+                continue
+            somas[linha.equipamento_id] = (
+                somas.get(linha.equipamento_id, 0) + EFEITOS[linha.tipo][lado] * linha.quantidade
+            )
+    return somas
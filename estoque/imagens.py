@@ -0,0 +1,69 @@
+import os
+
+from PIL import Image, ImageOps
+
+# ==============================================================================
+# MINIATURAS DAS FOTOS (Pillow)
+# ==============================================================================
+# O card do painel mostra a foto em 80x80. Guardamos ao lado do original uma
+# miniatura 160x160 (tela de celular é 2x) em WebP e em JPEG, sem EXIF/GPS.
+#   equipamentos/onu.png -> equipamentos/onu_mini.webp e equipamentos/onu_mini.jpg
+#
+# Este módulo não usa o Django (só caminhos de arquivo), então pode rodar em
+# vários processos ao mesmo tempo no comando "gerar_miniaturas".
+TAMANHO_MINIATURA = (160, 160)
+SUFIXO = '_mini'
+FORMATOS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 6}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def nome_miniatura(nome_original, extensao):
+    raiz, _ = os.path.splitext(nome_original)
+    return f"{raiz}{SUFIXO}.{extensao}"
+
+
+def miniaturas_existem(caminho_original):
+    return all(os.path.exists(nome_miniatura(caminho_original, extensao)) for extensao in FORMATOS)
+
+
+# Gera as miniaturas de um arquivo. Devolve quantas foram gravadas (0 = já existiam).
+def gerar_miniaturas(caminho_original, forcar=False):
+    if not forcar and miniaturas_existem(caminho_original):
+        return 0
+
+    with Image.open(caminho_original) as imagem:
+        # Foto de celular vem "deitada" com a rotação no EXIF: aplica antes de jogar o EXIF fora
+        imagem = ImageOps.exif_transpose(imagem)
+        if imagem.mode not in ('RGB', 'RGBA'):
+            imagem = imagem.convert('RGBA' if 'A' in imagem.getbands() else 'RGB')
+        # Corta no centro e reduz para o tamanho exato do card
+        miniatura = ImageOps.fit(imagem, TAMANHO_MINIATURA, Image.Resampling.LANCZOS)
+
+    gravadas = 0
+    for extensao, (formato, opcoes) in FORMATOS.items():
+        copia = miniatura
+        if formato == 'JPEG' and copia.mode == 'RGBA':
+            # JPEG não tem transparência: fundo branco
+            fundo = Image.new('RGB', copia.size, (255, 255, 255))
+            fundo.paste(copia, mask=copia.getchannel('A'))
+            copia = fundo
+
+        destino = nome_miniatura(caminho_original, extensao)
+        temporario = f"{destino}.{os.getpid()}.tmp"
+        # Imagem nova, sem exif/icc: nada dos metadados do original vai junto
+        copia.save(temporario, formato, **opcoes)
+        os.replace(temporario, destino)
+        gravadas += 1
+
+    return gravadas
+
+
+# Versão para o pool de processos: recebe (caminho, forcar) e nunca levanta erro
+def processar_foto(argumentos):
+    caminho, forcar = argumentos
+    try:
+        return caminho, gerar_miniaturas(caminho, forcar=forcar), None
+    except (OSError, ValueError) as erro:
+        return caminho, 0, str(erro)
@@ -0,0 +1,201 @@
+import csv
+import io
+import os
+
+from django.db import transaction
+
+from .models import MATRIZ, Equipamento, Movimentacao
+from .saldos import lancar_movimentos
+from .signals import invalidar_catalogo
+
+# ==============================================================================
+# IMPORTAÇÃO DE PLANILHA (Cadastro inicial e entregas de fornecedor)
+# ==============================================================================
+# Lê CSV ou XLSX linha a linha e grava de TAMANHO_LOTE em TAMANHO_LOTE linhas:
+# a memória fica do mesmo tamanho seja a planilha de 100 ou de 50 mil itens.
+# (900 para os "nome IN (...)" caberem no limite de parâmetros do SQLite antigo)
+#
+# Colunas (cabeçalho na primeira linha, maiúsculas/minúsculas tanto faz):
+#   nome, tipo                -> obrigatórias (o item é achado por nome + tipo)
+#   quantidade                -> entra no estoque da filial escolhida como movimentação de ENTRADA
+#   minimo, especificacoes, observacao -> opcionais (atualizam o cadastro)
+TAMANHO_LOTE = 900
+CAMPOS_OPCIONAIS = ('minimo', 'especificacoes', 'observacao')
+
+# Aceita o código (FIBRA) ou o nome que aparece na tela (Fibra Óptica)
+TIPOS = {
+    **{codigo.lower(): codigo for codigo, _ in Equipamento.TIPO_CHOICES},
+    **{nome.lower(): codigo for codigo, nome in Equipamento.TIPO_CHOICES},
+}
+
+
+def _ler_csv(arquivo):
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    try:
+        amostra = texto.read(4096)
+        texto.seek(0)
+        # Excel em português salva CSV com ";"
+        try:
+            dialeto = csv.Sniffer().sniff(amostra, delimiters=';,\t') if amostra else csv.excel
+        except csv.Error:
+            raise ValueError(
+                "Não deu para achar o separador das colunas: use ';' ou ',' e comece com o cabeçalho nome;tipo."
+            )
+        yield from csv.reader(texto, dialeto)
+    except UnicodeDecodeError:
+        raise ValueError("O arquivo não está em UTF-8: no Excel, salve como \"CSV UTF-8\".")
+    except csv.Error as erro:
+        raise ValueError(f"CSV quebrado ({erro}).")
+
+
+def _ler_xlsx(arquivo):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Para importar .xlsx instale o openpyxl (pip install openpyxl) ou salve a planilha como CSV.")
+
+    # read_only: o openpyxl vai lendo o arquivo aos poucos, sem carregar a planilha inteira
+    planilha = load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        for linha in planilha.active.iter_rows(values_only=True):
+            yield ['' if valor is None else valor for valor in linha]
+    finally:
+        planilha.close()
+
+
+# Devolve (número da linha, {coluna: valor}) para cada linha com alguma coisa preenchida
+def ler_planilha(arquivo, nome_arquivo):
+    extensao = os.path.splitext(nome_arquivo)[1].lower()
+    if extensao not in ('.csv', '.xlsx'):
+        raise ValueError("Formato não suportado: envie um arquivo .csv ou .xlsx.")
+    linhas = _ler_xlsx(arquivo) if extensao == '.xlsx' else _ler_csv(arquivo)
+
+    cabecalho = [str(coluna).strip().lower() for coluna in next(linhas, [])]
+    if 'nome' not in cabecalho or 'tipo' not in cabecalho:
+        raise ValueError("A primeira linha precisa ter as colunas 'nome' e 'tipo'.")
+
+    for numero, valores in enumerate(linhas, start=2):
+        if any(str(valor).strip() for valor in valores):
+            yield numero, dict(zip(cabecalho, valores))
+
+
+def _numero(valor, coluna):
+    texto = str(valor).strip()
+    if not texto:
+        return None
+    try:
+        numero = float(texto.replace(',', '.'))
+    except ValueError:
+        raise ValueError(f"'{coluna}' não é um número: {texto}")
+    if numero < 0 or numero != int(numero):
+        raise ValueError(f"'{coluna}' precisa ser inteiro e positivo: {texto}")
+    return int(numero)
+
+
+# Confere uma linha. Devolve (item pronto para gravar, quantidade que entra, campos presentes)
+def _validar_linha(dados):
+    nome = str(dados.get('nome', '')).strip()
+    if not nome:
+        raise ValueError("Nome vazio.")
+    if len(nome) > Equipamento._meta.get_field('nome').max_length:
+        raise ValueError("Nome com mais de 100 letras.")
+    tipo = TIPOS.get(str(dados.get('tipo', '')).strip().lower())
+    if tipo is None:
+        raise ValueError(f"Tipo desconhecido: {dados.get('tipo')!r} (use {', '.join(c for c, _ in Equipamento.TIPO_CHOICES)}).")
+
+    equipamento = Equipamento(nome=nome, tipo=tipo, quantidade=0)
+    campos = []
+    for campo in CAMPOS_OPCIONAIS:
+        if campo not in dados:
+            continue
+        valor = _numero(dados[campo], campo) if campo == 'minimo' else (str(dados[campo]).strip() or None)
+        if valor is not None:
+            setattr(equipamento, campo, valor)
+            campos.append(campo)
+    return equipamento, _numero(dados.get('quantidade', ''), 'quantidade') or 0, campos
+
+
+def _gravar_lote(lote, autor, origem, resultado, filial):
+    # Mesmo item repetido no lote: as quantidades somam e, no cadastro, cada coluna
+    # preenchida numa linha mais abaixo vale sobre a de cima
+    itens, entradas = {}, {}
+    for equipamento, quantidade, campos in lote:
+        chave = (equipamento.nome, equipamento.tipo)
+        if chave in itens:
+            anterior, campos_anteriores = itens[chave]
+            for campo in campos:
+                setattr(anterior, campo, getattr(equipamento, campo))
+            itens[chave] = (anterior, tuple(sorted(set(campos_anteriores) | set(campos))))
+        else:
+            itens[chave] = (equipamento, tuple(campos))
+        entradas[chave] = entradas.get(chave, 0) + quantidade
+
+    # Célula vazia não apaga o que já está cadastrado: cada grupo de linhas só
+    # atualiza as colunas que ele preencheu (normalmente é um grupo só)
+    grupos = {}
+    for equipamento, campos in itens.values():
+        grupos.setdefault(campos, []).append(equipamento)
+
+    nomes = {nome for nome, _ in itens}
+    existentes = set(Equipamento.objects.filter(nome__in=nomes).values_list('nome', 'tipo'))
+
+    with transaction.atomic():
+        # INSERT ... ON CONFLICT para o lote inteiro (quantidade nunca é sobrescrita:
+        # ela só muda pelas movimentações de ENTRADA logo abaixo)
+        for campos, equipamentos in grupos.items():
+            if campos:
+                Equipamento.objects.bulk_create(
+                    equipamentos, update_conflicts=True, unique_fields=['nome', 'tipo'], update_fields=list(campos),
+                )
+            else:
+                Equipamento.objects.bulk_create(equipamentos, ignore_conflicts=True)
+
+        ids = {
+            (nome, tipo): pk
+            for pk, nome, tipo in Equipamento.objects.filter(nome__in=nomes).values_list('id', 'nome', 'tipo')
+        }
+        movimentacoes = [
+            Movimentacao(tecnico=autor, autor_movimento=autor, equipamento_id=ids[chave], tipo='ENTRADA',
+                         filial_id=filial, quantidade=quantidade, obs=origem)
+            for chave, quantidade in entradas.items() if quantidade
+        ]
+        lancar_movimentos(movimentacoes)
+        # bulk_create não dispara post_save: avisa o índice do autocompletar
+        invalidar_catalogo()
+
+    resultado['criados'] += len(itens.keys() - existentes)
+    resultado['atualizados'] += len(itens.keys() & existentes)
+    resultado['entradas'] += sum(mov.quantidade for mov in movimentacoes)
+
+
+# Importa a planilha inteira. Linhas com problema não param a importação:
+# vão para resultado['erros'] como (número da linha, motivo).
+# Arquivo que estraga no meio (codificação errada, CSV quebrado) para a leitura ali:
+# os lotes de cima já foram gravados, então o que foi lido entra e
+# resultado['interrompido'] = (linha, motivo) diz de onde reenviar, para as
+# ENTRADAS não serem lançadas duas vezes. Sem nenhuma linha lida, é ValueError.
+def importar_planilha(arquivo, nome_arquivo, autor, filial=MATRIZ):
+    resultado = {'linhas': 0, 'criados': 0, 'atualizados': 0, 'entradas': 0, 'erros': [], 'interrompido': None}
+    origem = f"Importação {os.path.basename(nome_arquivo)}"[:100]
+
+    lote, numero = [], 1
+    try:
+        for numero, dados in ler_planilha(arquivo, nome_arquivo):
+            resultado['linhas'] += 1
+            try:
+                lote.append(_validar_linha(dados))
+            except ValueError as erro:
+                resultado['erros'].append((numero, str(erro)))
+                continue
+            if len(lote) >= TAMANHO_LOTE:
+                _gravar_lote(lote, autor, origem, resultado, filial)
+                lote = []
+    except ValueError as erro:
+        if not resultado['linhas']:
+            raise
+        resultado['interrompido'] = (numero + 1, str(erro))
+        resultado['erros'].append(resultado['interrompido'])
+
+    if lote:
+        _gravar_lote(lote, autor, origem, resultado, filial)
+    return resultado
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+from estoque.arquivo import arquivar, corte
+from estoque.models import Movimentacao
+
+
+# ==============================================================================
+# COMANDO: python manage.py arquivar_movimentacoes [--meses N] [--confirmar] [--compactar]
+# ==============================================================================
+# Tira do banco os meses mais velhos que --meses (padrão settings.ARQUIVO_MESES) e
+# grava cada um num .ndjson.gz em settings.ARQUIVO_ROOT. Sem --confirmar só mostra
+# o que sairia. Agendar uma vez por mês (cron), fora do expediente.
+# --compactar roda o VACUUM no fim: sem ele o db.sqlite3 não diminui no disco
+# (o espaço fica livre para as próximas movimentações).
+class Command(BaseCommand):
+    help = "Arquiva as movimentações antigas em arquivos compactados, um por mês."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses', type=int, default=settings.ARQUIVO_MESES,
+                            help="Quantos meses (além do atual) ficam no banco.")
+        parser.add_argument('--confirmar', action='store_true', help="Arquiva de verdade.")
+        parser.add_argument('--compactar', action='store_true', help="Roda o VACUUM depois (SQLite).")
+
+    def handle(self, *args, **options):
+        limite = corte(options['meses'])
+        if not options['confirmar']:
+            meses = (
+                Movimentacao.objects.filter(data__lt=limite).annotate(mes=TruncMonth('data'))
+                .values('mes').annotate(linhas=Count('id')).order_by('mes')
+            )
+            for mes in meses:
+                self.stdout.write(f"{mes['mes']:%m/%Y}: {mes['linhas']} movimentações")
+            total = sum(mes['linhas'] for mes in meses)
+            self.stdout.write(self.style.WARNING(
+                f"{total} movimentações de antes de {limite:%d/%m/%Y} sairiam do banco. Use --confirmar para arquivar."
+            ))
+            return
+
+        resultado = arquivar(options['meses'])
+        if not resultado['movimentacoes']:
+            self.stdout.write(self.style.SUCCESS(f"✅ Nada para arquivar antes de {limite:%d/%m/%Y}."))
+            return
+
+        for arquivo in resultado['arquivos']:
+            self.stdout.write(f"📦 {arquivo.arquivo}: {arquivo.linhas} movimentações")
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {resultado['movimentacoes']} movimentações arquivadas ({resultado['fechamento']} gravado antes)."
+        ))
+
+        if options['compactar'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute("VACUUM")
+            self.stdout.write(self.style.SUCCESS("✅ Banco compactado."))
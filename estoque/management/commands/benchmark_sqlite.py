@@ -0,0 +1,138 @@
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from estoque.banco import aplicar_pragmas
+
+# ==============================================================================
+# COMANDO: python manage.py benchmark_sqlite [--segundos 5] [--leitores 6] [--escritores 4]
+# ==============================================================================
+# Carga mista de leitura e escrita (várias threads, cada uma com sua conexão)
+# num banco temporário, com o SQLite do jeito padrão e com o perfil de produção.
+# Não toca no db.sqlite3 de verdade.
+#   padrao   -> journal DELETE, synchronous FULL, BEGIN DEFERRED, timeout 5s (padrão do Django)
+#   producao -> settings.SQLITE_PRAGMAS_PRODUCAO + BEGIN IMMEDIATE
+PERFIS = {
+    'padrao': {'pragmas': {}, 'begin': 'BEGIN', 'timeout': 5},
+    'producao': {'pragmas': settings.SQLITE_PRAGMAS_PRODUCAO, 'begin': 'BEGIN IMMEDIATE', 'timeout': 20},
+}
+
+ITENS = 500
+HISTORICO_INICIAL = 20000
+
+
+def _conectar(caminho, perfil):
+    conexao = sqlite3.connect(caminho, timeout=perfil['timeout'], isolation_level=None, check_same_thread=False)
+    aplicar_pragmas(conexao.cursor(), perfil['pragmas'])
+    return conexao
+
+
+def _criar_banco(caminho, perfil):
+    conexao = _conectar(caminho, perfil)
+    conexao.executescript("""
+        CREATE TABLE equipamento (id INTEGER PRIMARY KEY, nome TEXT NOT NULL, quantidade INTEGER NOT NULL);
+        CREATE INDEX equipamento_nome ON equipamento (nome);
+        CREATE TABLE movimentacao (id INTEGER PRIMARY KEY, equipamento_id INTEGER NOT NULL,
+                                   quantidade INTEGER NOT NULL, data REAL NOT NULL);
+        CREATE INDEX movimentacao_equipamento ON movimentacao (equipamento_id, data);
+    """)
+    conexao.execute("BEGIN")
+    conexao.executemany("INSERT INTO equipamento (id, nome, quantidade) VALUES (?, ?, ?)",
+                        ((i, f"Item {i:04d}", 10 ** 6) for i in range(1, ITENS + 1)))
+    conexao.executemany("INSERT INTO movimentacao (equipamento_id, quantidade, data) VALUES (?, 1, ?)",
+                        ((random.randint(1, ITENS), time.time()) for _ in range(HISTORICO_INICIAL)))
+    conexao.execute("COMMIT")
+    conexao.close()
+
+
+def _ler(conexao):
+    # Página do painel + histórico de um item
+    conexao.execute("SELECT id, nome, quantidade FROM equipamento ORDER BY nome LIMIT 30 OFFSET ?",
+                    (random.randrange(0, ITENS, 30),)).fetchall()
+    conexao.execute("SELECT COUNT(*), SUM(quantidade) FROM movimentacao WHERE equipamento_id = ?",
+                    (random.randint(1, ITENS),)).fetchone()
+
+
+def _escrever(conexao, perfil):
+    # Mesmo formato de uma saída: baixa o saldo e grava no histórico, numa transação
+    item = random.randint(1, ITENS)
+    conexao.execute(perfil['begin'])
+    try:
+        conexao.execute("UPDATE equipamento SET quantidade = quantidade - 1 WHERE id = ? AND quantidade >= 1", (item,))
+        conexao.execute("INSERT INTO movimentacao (equipamento_id, quantidade, data) VALUES (?, 1, ?)",
+                        (item, time.time()))
+        conexao.execute("COMMIT")
+    except sqlite3.OperationalError:
+        if conexao.in_transaction:
+            conexao.execute("ROLLBACK")
+        raise
+
+
+def rodar(perfil, segundos, leitores, escritores):
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'benchmark.sqlite3')
+        _criar_banco(caminho, perfil)
+
+        parar = threading.Event()
+        trava = threading.Lock()
+        resultado = {'leituras': 0, 'escritas': 0, 'erros': 0, 'latencias': []}
+
+        def trabalhador(escreve):
+            conexao = _conectar(caminho, perfil)
+            feitas, erros, latencias = 0, 0, []
+            while not parar.is_set():
+                inicio = time.perf_counter()
+                try:
+                    _escrever(conexao, perfil) if escreve else _ler(conexao)
+                    feitas += 1
+                except sqlite3.OperationalError:
+                    erros += 1  # "database is locked"
+                latencias.append((time.perf_counter() - inicio) * 1000)
+            conexao.close()
+            with trava:
+                resultado['escritas' if escreve else 'leituras'] += feitas
+                resultado['erros'] += erros
+                if escreve:
+                    resultado['latencias'].extend(latencias)
+
+        threads = [threading.Thread(target=trabalhador, args=(i < escritores,)) for i in range(escritores + leitores)]
+        for thread in threads:
+            thread.start()
+        time.sleep(segundos)
+        parar.set()
+        for thread in threads:
+            thread.join()
+
+    latencias = resultado.pop('latencias')
+    resultado['p95_escrita_ms'] = statistics.quantiles(latencias, n=20)[-1] if len(latencias) > 1 else 0
+    resultado['por_segundo'] = (resultado['leituras'] + resultado['escritas']) / segundos
+    return resultado
+
+
+class Command(BaseCommand):
+    help = "Compara o SQLite padrão com o perfil de produção (WAL, busy timeout...) numa carga mista."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segundos', type=float, default=5, help="Duração de cada rodada.")
+        parser.add_argument('--leitores', type=int, default=6, help="Threads só lendo.")
+        parser.add_argument('--escritores', type=int, default=4, help="Threads só escrevendo.")
+        parser.add_argument('--perfil', choices=sorted(PERFIS), help="Roda só um perfil.")
+
+    def handle(self, *args, **options):
+        nomes = [options['perfil']] if options['perfil'] else list(PERFIS)
+        self.stdout.write(f"{options['leitores']} leitores + {options['escritores']} escritores, "
+                          f"{options['segundos']:g}s por perfil")
+
+        for nome in nomes:
+            r = rodar(PERFIS[nome], options['segundos'], options['leitores'], options['escritores'])
+            self.stdout.write(
+                f"{nome:>9}: {r['por_segundo']:8.0f} op/s | leituras {r['leituras']:7d} | "
+                f"escritas {r['escritas']:6d} | travados {r['erros']:4d} | p95 escrita {r['p95_escrita_ms']:6.1f} ms"
+            )
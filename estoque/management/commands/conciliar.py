@@ -0,0 +1,40 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from estoque.conciliacao import conciliar
+from estoque.models import Equipamento
+
+
+# ==============================================================================
+# COMANDO: python manage.py conciliar [--reparar]
+# ==============================================================================
+# Confere cada carteira de técnico contra a soma do histórico de movimentações.
+# Sem --reparar só mostra as diferenças; com --reparar deixa a carteira igual ao histórico.
+class Command(BaseCommand):
+    help = "Confere as carteiras dos técnicos contra o histórico de movimentações."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reparar', action='store_true', help="Corrige as carteiras que estiverem diferentes.")
+
+    def handle(self, *args, **options):
+        resultado = conciliar(reparar=options['reparar'])
+        divergencias = resultado['divergencias']
+
+        modo = "histórico inteiro" if resultado['completa'] else "só as movimentações novas"
+        self.stdout.write(f"Conferido até a movimentação #{resultado['somadas_ate']} ({modo}).")
+        if not divergencias:
+            self.stdout.write(self.style.SUCCESS("✅ Todas as carteiras batem com o histórico."))
+            return
+
+        tecnicos = dict(User.objects.filter(pk__in={d[0] for d in divergencias}).values_list('id', 'username'))
+        itens = dict(Equipamento.objects.filter(pk__in={d[1] for d in divergencias}).values_list('id', 'nome'))
+        for tecnico_id, equipamento_id, esperado, atual in divergencias:
+            self.stdout.write(
+                f"⚠️ {tecnicos.get(tecnico_id, tecnico_id)} / {itens.get(equipamento_id, equipamento_id)}: "
+                f"carteira {atual}, histórico {esperado} (diferença {atual - esperado:+d})"
+            )
+
+        if options['reparar']:
+            self.stdout.write(self.style.SUCCESS(f"✅ {resultado['reparadas']} carteiras corrigidas."))
+        else:
+            self.stdout.write(self.style.WARNING(f"{len(divergencias)} carteiras diferentes. Use --reparar para corrigir."))
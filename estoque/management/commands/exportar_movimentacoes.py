@@ -0,0 +1,63 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from estoque import exportacao
+from estoque.forms import FiltroMovimentacaoForm
+
+
+# ==============================================================================
+# COMANDO: python manage.py exportar_movimentacoes [--formato csv|ndjson] [--saida arquivo]
+#          [--inicio AAAA-MM-DD] [--fim AAAA-MM-DD] [--tecnico usuario] [--tipo SAIDA] [--filial ID]
+#          [--desde ID | --marcador arquivo]
+# ==============================================================================
+# Exporta o histórico de movimentações linha a linha (não carrega tudo na memória).
+# Para a carga noturna da contabilidade use --marcador: o arquivo guarda o último id
+# exportado e a próxima rodada só traz as movimentações novas.
+class Command(BaseCommand):
+    help = "Exporta o histórico de movimentações em CSV ou NDJSON (com continuação pelo último id)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--formato', choices=sorted(exportacao.FORMATOS), default='csv')
+        parser.add_argument('--saida', help="Arquivo de saída (padrão: tela).")
+        parser.add_argument('--inicio', help="Data inicial (AAAA-MM-DD).")
+        parser.add_argument('--fim', help="Data final (AAAA-MM-DD).")
+        parser.add_argument('--tecnico', help="Usuário do técnico.")
+        parser.add_argument('--tipo', help="SAIDA, DEVOLUCAO, BAIXA, ENTRADA, TRANSF_SAIDA ou TRANSF_ENTRADA.")
+        parser.add_argument('--filial', help="Id da filial (padrão: todas).")
+        parser.add_argument('--desde', type=int, default=0, help="Só movimentações com id maior que este.")
+        parser.add_argument('--marcador', help="Arquivo com o último id exportado (lido e atualizado).")
+
+    def handle(self, *args, **options):
+        form = FiltroMovimentacaoForm({campo: options[campo] for campo in ('inicio', 'fim', 'tecnico', 'tipo', 'filial')
+                                       if options[campo]})
+        if not form.is_valid():
+            raise CommandError(f"Filtro inválido: {form.errors.as_text()}")
+
+        desde = options['desde']
+        if options['marcador'] and os.path.exists(options['marcador']):
+            with open(options['marcador']) as marcador:
+                desde = int(marcador.read().strip() or 0)
+
+        ultimo = exportacao.ultimo_id()
+        pedacos = exportacao.exportar(options['formato'], form.filtros(), desde, ultimo)
+
+        linhas = 0
+        destino = open(options['saida'], 'w', encoding='utf-8', newline='') if options['saida'] else sys.stdout
+        try:
+            for pedaco in pedacos:
+                destino.write(pedaco)
+                linhas += 1
+        finally:
+            if options['saida']:
+                destino.close()
+
+        # Só avança o marcador depois que o arquivo foi escrito inteiro
+        if options['marcador']:
+            with open(options['marcador'], 'w') as marcador:
+                marcador.write(str(ultimo))
+
+        if options['formato'] == 'csv':
+            linhas -= 1  # Cabeçalho
+        self.stderr.write(f"✅ {linhas} movimentações exportadas (ids {desde + 1} a {ultimo}).")
@@ -0,0 +1,46 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from estoque.sinteticos import PREFIXO_TECNICO, gerar
+
+
+# ==============================================================================
+# COMANDO: python manage.py gerar_dados_sinteticos --confirmar [--movimentacoes 1000000]
+# ==============================================================================
+# Enche o banco configurado com um estoque falso (itens, técnicos, histórico de
+# um ano) para medir desempenho com volume de verdade. Ver estoque/sinteticos.py.
+# Use numa cópia do banco, nunca no de produção.
+class Command(BaseCommand):
+    help = "Gera itens, técnicos e movimentações sintéticas (bulk_create) para testes de desempenho."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--itens', type=int, default=2000, help="Quantos itens no catálogo (padrão 2000).")
+        parser.add_argument('--tecnicos', type=int, default=200, help="Quantos técnicos (padrão 200).")
+        parser.add_argument('--movimentacoes', type=int, default=1_000_000,
+                            help="Tamanho do histórico (padrão 1 milhão).")
+        parser.add_argument('--dias', type=int, default=365, help="Período do histórico, até hoje (padrão 365).")
+        parser.add_argument('--semente', type=int, default=42, help="Mesma semente = mesmos dados.")
+        parser.add_argument('--confirmar', action='store_true',
+                            help="Confirma que o banco configurado pode receber dados falsos.")
+
+    def handle(self, *args, **options):
+        if min(options['itens'], options['tecnicos'], options['movimentacoes'], options['dias']) < 1:
+            raise CommandError("Itens, técnicos, movimentações e dias precisam ser maiores que zero.")
+        banco = connection.settings_dict['NAME']
+        if not options['confirmar']:
+            raise CommandError(f"Isto grava dados falsos em {banco}. Rode de novo com --confirmar.")
+        if User.objects.filter(username__startswith=PREFIXO_TECNICO).exists():
+            raise CommandError(f"{banco} já tem dados sintéticos (usuários '{PREFIXO_TECNICO}...').")
+
+        inicio = time.perf_counter()
+        resumo = gerar(
+            itens=options['itens'], tecnicos=options['tecnicos'], movimentacoes=options['movimentacoes'],
+            dias=options['dias'], semente=options['semente'], avisar=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {resumo['movimentacoes']} movimentações, {resumo['itens']} itens, {resumo['tecnicos']} técnicos "
+            f"e {resumo['carteiras']} carteiras em {time.perf_counter() - inicio:.0f} s."
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from estoque.fechamentos import gerar_fechamento
+from estoque.models import Fechamento
+
+
+# ==============================================================================
+# COMANDO: python manage.py gerar_fechamento [--forcar]
+# ==============================================================================
+# Tira a foto dos saldos (empresa e carteiras). Agendar uma vez por dia (cron),
+# de preferência fora do expediente.
+class Command(BaseCommand):
+    help = "Grava o fechamento diário dos saldos (base para consultar saldos de datas passadas)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forcar', action='store_true', help="Gera mesmo se já existir um fechamento hoje.")
+
+    def handle(self, *args, **options):
+        hoje = timezone.localdate()
+        if not options['forcar'] and Fechamento.objects.filter(data__date=hoje).exists():
+            self.stdout.write(self.style.WARNING(f"⚠️ Já existe fechamento de {hoje:%d/%m/%Y}. Use --forcar para gerar outro."))
+            return
+
+        fechamento = gerar_fechamento()
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {fechamento} gravado com {fechamento.saldos.count()} saldos "
+            f"(até a movimentação #{fechamento.ultima_movimentacao})."
+        ))
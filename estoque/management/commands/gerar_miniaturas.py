@@ -0,0 +1,41 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from estoque.imagens import processar_foto
+from estoque.models import Equipamento
+
+
+# ==============================================================================
+# COMANDO: python manage.py gerar_miniaturas [--forcar] [--processos N]
+# ==============================================================================
+# Gera as miniaturas das fotos que já estavam cadastradas antes do recurso existir.
+# Usa todos os núcleos da máquina (um processo por núcleo).
+class Command(BaseCommand):
+    help = "Gera as miniaturas (WebP/JPEG) das fotos dos equipamentos que ainda não têm."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forcar', action='store_true', help="Gera de novo mesmo se já existir.")
+        parser.add_argument('--processos', type=int, default=os.cpu_count() or 1,
+                            help="Quantos processos em paralelo (padrão: número de núcleos).")
+
+    def handle(self, *args, **options):
+        fotos = Equipamento.objects.exclude(foto='').exclude(foto__isnull=True).values_list('foto', flat=True)
+        storage = Equipamento._meta.get_field('foto').storage
+        trabalhos = [(storage.path(nome), options['forcar']) for nome in fotos.iterator()]
+
+        if options['processos'] > 1 and len(trabalhos) > 1:
+            with ProcessPoolExecutor(max_workers=options['processos']) as pool:
+                resultados = list(pool.map(processar_foto, trabalhos, chunksize=8))
+        else:
+            resultados = [processar_foto(trabalho) for trabalho in trabalhos]
+
+        geradas = sum(1 for _, gravadas, _ in resultados if gravadas)
+        for caminho, _, erro in resultados:
+            if erro:
+                self.stderr.write(f"❌ {caminho}: {erro}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {geradas} fotos com miniaturas novas ({len(trabalhos) - geradas} já estavam prontas ou falharam)."
+        ))
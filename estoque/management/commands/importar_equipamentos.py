@@ -0,0 +1,63 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from estoque.importacao import importar_planilha
+from estoque.models import MATRIZ, Filial
+
+
+# ==============================================================================
+# COMANDO: python manage.py importar_equipamentos planilha.csv --usuario secretaria [--filial ID]
+# ==============================================================================
+# Cadastra/atualiza os itens da planilha (CSV ou XLSX) e lança a quantidade como
+# ENTRADA no estoque da filial (padrão: Matriz). As linhas com erro são listadas
+# no final (e no --relatorio).
+class Command(BaseCommand):
+    help = "Importa equipamentos e quantidades de uma planilha CSV ou XLSX."
+
+    def add_arguments(self, parser):
+        parser.add_argument('arquivo', help="Caminho do .csv ou .xlsx.")
+        parser.add_argument('--usuario', required=True, help="Usuário que fica registrado nas entradas.")
+        parser.add_argument('--relatorio', help="Grava as linhas com erro neste arquivo CSV.")
+        parser.add_argument('--filial', type=int, default=MATRIZ, help="Id da filial que recebe as quantidades.")
+
+    def handle(self, *args, **options):
+        try:
+            autor = User.objects.get(username=options['usuario'])
+        except User.DoesNotExist:
+            raise CommandError(f"Usuário '{options['usuario']}' não existe.")
+        if not Filial.objects.filter(pk=options['filial']).exists():
+            raise CommandError(f"Filial {options['filial']} não existe.")
+
+        inicio = time.perf_counter()
+        try:
+            with open(options['arquivo'], 'rb') as arquivo:
+                resultado = importar_planilha(arquivo, options['arquivo'], autor, options['filial'])
+        except (OSError, ValueError) as erro:
+            raise CommandError(str(erro))
+
+        for linha, motivo in resultado['erros'][:50]:
+            self.stderr.write(f"❌ Linha {linha}: {motivo}")
+        if len(resultado['erros']) > 50:
+            self.stderr.write(f"... e mais {len(resultado['erros']) - 50} linhas com erro.")
+
+        if resultado['interrompido']:
+            linha, motivo = resultado['interrompido']
+            self.stderr.write(self.style.ERROR(
+                f"⛔ A leitura parou na linha {linha}: {motivo} As linhas de cima já foram importadas: "
+                f"envie só da linha {linha} em diante."
+            ))
+
+        if options['relatorio'] and resultado['erros']:
+            import csv
+            with open(options['relatorio'], 'w', newline='', encoding='utf-8') as saida:
+                escritor = csv.writer(saida)
+                escritor.writerow(['linha', 'erro'])
+                escritor.writerows(resultado['erros'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ {resultado['linhas']} linhas em {time.perf_counter() - inicio:.1f}s: "
+            f"{resultado['criados']} itens novos, {resultado['atualizados']} atualizados, "
+            f"{resultado['entradas']} unidades de entrada, {len(resultado['erros'])} linhas com erro."
+        ))
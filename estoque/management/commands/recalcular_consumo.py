@@ -0,0 +1,29 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from estoque.consumo import refazer_consumo
+
+
+# ==============================================================================
+# COMANDO: python manage.py recalcular_consumo [--inicio AAAA-MM-DD] [--fim AAAA-MM-DD]
+# ==============================================================================
+# Refaz a tabela de consumo diário a partir do histórico, se ela ficar diferente
+# dele (a migração 0013 já somou o histórico que existia). Sem datas, refaz tudo.
+class Command(BaseCommand):
+    help = "Recalcula o consumo diário (base da previsão de dias de estoque) a partir do histórico."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inicio', help="Primeiro dia (AAAA-MM-DD).")
+        parser.add_argument('--fim', help="Último dia (AAAA-MM-DD).")
+
+    def handle(self, *args, **options):
+        try:
+            inicio = date.fromisoformat(options['inicio']) if options['inicio'] else None
+            fim = date.fromisoformat(options['fim']) if options['fim'] else None
+        except ValueError:
+            raise CommandError("Datas no formato AAAA-MM-DD.")
+
+        linhas = refazer_consumo(inicio, fim)
+        periodo = f"de {inicio or 'o início'} até {fim or 'hoje'}"
+        self.stdout.write(self.style.SUCCESS(f"✅ Consumo diário recalculado {periodo}: {linhas} linhas."))
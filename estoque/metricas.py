@@ -0,0 +1,200 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger('estoque.metricas')
+
+# ==============================================================================
+# MÉTRICAS (Tempo por rota, consultas SQL e PDF, no formato do Prometheus)
+# ==============================================================================
+# O MetricasMiddleware mede cada requisição e guarda, por rota (o padrão da URL,
+# ex. "/admin/estoque/equipamento/<path:object_id>/change/", não o endereço com o id):
+#   - tempo de resposta (histograma)
+#   - quantas consultas SQL e quanto tempo no banco (connection.execute_wrapper)
+# A fila de relatórios manda o tempo de montagem de cada PDF (fila.py).
+#
+# /metrics devolve tudo em texto do Prometheus. Só para staff logado ou para os
+# IPs de settings.METRICAS_IPS_PERMITIDOS (o coletor não faz login).
+#
+# N+1: a mesma consulta (mesmo SQL, só os parâmetros mudam) repetida
+# METRICAS_LIMITE_REPETICOES vezes ou mais numa requisição vai para o log
+# "estoque.metricas" com a rota e o SQL. Quase sempre é um select_related faltando.
+# Só SELECT com poucos parâmetros conta: gravação e leitura por lote não são N+1.
+#
+# Custo: por consulta, dois perf_counter e uma soma num dicionário; por requisição,
+# uma trava rápida. Fica ligado em produção.
+#
+# Atenção: os números são de cada processo (como o cache LocMem). Com vários
+# processos, cada um conta as próprias requisições desde que subiu.
+# Resposta em streaming (exportação CSV): o tempo e as consultas vão até a resposta
+# sair da view; as linhas lidas durante o envio não entram na conta.
+LIMITE_REPETICOES_PADRAO = 10
+# SELECT com tantos parâmetros assim é leitura de um lote (IN de uma lista), não de uma linha
+PARAMETROS_DE_LOTE = 50
+SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SEGUNDOS_PDF = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+CONSULTAS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+SEM_ROTA = '(sem rota)'
+
+
+class Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)  # a última é o "+Inf"
+        self.soma = 0.0
+
+    def observar(self, valor):
+        self.contagens[bisect_left(self.limites, valor)] += 1
+        self.soma += valor
+
+    def linhas(self, nome, rotulos):
+        acumulado = 0
+        for limite, contagem in zip((*self.limites, '+Inf'), self.contagens):
+            acumulado += contagem
+            yield f'{nome}_bucket{_rotulos({**rotulos, "le": limite})} {acumulado}'
+        yield f'{nome}_sum{_rotulos(rotulos)} {self.soma:.6f}'
+        yield f'{nome}_count{_rotulos(rotulos)} {acumulado}'
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(rotulos):
+    if not rotulos:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in rotulos.items()) + '}'
+
+
+class Registro:
+    def __init__(self):
+        self._trava = threading.Lock()
+        self.zerar()
+
+    def zerar(self):
+        with self._trava:
+            self._tempo = {}         # (rota, método) -> Histograma
+            self._consultas = {}     # rota -> Histograma
+            self._tempo_sql = Counter()
+            self._respostas = Counter()  # (rota, método, "2xx") -> total
+            self._n_mais_1 = Counter()
+            self._pdf = Histograma(SEGUNDOS_PDF)
+
+    def requisicao(self, rota, metodo, status, segundos, consultas, segundos_sql, n_mais_1):
+        with self._trava:
+            chave = (rota, metodo)
+            if chave not in self._tempo:
+                self._tempo[chave] = Histograma(SEGUNDOS)
+            self._tempo[chave].observar(segundos)
+            if rota not in self._consultas:
+                self._consultas[rota] = Histograma(CONSULTAS)
+            self._consultas[rota].observar(consultas)
+            self._tempo_sql[rota] += segundos_sql
+            self._respostas[(rota, metodo, f'{status // 100}xx')] += 1
+            if n_mais_1:
+                self._n_mais_1[rota] += n_mais_1
+
+    def relatorio(self, segundos):
+        with self._trava:
+            self._pdf.observar(segundos)
+
+    def texto(self):
+        with self._trava:
+            linhas = [
+                '# HELP estoque_http_segundos Tempo de resposta por rota.',
+                '# TYPE estoque_http_segundos histogram',
+            ]
+            for (rota, metodo), histograma in sorted(self._tempo.items()):
+                linhas += histograma.linhas('estoque_http_segundos', {'rota': rota, 'metodo': metodo})
+
+            linhas += ['# HELP estoque_http_respostas_total Respostas por rota e classe de status.',
+                       '# TYPE estoque_http_respostas_total counter']
+            for (rota, metodo, status), total in sorted(self._respostas.items()):
+                linhas.append(f'estoque_http_respostas_total'
+                              f'{_rotulos({"rota": rota, "metodo": metodo, "status": status})} {total}')
+
+            linhas += ['# HELP estoque_sql_consultas Consultas SQL por requisição.',
+                       '# TYPE estoque_sql_consultas histogram']
+            for rota, histograma in sorted(self._consultas.items()):
+                linhas += histograma.linhas('estoque_sql_consultas', {'rota': rota})
+
+            linhas += ['# HELP estoque_sql_segundos_total Tempo gasto no banco por rota.',
+                       '# TYPE estoque_sql_segundos_total counter']
+            for rota, segundos in sorted(self._tempo_sql.items()):
+                linhas.append(f'estoque_sql_segundos_total{_rotulos({"rota": rota})} {segundos:.6f}')
+
+            linhas += ['# HELP estoque_n_mais_1_total Consultas repetidas (N+1) detectadas por rota.',
+                       '# TYPE estoque_n_mais_1_total counter']
+            for rota, total in sorted(self._n_mais_1.items()):
+                linhas.append(f'estoque_n_mais_1_total{_rotulos({"rota": rota})} {total}')
+
+            linhas += ['# HELP estoque_relatorio_pdf_segundos Tempo de montagem de cada PDF.',
+                       '# TYPE estoque_relatorio_pdf_segundos histogram']
+            linhas += self._pdf.linhas('estoque_relatorio_pdf_segundos', {})
+        return '\n'.join(linhas) + '\n'
+
+
+registro = Registro()
+
+
+# Conta cada consulta da requisição (ligado só durante ela, na conexão da thread)
+class ContadorSql:
+    def __init__(self):
+        self.consultas = 0
+        self.segundos = 0.0
+        self.repeticoes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        inicio = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.segundos += time.perf_counter() - inicio
+            self.consultas += 1
+            # N+1 é leitura linha a linha. INSERT/UPDATE em lotes do mesmo tamanho
+            # (importação, UPDATE agrupado do saldos.py) e SELECT de um lote inteiro
+            # (IN com a lista do lote) repetem o SQL de propósito.
+            if (not many and sql.lstrip()[:6].upper() == 'SELECT'
+                    and len(params or ()) < PARAMETROS_DE_LOTE):
+                self.repeticoes[sql] += 1
+
+
+def _rota(request):
+    # Endereço que não bateu com nenhuma URL (404) fica numa rota só
+    match = getattr(request, 'resolver_match', None)
+    return SEM_ROTA if match is None else f'/{match.route}'
+
+
+class MetricasMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        contador = ContadorSql()
+        inicio = time.perf_counter()
+        with connection.execute_wrapper(contador):
+            response = self.get_response(request)
+        segundos = time.perf_counter() - inicio
+
+        rota = _rota(request)
+        limite = getattr(settings, 'METRICAS_LIMITE_REPETICOES', LIMITE_REPETICOES_PADRAO)
+        repetidas = [(sql, vezes) for sql, vezes in contador.repeticoes.items() if vezes >= limite]
+        for sql, vezes in repetidas:
+            logger.warning("N+1 em %s %s: %d consultas iguais: %s", request.method, rota, vezes, sql[:300])
+
+        registro.requisicao(rota, request.method, response.status_code, segundos,
+                            contador.consultas, contador.segundos, len(repetidas))
+        return response
+
+
+def metricas(request):
+    permitidos = getattr(settings, 'METRICAS_IPS_PERMITIDOS', ())
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in permitidos:
+        return HttpResponseForbidden("Sem permissão para ver as métricas.")
+    return HttpResponse(registro.texto(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,35 @@
+# Generated by Django 6.0.1 on 2026-10-18 20:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0006_alter_ordemmovimentacao_tipo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='equipamento',
+            index=models.Index(fields=['nome'], name='eqp_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='equipamento',
+            index=models.Index(fields=['tipo', 'nome'], name='eqp_tipo_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['data'], name='mov_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['tecnico', 'data'], name='mov_tecnico_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['equipamento', 'data'], name='mov_equipamento_data_idx'),
+        ),
+    ]
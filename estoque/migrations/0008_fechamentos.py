@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0007_indices_historico'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Fechamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateTimeField(db_index=True)),
+                ('ultima_movimentacao', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Fechamento de Saldos',
+                'verbose_name_plural': 'Fechamentos de Saldos',
+            },
+        ),
+        migrations.CreateModel(
+            name='SaldoFechamento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.IntegerField()),
+                ('equipamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='estoque.equipamento')),
+                ('fechamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos', to='estoque.fechamento')),
+                ('tecnico', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fechamento', 'tecnico', 'equipamento'], name='saldofech_busca_idx')],
+            },
+        ),
+    ]
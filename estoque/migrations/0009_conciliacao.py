@@ -0,0 +1,41 @@
+# Generated by Django 6.0.1 on 2026-10-18 21:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0008_fechamentos'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conciliacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateTimeField(blank=True, null=True)),
+                ('ultima_movimentacao', models.PositiveBigIntegerField(default=0)),
+                ('valida', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Conciliação',
+                'verbose_name_plural': 'Conciliações',
+            },
+        ),
+        migrations.CreateModel(
+            name='SaldoConciliado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.IntegerField(default=0)),
+                ('equipamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='estoque.equipamento')),
+                ('tecnico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tecnico', 'equipamento'), name='saldoconciliado_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 6.0.1 on 2026-10-18 22:05
+
+from django.db import migrations, models
+
+
+# Itens já cadastrados em duplicidade (mesmo nome e tipo) ganham o id no nome,
+# senão a regra de nome+tipo único não entra. Nada é apagado nem juntado.
+def renomear_duplicados(apps, schema_editor):
+    Equipamento = apps.get_model('estoque', 'Equipamento')
+    vistos = set()
+    for equipamento in Equipamento.objects.order_by('id').only('id', 'nome', 'tipo').iterator():
+        chave = (equipamento.nome, equipamento.tipo)
+        if chave in vistos:
+            equipamento.nome = f"{equipamento.nome[:90]} (#{equipamento.id})"
+            equipamento.save(update_fields=['nome'])
+        vistos.add(chave)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0009_conciliacao'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='movimentacao',
+            name='tipo',
+            field=models.CharField(choices=[('SAIDA', '🔴 Retirada (Sai do Estoque -> Vai pro Técnico)'), ('DEVOLUCAO', '🟢 Devolução (Sai do Técnico -> Volta pro Estoque)'), ('BAIXA', '✅ Baixa em OS (Sai do Técnico -> Cliente/Lixo)'), ('ENTRADA', '📦 Entrada (Fornecedor/Importação -> Estoque)')], max_length=20),
+        ),
+        migrations.RunPython(renomear_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='equipamento',
+            constraint=models.UniqueConstraint(fields=('nome', 'tipo'), name='equipamento_nome_tipo_unico'),
+        ),
+    ]
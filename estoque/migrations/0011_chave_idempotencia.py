@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0010_importacao'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movimentacao',
+            name='chave_idempotencia',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
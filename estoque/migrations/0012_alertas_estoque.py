@@ -0,0 +1,59 @@
+# Generated by Django 6.0.1 on 2026-10-18 23:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from estoque.banco import criar_gatilho_alertas, remover_gatilho_alertas
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0011_chave_idempotencia'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AlertaEstoque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('ENTROU', '⚠️ Chegou no mínimo'), ('SAIU', '✅ Voltou ao normal')], max_length=10)),
+                ('quantidade', models.IntegerField()),
+                ('minimo', models.IntegerField()),
+                ('data', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Alerta de Estoque',
+                'verbose_name_plural': 'Alertas de Estoque',
+            },
+        ),
+        migrations.CreateModel(
+            name='EstoqueBaixo',
+            fields=[
+            ],
+            options={
+                'verbose_name': 'Item no Mínimo',
+                'verbose_name_plural': 'Itens no Mínimo',
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('estoque.equipamento',),
+        ),
+        migrations.AddField(
+            model_name='equipamento',
+            name='estoque_baixo',
+            field=models.GeneratedField(db_persist=True, expression=models.Q(('quantidade__lte', models.F('minimo'))), output_field=models.BooleanField(), verbose_name='Estoque Baixo'),
+        ),
+        migrations.AddIndex(
+            model_name='equipamento',
+            index=models.Index(condition=models.Q(('estoque_baixo', True)), fields=['nome'], name='eqp_baixo_nome_idx'),
+        ),
+        migrations.AddField(
+            model_name='alertaestoque',
+            name='equipamento',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='alertas', to='estoque.equipamento'),
+        ),
+        # Alertas gravados pelo próprio banco quando o item cruza o mínimo (ver banco.py)
+        migrations.RunPython(criar_gatilho_alertas, remover_gatilho_alertas),
+    ]
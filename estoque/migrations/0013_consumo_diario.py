@@ -0,0 +1,53 @@
+# Generated by Django 6.0.1 on 2026-10-18 23:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+# O histórico que já existe entra somado (mesma conta do comando "recalcular_consumo")
+def somar_historico(apps, schema_editor):
+    Movimentacao = apps.get_model('estoque', 'Movimentacao')
+    ConsumoDiario = apps.get_model('estoque', 'ConsumoDiario')
+    somas = (
+        Movimentacao.objects.order_by().annotate(dia_local=TruncDate('data'))
+        .values('dia_local', 'equipamento_id', 'tecnico_id', 'tipo')
+        .annotate(total=Sum('quantidade'), movimentos=Count('id'))
+    )
+    ConsumoDiario.objects.bulk_create(
+        (ConsumoDiario(dia=linha['dia_local'], equipamento_id=linha['equipamento_id'], tecnico_id=linha['tecnico_id'],
+                       tipo=linha['tipo'], quantidade=linha['total'], movimentos=linha['movimentos'])
+         for linha in somas.iterator(chunk_size=1000)),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0012_alertas_estoque'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConsumoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('tipo', models.CharField(choices=[('SAIDA', '🔴 Retirada (Sai do Estoque -> Vai pro Técnico)'), ('DEVOLUCAO', '🟢 Devolução (Sai do Técnico -> Volta pro Estoque)'), ('BAIXA', '✅ Baixa em OS (Sai do Técnico -> Cliente/Lixo)'), ('ENTRADA', '📦 Entrada (Fornecedor/Importação -> Estoque)')], max_length=20)),
+                ('quantidade', models.PositiveIntegerField(default=0)),
+                ('movimentos', models.PositiveIntegerField(default=0)),
+                ('equipamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='estoque.equipamento')),
+                ('tecnico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Consumo Diário',
+                'verbose_name_plural': 'Consumo Diário',
+                'constraints': [models.UniqueConstraint(fields=('dia', 'equipamento', 'tecnico', 'tipo'), name='consumo_unico')],
+            },
+        ),
+        migrations.RunPython(somar_historico, migrations.RunPython.noop),
+    ]
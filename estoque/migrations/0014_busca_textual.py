@@ -0,0 +1,18 @@
+# Generated by Django 6.0.1 on 2026-10-19 00:05
+
+from django.db import migrations
+
+from estoque.banco import criar_busca_textual, remover_busca_textual
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0013_consumo_diario'),
+    ]
+
+    operations = [
+        # Índices FTS5 de Equipamento (nome/especificações/observação) e Movimentacao (obs).
+        # Só no SQLite com FTS5; nos outros bancos a busca continua com LIKE (ver busca.py)
+        migrations.RunPython(criar_busca_textual, remover_busca_textual),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 6.0.1 on 2026-10-19 09:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0014_busca_textual'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArquivoMovimentacao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField(db_index=True)),
+                ('arquivo', models.CharField(max_length=255)),
+                ('primeira_movimentacao', models.PositiveBigIntegerField()),
+                ('ultima_movimentacao', models.PositiveBigIntegerField()),
+                ('linhas', models.PositiveIntegerField()),
+                ('data', models.DateTimeField()),
+                ('fechamento', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='estoque.fechamento')),
+            ],
+            options={
+                'verbose_name': 'Mês Arquivado',
+                'verbose_name_plural': 'Meses Arquivados',
+            },
+        ),
+        migrations.CreateModel(
+            name='SaldoArquivado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.IntegerField(default=0)),
+                ('equipamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='estoque.equipamento')),
+                ('tecnico', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('tecnico', 'equipamento'), name='saldoarquivado_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-19 11:15
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0015_arquivo_historico'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ordemmovimentacao',
+            name='rascunho',
+            field=models.BooleanField(default=False, help_text='Segura os itens para este técnico sem lançar. Desmarque e salve para lançar.', verbose_name='Só reservar (lançar depois)'),
+        ),
+        migrations.CreateModel(
+            name='Reserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.PositiveIntegerField()),
+                ('expira_em', models.DateTimeField()),
+                ('equipamento', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='estoque.equipamento')),
+                ('ordem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas', to='estoque.ordemmovimentacao')),
+            ],
+            options={
+                'verbose_name': 'Reserva de Estoque',
+                'verbose_name_plural': 'Reservas de Estoque',
+                'indexes': [models.Index(fields=['equipamento', 'expira_em'], name='reserva_ativa_idx')],
+            },
+        ),
+    ]
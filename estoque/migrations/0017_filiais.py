@@ -0,0 +1,140 @@
+# Generated by Django 6.0.1 on 2026-10-19 13:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from estoque.banco import (
+    criar_busca_textual, criar_gatilho_total_filiais, remover_busca_textual, remover_gatilho_total_filiais,
+)
+
+
+# A filial de sempre: primeira da tabela (id 1 = models.MATRIZ), dona do histórico antigo
+def criar_matriz(apps, schema_editor):
+    Filial = apps.get_model('estoque', 'Filial')
+    Filial.objects.create(nome='Matriz')
+
+
+# O estoque que já existe é todo da Matriz (o total do item não muda)
+def copiar_estoque(apps, schema_editor):
+    Equipamento = apps.get_model('estoque', 'Equipamento')
+    EstoqueFilial = apps.get_model('estoque', 'EstoqueFilial')
+    EstoqueFilial.objects.bulk_create(
+        (EstoqueFilial(filial_id=1, equipamento_id=pk, quantidade=quantidade)
+         for pk, quantidade in Equipamento.objects.exclude(quantidade=0).values_list('id', 'quantidade').iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('estoque', '0016_reservas'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Filial',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=60, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Filial',
+                'verbose_name_plural': 'Filiais',
+                'ordering': ['nome'],
+            },
+        ),
+        migrations.RunPython(criar_matriz, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='EstoqueFilial',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantidade', models.IntegerField(default=0, verbose_name='Estoque na Filial')),
+            ],
+            options={
+                'verbose_name': 'Estoque da Filial',
+                'verbose_name_plural': 'Estoques das Filiais',
+            },
+        ),
+        migrations.RemoveConstraint(
+            model_name='consumodiario',
+            name='consumo_unico',
+        ),
+        migrations.RemoveIndex(
+            model_name='reserva',
+            name='reserva_ativa_idx',
+        ),
+        migrations.AlterField(
+            model_name='consumodiario',
+            name='tipo',
+            field=models.CharField(choices=[('SAIDA', '🔴 Retirada (Sai do Estoque -> Vai pro Técnico)'), ('DEVOLUCAO', '🟢 Devolução (Sai do Técnico -> Volta pro Estoque)'), ('BAIXA', '✅ Baixa em OS (Sai do Técnico -> Cliente/Lixo)'), ('ENTRADA', '📦 Entrada (Fornecedor/Importação -> Estoque)'), ('TRANSF_SAIDA', '🚚 Transferência (Sai desta Filial -> Outra Filial)'), ('TRANSF_ENTRADA', '🚚 Transferência (Outra Filial -> Chega nesta Filial)')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='movimentacao',
+            name='tipo',
+            field=models.CharField(choices=[('SAIDA', '🔴 Retirada (Sai do Estoque -> Vai pro Técnico)'), ('DEVOLUCAO', '🟢 Devolução (Sai do Técnico -> Volta pro Estoque)'), ('BAIXA', '✅ Baixa em OS (Sai do Técnico -> Cliente/Lixo)'), ('ENTRADA', '📦 Entrada (Fornecedor/Importação -> Estoque)'), ('TRANSF_SAIDA', '🚚 Transferência (Sai desta Filial -> Outra Filial)'), ('TRANSF_ENTRADA', '🚚 Transferência (Outra Filial -> Chega nesta Filial)')], max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='ordemmovimentacao',
+            name='tipo',
+            field=models.CharField(choices=[('SAIDA', '🔴 Retirada (Sai do Estoque -> Vai pro Técnico)'), ('DEVOLUCAO', '🟢 Devolução (Sai do Técnico -> Volta pro Estoque)'), ('BAIXA', '✅ Baixa em OS (Sai do Técnico -> Cliente/Lixo)'), ('TRANSFERENCIA', '🚚 Transferência (Sai desta Filial -> Filial de destino)')], default='SAIDA', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='estoquefilial',
+            name='equipamento',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='saldos_filial', to='estoque.equipamento'),
+        ),
+        migrations.AddField(
+            model_name='estoquefilial',
+            name='filial',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='saldos', to='estoque.filial'),
+        ),
+        migrations.AddField(
+            model_name='consumodiario',
+            name='filial',
+            field=models.ForeignKey(db_default=1, default=1, on_delete=django.db.models.deletion.CASCADE, to='estoque.filial'),
+        ),
+        migrations.AddField(
+            model_name='movimentacao',
+            name='filial',
+            field=models.ForeignKey(db_default=1, default=1, on_delete=django.db.models.deletion.PROTECT, related_name='movimentacoes', to='estoque.filial'),
+        ),
+        migrations.AddField(
+            model_name='ordemmovimentacao',
+            name='filial',
+            field=models.ForeignKey(db_default=1, default=1, on_delete=django.db.models.deletion.PROTECT, related_name='ordens', to='estoque.filial'),
+        ),
+        migrations.AddField(
+            model_name='ordemmovimentacao',
+            name='filial_destino',
+            field=models.ForeignKey(blank=True, help_text='Só na transferência: quem recebe os itens.', null=True, on_delete=django.db.models.deletion.PROTECT, related_name='ordens_recebidas', to='estoque.filial', verbose_name='Filial de destino'),
+        ),
+        migrations.AddField(
+            model_name='reserva',
+            name='filial',
+            field=models.ForeignKey(db_default=1, default=1, on_delete=django.db.models.deletion.CASCADE, to='estoque.filial'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['filial', 'data'], name='mov_filial_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['equipamento', 'filial', 'expira_em'], name='reserva_ativa_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='consumodiario',
+            constraint=models.UniqueConstraint(fields=('dia', 'equipamento', 'tecnico', 'tipo', 'filial'), name='consumo_unico'),
+        ),
+        migrations.AddConstraint(
+            model_name='estoquefilial',
+            constraint=models.UniqueConstraint(fields=('filial', 'equipamento'), name='estoquefilial_unico'),
+        ),
+        migrations.RunPython(copiar_estoque, migrations.RunPython.noop),
+        # Soma de cada filial no total do item (Equipamento.quantidade)
+        migrations.RunPython(criar_gatilho_total_filiais, remover_gatilho_total_filiais),
+        # A tabela de movimentações foi recriada (SQLite): os gatilhos da busca somem junto
+        migrations.RunPython(criar_busca_textual, remover_busca_textual),
+    ]
@@ -1,6 +1,12 @@
-from django.db import models
-from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.contrib.auth.models import User
+
+from .imagens import nome_miniatura
+
+# Filial que já existia antes das filiais (criada pela migração 0017). É o padrão de
+# tudo que não diz de qual filial é: histórico antigo, app de campo, importação.
+MATRIZ = 1
 
 # ==============================================================================
 # 1. O Equipamento (O que existe na empresa) - MANTIDO ORIGINAL
@@ -25,10 +31,38 @@ class Equipamento(models.Model):
     # Controle de Quantidade
     quantidade = models.IntegerField(default=0, verbose_name="Estoque na Empresa")
     minimo = models.IntegerField(default=5, verbose_name="Alerta Mínimo")
+    # Calculado pelo próprio banco a cada UPDATE (inclusive os em lote do motor de saldos)
+    # e indexado: "itens no mínimo" vira uma busca no índice, sem varrer o catálogo
+    estoque_baixo = models.GeneratedField(
+        expression=models.Q(quantidade__lte=models.F('minimo')),
+        output_field=models.BooleanField(), db_persist=True, verbose_name="Estoque Baixo",
+    )
+
+    class Meta:
+        constraints = [
+            # Mesmo nome + mesmo tipo = mesmo item (a importação atualiza em vez de duplicar)
+            models.UniqueConstraint(fields=['nome', 'tipo'], name='equipamento_nome_tipo_unico'),
+        ]
+        indexes = [
+            # Painel, PDF e busca do admin ordenam por nome (e o painel filtra por tipo)
+            models.Index(fields=['nome'], name='eqp_nome_idx'),
+            models.Index(fields=['tipo', 'nome'], name='eqp_tipo_nome_idx'),
+            # Só os itens no mínimo (índice parcial: cresce com os alertas, não com o catálogo)
+            models.Index(fields=['nome'], condition=models.Q(estoque_baixo=True), name='eqp_baixo_nome_idx'),
+        ]
 
     def __str__(self):
         return f"{self.nome} (Qtd: {self.quantidade})"
 
+    # Miniaturas da foto para o card (geradas no upload, ver imagens.py)
+    @property
+    def foto_mini_webp(self):
+        return self.foto.storage.url(nome_miniatura(self.foto.name, 'webp')) if self.foto else ''
+
+    @property
+    def foto_mini_jpg(self):
+        return self.foto.storage.url(nome_miniatura(self.foto.name, 'jpg')) if self.foto else ''
+
 # ==============================================================================
 # 2. O Estoque do Técnico (O que está com ele/Dívida) - MANTIDO ORIGINAL
 # ==============================================================================
@@ -53,64 +87,64 @@ class Movimentacao(models.Model):
         ('SAIDA', '🔴 Retirada (Sai do Estoque -> Vai pro Técnico)'),
         ('DEVOLUCAO', '🟢 Devolução (Sai do Técnico -> Volta pro Estoque)'),
         ('BAIXA', '✅ Baixa em OS (Sai do Técnico -> Cliente/Lixo)'),
+        ('ENTRADA', '📦 Entrada (Fornecedor/Importação -> Estoque)'),
+        # As duas pernas de uma transferência (sempre lançadas juntas pelo lote)
+        ('TRANSF_SAIDA', '🚚 Transferência (Sai desta Filial -> Outra Filial)'),
+        ('TRANSF_ENTRADA', '🚚 Transferência (Outra Filial -> Chega nesta Filial)'),
     ]
 
     tecnico = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Técnico Responsável")
     equipamento = models.ForeignKey(Equipamento, on_delete=models.CASCADE)
+    # Estoque de qual filial o movimento mexe (a carteira do técnico é uma só)
+    filial = models.ForeignKey('Filial', on_delete=models.PROTECT, default=MATRIZ, db_default=MATRIZ,
+                               related_name='movimentacoes')
     tipo = models.CharField(max_length=20, choices=TIPO_MOVIMENTO)
     quantidade = models.PositiveIntegerField()
     obs = models.CharField(max_length=100, blank=True, null=True, verbose_name="OBS / Nº da OS")
     data = models.DateTimeField(auto_now_add=True)
     autor_movimento = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='autor_log', verbose_name="Quem registrou")
+    # Chave gerada pelo app de campo para cada lançamento: se o celular reenviar
+    # (sinal caiu no meio), o índice único impede a movimentação em dobro
+    chave_idempotencia = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
 
     # --- NOVIDADE: A validação (clean) acontece ANTES de salvar ---
     def clean(self):
-        # Se for edição (self.pk existe), não validamos saldo para evitar bloqueios antigos
-        if self.pk is None:
-            # Pega ou cria a carteira do técnico para conferir o saldo
-            carteira, created = EstoqueTecnico.objects.get_or_create(tecnico=self.tecnico, equipamento=self.equipamento)
-
-            # Validação 1: Empresa tem saldo para SAIDA?
-            if self.tipo == 'SAIDA':
-                if self.equipamento.quantidade < self.quantidade:
-                    raise ValidationError(f"Estoque Insuficiente! A empresa só tem {self.equipamento.quantidade} unidades.")
+        from .saldos import conferir_saldo
 
-            # Validação 2: Técnico tem saldo para DEVOLUCAO?
-            elif self.tipo == 'DEVOLUCAO':
-                if carteira.quantidade < self.quantidade:
-                    raise ValidationError(f"Erro no Saldo! O técnico {self.tecnico.username} só tem {carteira.quantidade} em mãos.")
-
-            # Validação 3: Técnico tem saldo para BAIXA?
-            elif self.tipo == 'BAIXA':
-                if carteira.quantidade < self.quantidade:
-                    raise ValidationError(f"Não pode dar Baixa! O técnico tem apenas {carteira.quantidade} unidades deste item.")
+        # Se for edição (self.pk existe), não validamos saldo para evitar bloqueios antigos
+        # Só lê o saldo (1 consulta): não cria carteira vazia só para conferir
+        if self.pk is None and self.tecnico_id and self.equipamento_id and self.quantidade:
+            conferir_saldo(self.tecnico, self.equipamento, self.tipo, self.quantidade, self.filial_id)
 
     # --- AÇÃO: O save só executa se o clean passar ---
     def save(self, *args, **kwargs):
-        if self.pk is None: 
-            carteira, created = EstoqueTecnico.objects.get_or_create(tecnico=self.tecnico, equipamento=self.equipamento)
-
-            # Executa a movimentação matemática
-            if self.tipo == 'SAIDA':
-                self.equipamento.quantidade -= self.quantidade
-                carteira.quantidade += self.quantidade
+        from .saldos import aplicar_movimento
+        from .signals import movimentacoes_lancadas
 
-            elif self.tipo == 'DEVOLUCAO':
-                self.equipamento.quantidade += self.quantidade
-                carteira.quantidade -= self.quantidade
-
-            elif self.tipo == 'BAIXA':
-                carteira.quantidade -= self.quantidade
-            
-            # Salva os saldos atualizados
-            self.equipamento.save()
-            carteira.save()
+        if self.pk is None:
+            # Saldo e histórico entram juntos: se um falhar, nada é gravado.
+            # O motor de saldos confere de novo dentro do UPDATE, então mesmo com
+            # várias secretárias lançando ao mesmo tempo o estoque não fica negativo.
+            with transaction.atomic():
+                aplicar_movimento(self.tecnico, self.equipamento, self.tipo, self.quantidade, self.filial_id)
+                super().save(*args, **kwargs)
+                movimentacoes_lancadas.send(sender=Movimentacao, movimentacoes=[self])
+            return
 
         super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = "Registrar Movimentação"
         verbose_name_plural = "Registrar Movimentações"
+        indexes = [
+            # Histórico mais recente primeiro (admin e PDF) e filtro por período
+            models.Index(fields=['data'], name='mov_data_idx'),
+            # Histórico de um técnico / de um item, já na ordem de data
+            models.Index(fields=['tecnico', 'data'], name='mov_tecnico_data_idx'),
+            models.Index(fields=['equipamento', 'data'], name='mov_equipamento_data_idx'),
+            # Histórico de uma filial (admin, PDF e exportação filtrados por filial)
+            models.Index(fields=['filial', 'data'], name='mov_filial_data_idx'),
+        ]
     
     def __str__(self):
         return f"{self.tipo} - {self.equipamento.nome} ({self.quantidade})"
@@ -128,17 +162,75 @@ class OrdemMovimentacao(models.Model):
         ('SAIDA', '🔴 Retirada (Sai do Estoque -> Vai pro Técnico)'),
         ('DEVOLUCAO', '🟢 Devolução (Sai do Técnico -> Volta pro Estoque)'),
         ('BAIXA', '✅ Baixa em OS (Sai do Técnico -> Cliente/Lixo)'),
+        ('TRANSFERENCIA', '🚚 Transferência (Sai desta Filial -> Filial de destino)'),
     ], default='SAIDA')
+    # Filial de onde os itens saem (ou para onde voltam, na devolução)
+    filial = models.ForeignKey('Filial', on_delete=models.PROTECT, default=MATRIZ, db_default=MATRIZ,
+                               related_name='ordens')
+    filial_destino = models.ForeignKey(
+        'Filial', on_delete=models.PROTECT, null=True, blank=True, related_name='ordens_recebidas',
+        verbose_name="Filial de destino", help_text="Só na transferência: quem recebe os itens.",
+    )
     
     data = models.DateTimeField(auto_now_add=True)
     obs = models.TextField(blank=True, null=True, verbose_name="Observação do Lote")
 
     # Trava de segurança para não lançar 2x se editar o pedido
     lancado = models.BooleanField(default=False, editable=False)
+    # Kit ainda sendo separado: só segura o estoque dos itens (ver reservas.py)
+    rascunho = models.BooleanField(
+        default=False, verbose_name="Só reservar (lançar depois)",
+        help_text="Segura os itens para este técnico sem lançar. Desmarque e salve para lançar.",
+    )
 
     def __str__(self):
         return f"Lote #{self.id} - {self.tecnico.username} ({self.get_tipo_display()})"
 
+    def clean(self):
+        if self.tipo == 'TRANSFERENCIA':
+            if not self.filial_destino_id:
+                raise ValidationError({'filial_destino': "Escolha a filial que recebe a transferência."})
+            if self.filial_destino_id == self.filial_id:
+                raise ValidationError({'filial_destino': "A filial de destino é a mesma de origem."})
+        elif self.filial_destino_id:
+            raise ValidationError({'filial_destino': "Filial de destino é só para transferência."})
+
+    # Lança todos os itens do lote de uma vez (tudo ou nada).
+    # Se algum item não tiver saldo, levanta ValidationError com a lista dos itens que falharam.
+    def lancar(self, autor):
+        from .saldos import lancar_movimentos
+
+        # Transferência = duas movimentações por item, no mesmo lote: sai da origem e
+        # chega no destino (o total da empresa não muda, e o histórico mostra as duas)
+        if self.tipo == 'TRANSFERENCIA':
+            pernas = [('TRANSF_SAIDA', self.filial_id), ('TRANSF_ENTRADA', self.filial_destino_id)]
+        else:
+            pernas = [(self.tipo, self.filial_id)]
+
+        movimentacoes = [
+            Movimentacao(
+                tecnico=self.tecnico,
+                equipamento=item.equipamento,
+                tipo=tipo,
+                filial_id=filial_id,
+                quantidade=item.quantidade,
+                obs=f"Lote #{self.id} | {self.obs or ''}",
+                autor_movimento=autor,
+            )
+            for item in self.itemordem_set.select_related('equipamento')
+            for tipo, filial_id in pernas
+        ]
+
+        with transaction.atomic():
+            # Pode usar o que este lote reservou; lançado, a reserva acaba
+            lancar_movimentos(movimentacoes, reserva_de=self.pk)
+            self.reservas.all().delete()
+            self.lancado = True
+            self.rascunho = False
+            self.save(update_fields=['lancado', 'rascunho'])
+
+        return movimentacoes
+
     class Meta:
         verbose_name = "🔴 Lançamento em Lote (Vários Itens)"
         verbose_name_plural = "🔴 Lançamentos em Lote (Vários Itens)"
@@ -151,3 +243,231 @@ class ItemOrdem(models.Model):
 
     def __str__(self):
         return f"{self.quantidade}x {self.equipamento.nome}"
+
+
+# ==============================================================================
+# 5. FECHAMENTOS (Foto dos saldos num momento, para consultar o passado)
+# ==============================================================================
+# Gerados todo dia pelo comando "gerar_fechamento". O saldo de uma data antiga
+# parte do fechamento mais perto dela e só refaz as movimentações do meio
+# (ver fechamentos.py), em vez de refazer o histórico inteiro.
+class Fechamento(models.Model):
+    data = models.DateTimeField(db_index=True)
+    # Última movimentação que já estava nos saldos quando a foto foi tirada
+    ultima_movimentacao = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Fechamento de Saldos"
+        verbose_name_plural = "Fechamentos de Saldos"
+
+    def __str__(self):
+        return f"Fechamento de {self.data:%d/%m/%Y %H:%M}"
+
+
+class SaldoFechamento(models.Model):
+    fechamento = models.ForeignKey(Fechamento, on_delete=models.CASCADE, related_name='saldos')
+    equipamento = models.ForeignKey(Equipamento, on_delete=models.CASCADE)
+    # Vazio = estoque da empresa. Carteira zerada não é gravada.
+    tecnico = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    quantidade = models.IntegerField()
+
+    class Meta:
+        indexes = [models.Index(fields=['fechamento', 'tecnico', 'equipamento'], name='saldofech_busca_idx')]
+
+    def __str__(self):
+        dono = self.tecnico.username if self.tecnico_id else "Empresa"
+        return f"{dono}: {self.quantidade}x {self.equipamento.nome}"
+
+
+# ==============================================================================
+# 6. CONCILIAÇÃO (Carteiras x Histórico)
+# ==============================================================================
+# A carteira do técnico é 100% derivada do histórico: soma das movimentações dele.
+# Se alguém editar ou apagar uma movimentação no admin, a carteira não acompanha.
+# O comando "conciliar" refaz a conta e aponta (ou corrige) as diferenças.
+# Ponto de parada (uma linha só): até qual movimentação os saldos esperados já foram somados
+class Conciliacao(models.Model):
+    data = models.DateTimeField(null=True, blank=True)
+    ultima_movimentacao = models.PositiveBigIntegerField(default=0)
+    # Desligado quando uma movimentação já somada é editada/apagada: a próxima conciliação refaz do zero
+    valida = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = "Conciliação"
+        verbose_name_plural = "Conciliações"
+
+    def __str__(self):
+        return f"Conciliação até a movimentação #{self.ultima_movimentacao}"
+
+
+# Saldo que cada carteira deveria ter segundo o histórico (até Conciliacao.ultima_movimentacao)
+class SaldoConciliado(models.Model):
+    tecnico = models.ForeignKey(User, on_delete=models.CASCADE)
+    equipamento = models.ForeignKey(Equipamento, on_delete=models.CASCADE)
+    quantidade = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['tecnico', 'equipamento'], name='saldoconciliado_unico')]
+
+
+# ==============================================================================
+# 7. ALERTAS DE ESTOQUE BAIXO (Quando o item cruza o mínimo)
+# ==============================================================================
+# Gravados por um gatilho no banco (migração 0012) sempre que estoque_baixo muda:
+# pega o admin, o lançamento avulso, o lote e a importação, sem depender de sinal.
+class AlertaEstoque(models.Model):
+    TIPO_ALERTA = [
+        ('ENTROU', '⚠️ Chegou no mínimo'),
+        ('SAIU', '✅ Voltou ao normal'),
+    ]
+
+    equipamento = models.ForeignKey(Equipamento, on_delete=models.CASCADE, related_name='alertas')
+    tipo = models.CharField(max_length=10, choices=TIPO_ALERTA)
+    quantidade = models.IntegerField()
+    minimo = models.IntegerField()
+    data = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Alerta de Estoque"
+        verbose_name_plural = "Alertas de Estoque"
+
+    def __str__(self):
+        return f"{self.get_tipo_display()}: {self.equipamento.nome} ({self.quantidade}/{self.minimo})"
+
+
+# Mesma tabela de Equipamento, só os itens no mínimo (tela própria no admin)
+class EstoqueBaixo(Equipamento):
+    class Meta:
+        proxy = True
+        verbose_name = "Item no Mínimo"
+        verbose_name_plural = "Itens no Mínimo"
+
+
+# ==============================================================================
+# 8. CONSUMO DIÁRIO (Histórico somado por dia, base da previsão)
+# ==============================================================================
+# Uma linha por (dia, item, técnico, tipo, filial) com o total movimentado. Somada a cada
+# lançamento (ver consumo.py), então a previsão lê algumas dezenas de dias
+# agregados em vez de agrupar o histórico inteiro. Comando "recalcular_consumo"
+# refaz a tabela a partir do histórico.
+class ConsumoDiario(models.Model):
+    dia = models.DateField()
+    equipamento = models.ForeignKey(Equipamento, on_delete=models.CASCADE)
+    tecnico = models.ForeignKey(User, on_delete=models.CASCADE)
+    filial = models.ForeignKey('Filial', on_delete=models.CASCADE, default=MATRIZ, db_default=MATRIZ)
+    tipo = models.CharField(max_length=20, choices=Movimentacao.TIPO_MOVIMENTO)
+    quantidade = models.PositiveIntegerField(default=0)
+    movimentos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Consumo Diário"
+        verbose_name_plural = "Consumo Diário"
+        constraints = [
+            models.UniqueConstraint(fields=['dia', 'equipamento', 'tecnico', 'tipo', 'filial'], name='consumo_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.dia:%d/%m/%Y} {self.tipo} {self.quantidade}x {self.equipamento.nome}"
+
+
+# ==============================================================================
+# 9. ARQUIVO DO HISTÓRICO (Movimentações antigas fora do banco)
+# ==============================================================================
+# O comando "arquivar_movimentacoes" tira do banco os meses mais velhos que
+# settings.ARQUIVO_MESES e grava cada mês num .ndjson.gz em settings.ARQUIVO_ROOT
+# (ver arquivo.py). Relatório, exportação e saldos do passado continuam lendo o
+# histórico inteiro pelo historico.py. Uma linha aqui por arquivo gravado.
+class ArquivoMovimentacao(models.Model):
+    mes = models.DateField(db_index=True)  # primeiro dia do mês (fuso local)
+    arquivo = models.CharField(max_length=255)  # nome dentro de ARQUIVO_ROOT
+    primeira_movimentacao = models.PositiveBigIntegerField()
+    ultima_movimentacao = models.PositiveBigIntegerField()
+    linhas = models.PositiveIntegerField()
+    data = models.DateTimeField()
+    # Foto dos saldos tirada logo antes de apagar as linhas do banco
+    fechamento = models.ForeignKey(Fechamento, on_delete=models.SET_NULL, null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Mês Arquivado"
+        verbose_name_plural = "Meses Arquivados"
+
+    def __str__(self):
+        return f"{self.mes:%m/%Y}: {self.linhas} movimentações"
+
+
+# Soma (lado do técnico) de tudo que já foi arquivado: a conciliação do zero parte daqui
+class SaldoArquivado(models.Model):
+    tecnico = models.ForeignKey(User, on_delete=models.CASCADE)
+    equipamento = models.ForeignKey(Equipamento, on_delete=models.CASCADE)
+    quantidade = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['tecnico', 'equipamento'], name='saldoarquivado_unico')]
+
+
+# ==============================================================================
+# 10. RESERVAS (Estoque segurado por lotes em rascunho)
+# ==============================================================================
+# Lote de retirada marcado "Só reservar" grava uma reserva por item, com validade
+# (settings.RESERVA_MINUTOS). Disponível = quantidade - reservas ativas dos outros
+# lotes: é o número que a validação e o painel usam (ver reservas.py). Reserva
+# vencida não conta mais e é apagada na próxima reserva.
+class Reserva(models.Model):
+    ordem = models.ForeignKey(OrdemMovimentacao, on_delete=models.CASCADE, related_name='reservas')
+    equipamento = models.ForeignKey(Equipamento, on_delete=models.CASCADE, related_name='reservas')
+    # Mesma filial do lote (repetida aqui para a soma por filial sair do índice)
+    filial = models.ForeignKey('Filial', on_delete=models.CASCADE, default=MATRIZ, db_default=MATRIZ)
+    quantidade = models.PositiveIntegerField()
+    expira_em = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Reserva de Estoque"
+        verbose_name_plural = "Reservas de Estoque"
+        indexes = [
+            # Soma das reservas ativas de um item (na empresa toda ou numa filial):
+            # só as linhas ainda válidas daquele item
+            models.Index(fields=['equipamento', 'filial', 'expira_em'], name='reserva_ativa_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantidade}x {self.equipamento.nome} (Lote #{self.ordem_id})"
+
+
+# ==============================================================================
+# 11. FILIAIS (Estoque da empresa separado por local)
+# ==============================================================================
+# Cada filial tem o próprio estoque de cada item (EstoqueFilial), mexido pelas
+# movimentações daquela filial. Equipamento.quantidade continua sendo o total da
+# empresa (soma das filiais), mantido pelo próprio banco: um gatilho soma no
+# Equipamento cada mudança do EstoqueFilial (ver banco.py). Assim o alerta de
+# estoque baixo, os fechamentos e a previsão da empresa toda seguem iguais.
+# Entre filiais, só por transferência (lote do tipo Transferência).
+class Filial(models.Model):
+    nome = models.CharField(max_length=60, unique=True)
+
+    class Meta:
+        verbose_name = "Filial"
+        verbose_name_plural = "Filiais"
+        ordering = ['nome']
+
+    def __str__(self):
+        return self.nome
+
+
+# Linha criada na primeira entrada do item na filial (ou no cadastro, para a
+# Matriz): item que nunca passou pela filial não tem linha, e o saldo é 0
+class EstoqueFilial(models.Model):
+    filial = models.ForeignKey(Filial, on_delete=models.PROTECT, related_name='saldos')
+    equipamento = models.ForeignKey(Equipamento, on_delete=models.CASCADE, related_name='saldos_filial')
+    quantidade = models.IntegerField(default=0, verbose_name="Estoque na Filial")
+
+    class Meta:
+        verbose_name = "Estoque da Filial"
+        verbose_name_plural = "Estoques das Filiais"
+        constraints = [
+            # Também é o índice do painel da filial: (filial, item) direto, sem varrer as outras
+            models.UniqueConstraint(fields=['filial', 'equipamento'], name='estoquefilial_unico'),
+        ]
+
+    def __str__(self):
+        return f"{self.filial.nome}: {self.quantidade}x {self.equipamento.nome}"
@@ -0,0 +1,80 @@
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.utils import timezone
+
+from .models import ConsumoDiario, Equipamento, EstoqueFilial
+from .signals import versao_estoque
+
+# ==============================================================================
+# PREVISÃO (Quantos dias o estoque da empresa ainda aguenta)
+# ==============================================================================
+# Consumo do dia = o que saiu para os técnicos (SAIDA) menos o que voltou (DEVOLUCAO),
+# lido da tabela ConsumoDiario dos últimos JANELA_DIAS dias. Os dias mais recentes
+# pesam mais (média exponencial com meia-vida MEIA_VIDA_DIAS).
+#
+# A conta é feita de uma vez para o catálogo inteiro: uma matriz item x dia no
+# NumPy, sem laço por item. O resultado fica no cache até o estoque mudar.
+# Com filial: só o consumo e o estoque daquela filial (painel com ?filial=).
+JANELA_DIAS = 60
+MEIA_VIDA_DIAS = 14
+TIPOS_CONSUMO = {'SAIDA': 1, 'DEVOLUCAO': -1}
+
+
+def _pesos(janela, meia_vida):
+    # Posição 0 = hoje. Soma 1: taxa ponderada = (consumo * pesos).sum()
+    pesos = 0.5 ** (np.arange(janela) / meia_vida)
+    return pesos / pesos.sum()
+
+
+# Devolve {equipamento_id: dias restantes (float)} para os itens com consumo na janela.
+# Item sem consumo não aparece (o estoque dele não está acabando).
+def calcular_dias_restantes(hoje=None, janela=JANELA_DIAS, meia_vida=MEIA_VIDA_DIAS, filial=None):
+    hoje = hoje or timezone.localdate()
+    inicio = hoje - timedelta(days=janela - 1)
+
+    # Só a janela da tabela diária (faixa do índice por dia), não o histórico.
+    # Linhas de técnicos diferentes no mesmo dia são somadas pelo np.add.at abaixo.
+    consumos = ConsumoDiario.objects.filter(dia__gte=inicio, dia__lte=hoje, tipo__in=TIPOS_CONSUMO)
+    if filial is not None:
+        consumos = consumos.filter(filial_id=filial)
+    linhas = list(consumos.values_list('equipamento_id', 'dia', 'tipo', 'quantidade'))
+    if not linhas:
+        return {}
+
+    equipamentos, dias, tipos, totais = zip(*linhas)
+    ids, linha_do_item = np.unique(np.array(equipamentos), return_inverse=True)
+    idade = np.array([(hoje - dia).days for dia in dias])
+    sinal = np.array([TIPOS_CONSUMO[tipo] for tipo in tipos])
+
+    consumo = np.zeros((len(ids), janela))
+    np.add.at(consumo, (linha_do_item, idade), sinal * np.array(totais, dtype=float))
+    # Devolução maior que a saída num dia não vira "consumo negativo"
+    taxa = np.clip(consumo, 0, None) @ _pesos(janela, meia_vida)
+
+    # Itens da janela por subconsulta, não pela lista de ids: catálogo grande
+    # passaria do limite de parâmetros do SQLite num IN (...)
+    com_consumo = consumos.values('equipamento_id')
+    if filial is None:
+        estoque = dict(Equipamento.objects.filter(pk__in=com_consumo).values_list('id', 'quantidade'))
+    else:
+        estoque = dict(EstoqueFilial.objects.filter(filial_id=filial, equipamento_id__in=com_consumo)
+                       .values_list('equipamento_id', 'quantidade'))
+    saldo = np.array([max(estoque.get(pk, 0), 0) for pk in ids.tolist()], dtype=float)
+    dias_restantes = np.divide(saldo, taxa, out=np.full(len(ids), np.inf), where=taxa > 0)
+
+    return {
+        pk: float(dias) for pk, dias in zip(ids.tolist(), dias_restantes.tolist()) if np.isfinite(dias)
+    }
+
+
+# Mesma conta, guardada até o próximo lançamento (ou até virar o dia)
+def dias_restantes(filial=None):
+    hoje = timezone.localdate()
+    chave = f"previsao:{versao_estoque()}:{hoje.isoformat()}:{filial or 'empresa'}"
+    previsao = cache.get(chave)
+    if previsao is None:
+        previsao = calcular_dias_restantes(hoje, filial=filial)
+        cache.set(chave, previsao, 24 * 3600)
+    return previsao
@@ -0,0 +1,165 @@
+from fpdf import FPDF
+
+from . import historico
+from .forms import filtrar_movimentacoes
+from .filiais import anotar_saldo
+from .models import Equipamento, Movimentacao
+from .previsao import dias_restantes
+
+# ==============================================================================
+# RELATÓRIO PDF (Montagem do documento, separada da view)
+# ==============================================================================
+# Cada PDF traz no máximo LINHAS_POR_PARTE movimentações. Períodos maiores saem
+# em várias partes (?parte=2, ?parte=3...), então a memória fica do mesmo tamanho
+# seja o relatório de um dia ou de um ano inteiro.
+# As linhas vêm do historico.py: período que cai em meses arquivados também sai.
+LINHAS_POR_PARTE = 2000
+
+# Sem filtro nenhum, o relatório continua igual ao de sempre: só as últimas 20
+ULTIMAS_SEM_FILTRO = 20
+
+
+# Nova Classe do PDF (Configuração Visual)
+class PDF(FPDF):
+    # Nome da filial do relatório (ou "Todas as Filiais")
+    local = 'Todas as Filiais'
+
+    def header(self):
+        # Título em Arial Negrito 14
+        self.set_font('Arial', 'B', 14)
+        self.cell(0, 10, texto_pdf(f'FUTURANET - Controle de Estoque ({self.local})'), 0, 1, 'C')
+        self.ln(5) # Pula linha
+
+    def footer(self):
+        # Rodapé com número da página
+        self.set_y(-15)
+        self.set_font('Arial', 'I', 8)
+        self.cell(0, 10, f'Pagina {self.page_no()}', 0, 0, 'C')
+
+
+def texto_pdf(texto):
+    # O fpdf só entende latin-1: tira o que não couber (emoji, etc.)
+    return texto.encode('latin-1', 'ignore').decode('latin-1')
+
+
+# Parte do banco; historico.pagina completa com os meses arquivados
+def movimentacoes_do_relatorio(filtros):
+    return filtrar_movimentacoes(Movimentacao.objects.all(), filtros).order_by('-data', '-id')
+
+
+def total_de_partes(filtros):
+    if not filtros:
+        return 1
+    total = historico.contar(filtros)
+    return max(1, -(-total // LINHAS_POR_PARTE))
+
+
+def descrever_filtros(filtros):
+    partes = []
+    if filtros.get('inicio'):
+        partes.append(f"de {filtros['inicio']:%d/%m/%Y}")
+    if filtros.get('fim'):
+        partes.append(f"ate {filtros['fim']:%d/%m/%Y}")
+    if filtros.get('tecnico'):
+        partes.append(f"tecnico {filtros['tecnico'].username}")
+    if filtros.get('tipo'):
+        partes.append(f"tipo {filtros['tipo']}")
+    if filtros.get('filial'):
+        partes.append(f"filial {filtros['filial'].nome}")
+    return texto_pdf(", ".join(partes))
+
+
+def _secao_estoque(pdf, filial=None):
+    # --- SEÇÃO 1: ESTOQUE ATUAL ---
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, "1. Posicao de Estoque Atual", 0, 1, 'L')
+
+    # Cabeçalho da Tabela
+    pdf.set_fill_color(200, 220, 255) # Azul claro
+    pdf.set_font("Arial", 'B', 9)
+    pdf.cell(75, 8, "Produto", 1, 0, 'L', 1)
+    pdf.cell(35, 8, "Tipo", 1, 0, 'C', 1)
+    pdf.cell(25, 8, "Qtd", 1, 0, 'C', 1)
+    pdf.cell(30, 8, "Status", 1, 0, 'C', 1)
+    pdf.cell(25, 8, "Dura (dias)", 1, 1, 'C', 1)
+
+    # Dados da Tabela (lidos aos poucos do banco)
+    pdf.set_font("Arial", size=9)
+    # Com filial: o estoque daquela filial (mesmo JOIN do painel, ver filiais.py)
+    equipamentos = anotar_saldo(
+        Equipamento.objects.only('nome', 'tipo', 'quantidade', 'minimo', 'estoque_baixo'), filial
+    ).order_by('nome')
+    # Previsão pelo consumo recente (conta única para o catálogo inteiro, ver previsao.py)
+    previsao = dias_restantes(filial=filial)
+
+    for item in equipamentos.iterator(chunk_size=500):
+        pdf.cell(75, 8, texto_pdf(item.nome[:32]), 1)
+        pdf.cell(35, 8, item.get_tipo_display(), 1, 0, 'C')
+        pdf.cell(25, 8, str(item.saldo), 1, 0, 'C')
+
+        # Lógica para mostrar se está baixo
+        status = "BAIXO" if item.baixo else "Normal"
+        pdf.cell(30, 8, status, 1, 0, 'C')
+        dias = previsao.get(item.pk)
+        pdf.cell(25, 8, "-" if dias is None else f"{dias:.0f}", 1, 1, 'C')
+
+    pdf.ln(10) # Espaço grande
+
+
+def _secao_historico(pdf, filtros, parte, partes):
+    # --- SEÇÃO 2: MOVIMENTAÇÕES ---
+    if filtros:
+        titulo = f"2. Historico ({descrever_filtros(filtros)})"
+        if partes > 1:
+            titulo += f" - Parte {parte} de {partes}"
+        inicio, quantidade = (parte - 1) * LINHAS_POR_PARTE, LINHAS_POR_PARTE
+    else:
+        titulo = f"2. Historico Recente (Ultimos {ULTIMAS_SEM_FILTRO})"
+        inicio, quantidade = 0, ULTIMAS_SEM_FILTRO
+    movimentacoes = historico.pagina(movimentacoes_do_relatorio(filtros), filtros, inicio, quantidade)
+
+    pdf.set_font("Arial", 'B', 12)
+    pdf.cell(0, 10, titulo, 0, 1, 'L')
+
+    # Cabeçalho
+    pdf.set_fill_color(230, 230, 230) # Cinza
+    pdf.set_font("Arial", 'B', 8)
+    pdf.cell(35, 8, "Data/Hora", 1, 0, 'L', 1)
+    pdf.cell(30, 8, "Tecnico", 1, 0, 'L', 1)
+    pdf.cell(20, 8, "Acao", 1, 0, 'C', 1)
+    pdf.cell(50, 8, "Item", 1, 0, 'L', 1)
+    pdf.cell(10, 8, "Qtd", 1, 0, 'C', 1)
+    pdf.cell(20, 8, "Filial", 1, 0, 'L', 1)
+    pdf.cell(25, 8, "Obs", 1, 1, 'L', 1)
+
+    # Dados (técnico e item já vêm no mesmo SELECT, sem consulta extra por linha)
+    pdf.set_font("Arial", size=8)
+    for mov in movimentacoes:
+        pdf.cell(35, 8, mov.data.strftime("%d/%m %H:%M"), 1)
+        pdf.cell(30, 8, texto_pdf(mov.tecnico[:18]), 1)
+        pdf.cell(20, 8, mov.tipo[:12], 1, 0, 'C')
+        pdf.cell(50, 8, texto_pdf(mov.equipamento[:25]), 1)
+        pdf.cell(10, 8, str(mov.quantidade), 1, 0, 'C')
+        pdf.cell(20, 8, texto_pdf(mov.filial or "Matriz")[:12], 1)
+        pdf.cell(25, 8, texto_pdf(mov.obs or "-")[:14], 1, 1)
+
+
+# Monta o PDF e devolve os bytes prontos
+def gerar_pdf(filtros=None, parte=1):
+    filtros = filtros or {}
+    partes = total_de_partes(filtros)
+    parte = min(max(parte, 1), partes)
+
+    filial = filtros.get('filial')
+    pdf = PDF()
+    if filial:
+        pdf.local = f"Filial {filial.nome}"
+    pdf.add_page()
+    pdf.set_font("Arial", size=10)
+
+    # A posição do estoque só vai na primeira parte
+    if parte == 1:
+        _secao_estoque(pdf, filial.pk if filial else None)
+    _secao_historico(pdf, filtros, parte, partes)
+
+    return pdf.output(dest='S').encode('latin-1', 'ignore')
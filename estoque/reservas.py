@@ -0,0 +1,124 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import MATRIZ, Equipamento, EstoqueFilial, Reserva
+from .signals import invalidar_estoque, publicar_depois_do_commit, registrar_vencimento
+
+# ==============================================================================
+# RESERVAS (Disponível = estoque - reservas ativas)
+# ==============================================================================
+# Duas secretárias montando kits ao mesmo tempo: sem reserva, as duas passam na
+# validação contra o mesmo estoque e uma delas falha no lançamento.
+# Com "Só reservar" marcado no lote, reservar() segura os itens por
+# settings.RESERVA_MINUTOS; quem vier depois já vê o disponível menor.
+#
+# Disponível de um item numa filial = estoque da filial - soma das reservas ativas
+# dos OUTROS lotes naquela filial (o próprio lote não disputa com ele mesmo). A
+# soma é uma subconsulta por item que só lê as reservas ainda válidas dele
+# (índice reserva_ativa_idx), então o custo não cresce com as reservas vencidas,
+# nem com as dos outros itens, nem com as das outras filiais.
+#
+# Só retirada e transferência reservam: são as que tiram do estoque da filial.
+# Devolução e baixa mexem na carteira do próprio técnico, que não é disputada.
+
+
+def _reservas_ativas(exceto_ordem=None):
+    reservas = Reserva.objects.filter(expira_em__gt=timezone.now())
+    if exceto_ordem is not None:
+        reservas = reservas.exclude(ordem_id=exceto_ordem)
+    return reservas
+
+
+# Expressão (ORM) com o total reservado do item da linha de fora.
+# filial=None soma todas as filiais (o total da empresa); também aceita OuterRef.
+def expressao_reservado(exceto_ordem=None, item='pk', filial=None):
+    reservas = _reservas_ativas(exceto_ordem).filter(equipamento_id=OuterRef(item))
+    if filial is not None:
+        reservas = reservas.filter(filial_id=filial)
+    total = reservas.order_by().values('equipamento_id').annotate(total=Sum('quantidade')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+# Mesma soma em SQL, para o UPDATE agrupado do saldos.py: (sql, parâmetros)
+def sql_reservado(coluna_item, coluna_filial, exceto_ordem=None):
+    sql = (
+        f"SELECT COALESCE(SUM(r.quantidade), 0) FROM {Reserva._meta.db_table} r "
+        f"WHERE r.equipamento_id = {coluna_item} AND r.filial_id = {coluna_filial} "
+        f"AND r.expira_em > %s AND r.ordem_id <> %s"
+    )
+    return sql, [connection.ops.adapt_datetimefield_value(timezone.now()), exceto_ordem or 0]
+
+
+# {(filial_id, equipamento_id): disponível} numa consulta só, para várias filiais
+# (transferência mexe em duas). Item sem linha na filial não aparece (= 0).
+def disponiveis_por_filial(chaves, exceto_ordem=None):
+    chaves = set(chaves)
+    if not chaves:
+        return {}
+    linhas = EstoqueFilial.objects.filter(
+        filial_id__in={filial_id for filial_id, _ in chaves},
+        equipamento_id__in={equipamento_id for _, equipamento_id in chaves},
+    ).values_list(
+        'filial_id', 'equipamento_id',
+        F('quantidade') - expressao_reservado(exceto_ordem, item='equipamento_id', filial=OuterRef('filial_id')),
+    )
+    return {(f, e): livre for f, e, livre in linhas if (f, e) in chaves}
+
+
+# {equipamento_id: disponível} de uma filial
+def disponiveis(equipamento_ids, exceto_ordem=None, filial=MATRIZ):
+    livres = disponiveis_por_filial(((filial, pk) for pk in equipamento_ids), exceto_ordem)
+    return {equipamento_id: livre for (_, equipamento_id), livre in livres.items()}
+
+
+def disponivel(equipamento_id, exceto_ordem=None, filial=MATRIZ):
+    return disponiveis([equipamento_id], exceto_ordem, filial).get(equipamento_id, 0)
+
+
+# Segura os itens do lote (retirada ou transferência) na filial do lote até agora + RESERVA_MINUTOS. Reservar de novo
+# o mesmo lote troca as reservas dele e renova o prazo.
+# Falta disponível? ValidationError com um aviso por item, e nada é reservado.
+def reservar(ordem):
+    pedidos = {}
+    if ordem.tipo in ('SAIDA', 'TRANSFERENCIA'):
+        for equipamento_id, quantidade in ordem.itemordem_set.values_list('equipamento_id', 'quantidade'):
+            if quantidade:
+                pedidos[equipamento_id] = pedidos.get(equipamento_id, 0) + quantidade
+
+    expira_em = timezone.now() + timedelta(minutes=settings.RESERVA_MINUTOS)
+    with transaction.atomic():
+        # Trava os itens (PostgreSQL; no SQLite quem escreve já é um só): duas
+        # reservas do mesmo item não passam juntas pela conferência
+        itens = dict(
+            Equipamento.objects.select_for_update().filter(pk__in=pedidos)
+            .values_list('id', 'nome')
+        )
+        livres = disponiveis(pedidos, exceto_ordem=ordem.pk, filial=ordem.filial_id)
+        erros = [
+            f"O item '{itens[equipamento_id]}' falhou. Só há {livres.get(equipamento_id, 0)} unidades disponíveis."
+            for equipamento_id, quantidade in pedidos.items()
+            if livres.get(equipamento_id, 0) < quantidade
+        ]
+        if erros:
+            raise ValidationError(erros)
+
+        # Faxina: vencidas não contam mais para ninguém
+        Reserva.objects.filter(expira_em__lte=timezone.now()).delete()
+        antigas = set(ordem.reservas.values_list('equipamento_id', flat=True))
+        ordem.reservas.all().delete()
+        reservas = Reserva.objects.bulk_create(
+            Reserva(ordem=ordem, equipamento_id=equipamento_id, filial_id=ordem.filial_id, quantidade=quantidade,
+                    expira_em=expira_em)
+            for equipamento_id, quantidade in pedidos.items()
+        )
+
+        invalidar_estoque()
+        registrar_vencimento(expira_em)
+        publicar_depois_do_commit(antigas | set(pedidos))
+    return reservas
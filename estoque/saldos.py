@@ -0,0 +1,280 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from .models import MATRIZ, EstoqueFilial, EstoqueTecnico, Movimentacao
+from .reservas import disponiveis_por_filial, disponivel, expressao_reservado, sql_reservado
+from .signals import movimentacoes_lancadas
+
+# ==============================================================================
+# MOTOR DE SALDOS (Aplica as movimentações direto no banco, sem perder update)
+# ==============================================================================
+# Cada tipo de movimento mexe em dois saldos: o da Empresa, na filial da
+# movimentação (EstoqueFilial.quantidade; o total em Equipamento.quantidade vem
+# junto pelo gatilho do banco.py), e o da Carteira do Técnico (EstoqueTecnico.quantidade).
+# A tupla diz o sinal aplicado em cada um: (Empresa, Técnico).
+EFEITOS = {
+    'SAIDA': (-1, +1),
+    'DEVOLUCAO': (+1, -1),
+    'BAIXA': (0, -1),
+    'ENTRADA': (+1, 0),  # Chegada de fornecedor/importação: só a empresa recebe
+    # Transferência entre filiais: uma perna em cada filial, a carteira não muda
+    'TRANSF_SAIDA': (-1, 0),
+    'TRANSF_ENTRADA': (+1, 0),
+}
+
+EMPRESA, TECNICO = 0, 1
+
+
+# Os mesmos sinais em SQL: efeito de cada linha do histórico no saldo de um lado
+# (para somar o histórico direto no banco com Sum)
+def expressao_efeito(lado):
+    return Case(
+        *[When(tipo=tipo, then=F('quantidade') * sinais[lado]) for tipo, sinais in EFEITOS.items() if sinais[lado]],
+        default=Value(0), output_field=IntegerField(),
+    )
+
+
+def erro_saldo(tipo, tecnico, disponivel):
+    # Mesmas mensagens que a secretária já conhece do formulário
+    if tipo == 'SAIDA':
+        return ValidationError(f"Estoque Insuficiente! A empresa só tem {disponivel} unidades.")
+    if tipo == 'TRANSF_SAIDA':
+        return ValidationError(f"Transferência sem saldo! A filial de origem só tem {disponivel} unidades.")
+    if tipo == 'DEVOLUCAO':
+        return ValidationError(f"Erro no Saldo! O técnico {tecnico.username} só tem {disponivel} em mãos.")
+    return ValidationError(f"Não pode dar Baixa! O técnico tem apenas {disponivel} unidades deste item.")
+
+
+def saldo_tecnico(tecnico_id, equipamento_id):
+    return EstoqueTecnico.objects.filter(
+        tecnico_id=tecnico_id, equipamento_id=equipamento_id
+    ).values_list('quantidade', flat=True).first() or 0
+
+
+# Validação só de leitura (1 query). Não cria carteira nenhuma.
+# Do estoque da empresa só conta o disponível na filial (o que os lotes em rascunho não reservaram).
+def conferir_saldo(tecnico, equipamento, tipo, quantidade, filial=MATRIZ):
+    sinal_empresa, sinal_tecnico = EFEITOS[tipo]
+
+    if sinal_empresa < 0:
+        livre = disponivel(equipamento.pk, filial=filial)
+    elif sinal_tecnico < 0:
+        livre = saldo_tecnico(tecnico.pk, equipamento.pk)
+    else:
+        return
+
+    if livre < quantidade:
+        raise erro_saldo(tipo, tecnico, livre)
+
+
+# Aplica o movimento com UPDATEs condicionais (só debita se tiver saldo).
+# A conta é feita pelo banco (F-expression), então dois lançamentos ao mesmo
+# tempo nunca sobrescrevem um ao outro. Se faltar saldo, nada é gravado.
+def aplicar_movimento(tecnico, equipamento, tipo, quantidade, filial=MATRIZ):
+    sinal_empresa, sinal_tecnico = EFEITOS[tipo]
+
+    with transaction.atomic():
+        # --- Lado da Empresa (estoque da filial) ---
+        if sinal_empresa:
+            empresa = EstoqueFilial.objects.filter(filial_id=filial, equipamento=equipamento)
+            if sinal_empresa < 0:
+                # Não pode entrar no que está reservado para os lotes em rascunho
+                empresa = empresa.filter(
+                    quantidade__gte=expressao_reservado(item='equipamento_id', filial=filial) + quantidade
+                )
+                if not empresa.update(quantidade=F('quantidade') - quantidade):
+                    raise erro_saldo(tipo, tecnico, disponivel(equipamento.pk, filial=filial))
+            elif not empresa.update(quantidade=F('quantidade') + quantidade):
+                # Primeira entrada desse item na filial: a linha nasce zerada (o gatilho
+                # do total só conta UPDATE) e recebe a entrada logo em seguida
+                EstoqueFilial.objects.bulk_create(
+                    [EstoqueFilial(filial_id=filial, equipamento=equipamento, quantidade=0)], ignore_conflicts=True,
+                )
+                empresa.update(quantidade=F('quantidade') + quantidade)
+
+        # --- Lado do Técnico (Carteira) ---
+        carteira = EstoqueTecnico.objects.filter(tecnico=tecnico, equipamento=equipamento)
+        if sinal_tecnico < 0:
+            if not carteira.filter(quantidade__gte=quantidade).update(quantidade=F('quantidade') - quantidade):
+                raise erro_saldo(tipo, tecnico, saldo_tecnico(tecnico.pk, equipamento.pk))
+        elif sinal_tecnico > 0 and not carteira.update(quantidade=F('quantidade') + quantidade):
+            # Primeira retirada desse item: abre a carteira
+            try:
+                with transaction.atomic():
+                    EstoqueTecnico.objects.create(tecnico=tecnico, equipamento=equipamento, quantidade=quantidade)
+            except IntegrityError:
+                # Outro lançamento abriu a carteira no mesmo instante
+                carteira.update(quantidade=F('quantidade') + quantidade)
+
+    # Mantém o objeto em memória coerente com o banco
+    equipamento.quantidade += sinal_empresa * quantidade
+
+
+# ==============================================================================
+# LANÇAMENTO EM LOTE (Vários itens com número fixo de consultas)
+# ==============================================================================
+# Quantos ids entram em cada UPDATE agrupado (o SQLite limita os parâmetros)
+TAMANHO_GRUPO = 300
+
+
+def _em_grupos(itens):
+    itens = list(itens)
+    for inicio in range(0, len(itens), TAMANHO_GRUPO):
+        yield itens[inicio:inicio + TAMANHO_GRUPO]
+
+
+def _somar_efeitos(movimentacoes):
+    # Soma o efeito líquido por (Filial, Item) (Empresa) e por carteira (Técnico, Item)
+    empresa, carteiras = {}, {}
+    for mov in movimentacoes:
+        sinal_empresa, sinal_tecnico = EFEITOS[mov.tipo]
+        if sinal_empresa:
+            local = (mov.filial_id, mov.equipamento_id)
+            empresa[local] = empresa.get(local, 0) + sinal_empresa * mov.quantidade
+        chave = (mov.tecnico_id, mov.equipamento_id)
+        carteiras[chave] = carteiras.get(chave, 0) + sinal_tecnico * mov.quantidade
+    return empresa, carteiras
+
+
+def _carregar_saldos(empresa, carteiras, reserva_de=None):
+    # 2 consultas para o lote inteiro, não importa quantos itens ele tem.
+    # Empresa: o disponível (as reservas do próprio lote não contam contra ele)
+    saldos_empresa = disponiveis_por_filial(empresa, exceto_ordem=reserva_de)
+    saldos_carteira = {}
+    if carteiras:
+        tecnicos = {tecnico_id for tecnico_id, _ in carteiras}
+        equipamentos = {equipamento_id for _, equipamento_id in carteiras}
+        for tecnico_id, equipamento_id, quantidade in EstoqueTecnico.objects.filter(
+            tecnico_id__in=tecnicos, equipamento_id__in=equipamentos
+        ).values_list('tecnico_id', 'equipamento_id', 'quantidade'):
+            saldos_carteira[(tecnico_id, equipamento_id)] = quantidade
+    return saldos_empresa, saldos_carteira
+
+
+def _validar_lote(movimentacoes, empresa, carteiras, saldos_empresa, saldos_carteira):
+    # Tudo em memória: junta os erros de todos os itens de uma vez só
+    erros, avisados = [], set()
+    for mov in movimentacoes:
+        sinal_empresa, sinal_tecnico = EFEITOS[mov.tipo]
+        disponivel = None
+        local = (mov.filial_id, mov.equipamento_id)
+        if sinal_empresa < 0 and saldos_empresa.get(local, 0) + empresa.get(local, 0) < 0:
+            disponivel = saldos_empresa.get(local, 0)
+        chave = (mov.tecnico_id, mov.equipamento_id)
+        if disponivel is None and sinal_tecnico < 0 and saldos_carteira.get(chave, 0) + carteiras.get(chave, 0) < 0:
+            disponivel = saldos_carteira.get(chave, 0)
+
+        if disponivel is not None and (mov.tipo, mov.filial_id, chave) not in avisados:
+            avisados.add((mov.tipo, mov.filial_id, chave))
+            erro = erro_saldo(mov.tipo, mov.tecnico, disponivel)
+            erros.append(f"O item '{mov.equipamento.nome}' falhou. {erro.message}")
+
+    if erros:
+        raise ValidationError(erros)
+
+
+# UPDATE agrupado: soma um delta diferente em cada linha, numa instrução só.
+# Só conta as linhas que continuam com saldo >= 0; quem chama compara com o esperado.
+# "piso" = (sql, parâmetros) do mínimo que tem de sobrar nas linhas que descem
+# (as reservas, no estoque da empresa).
+# (SQL direto porque montar um Case/When com centenas de itens no ORM custa mais que o próprio banco)
+def _somar_em_grupo(model, colunas, deltas, piso=None):
+    tabela = connection.ops.quote_name(model._meta.db_table)
+    # VALUES sem nome de coluna vira column1, column2... (SQLite e PostgreSQL)
+    casa = ' AND '.join(
+        f'lote.column{i} = {tabela}.{connection.ops.quote_name(coluna)}'
+        for i, coluna in enumerate(colunas, start=1)
+    )
+    delta = f'lote.column{len(colunas) + 1}'
+    linha = '(' + ', '.join(['%s'] * (len(colunas) + 1)) + ')'
+
+    minimo, parametros_minimo = '0', []
+    if piso:
+        minimo = f"CASE WHEN {delta} < 0 THEN ({piso[0]}) ELSE 0 END"
+        parametros_minimo = piso[1]
+
+    sql = (
+        f"UPDATE {tabela} SET quantidade = {tabela}.quantidade + {delta} "
+        f"FROM (VALUES {', '.join([linha] * len(deltas))}) AS lote "
+        f"WHERE {casa} AND {tabela}.quantidade + {delta} >= {minimo}"
+    )
+    parametros = []
+    for chave, valor in deltas:
+        parametros.extend(chave if isinstance(chave, tuple) else (chave,))
+        parametros.append(valor)
+    parametros.extend(parametros_minimo)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, parametros)
+        return cursor.rowcount
+
+
+def _atualizar_empresa(empresa, saldos_empresa, reserva_de=None):
+    # Item que entra pela primeira vez numa filial: linha nova zerada (1 INSERT para todas)
+    novas = [chave for chave, valor in empresa.items() if chave not in saldos_empresa and valor > 0]
+    if novas:
+        EstoqueFilial.objects.bulk_create(
+            [EstoqueFilial(filial_id=f, equipamento_id=e, quantidade=0) for f, e in novas],
+            ignore_conflicts=True,
+        )
+
+    tabela = connection.ops.quote_name(EstoqueFilial._meta.db_table)
+    piso = sql_reservado(f'{tabela}.equipamento_id', f'{tabela}.filial_id', exceto_ordem=reserva_de)
+    for grupo in _em_grupos(empresa.items()):
+        if _somar_em_grupo(EstoqueFilial, ['filial_id', 'equipamento_id'], grupo, piso) != len(grupo):
+            return False
+    return True
+
+
+def _atualizar_carteiras(carteiras, saldos_carteira):
+    # Carteiras que ainda não existem nascem zeradas (1 INSERT para todas)
+    novas = [chave for chave, valor in carteiras.items() if chave not in saldos_carteira and valor > 0]
+    if novas:
+        EstoqueTecnico.objects.bulk_create(
+            [EstoqueTecnico(tecnico_id=t, equipamento_id=e, quantidade=0) for t, e in novas],
+            ignore_conflicts=True,
+        )
+
+    for grupo in _em_grupos(carteiras.items()):
+        if _somar_em_grupo(EstoqueTecnico, ['tecnico_id', 'equipamento_id'], grupo) != len(grupo):
+            return False
+    return True
+
+
+class _SaldoMudou(Exception):
+    pass
+
+
+# Grava uma lista de Movimentacao (ainda não salvas) de uma vez só, de uma ou
+# várias filiais (a transferência tem as duas pernas no mesmo lote):
+# 2 SELECTs para carregar os saldos, validação em memória, 1 bulk_create para o
+# histórico e UPDATEs agrupados para os saldos. Ou entra tudo, ou não entra nada.
+# reserva_de = lote (OrdemMovimentacao.pk) cujas reservas podem ser usadas aqui.
+def lancar_movimentos(movimentacoes, reserva_de=None):
+    movimentacoes = [mov for mov in movimentacoes if mov.quantidade]
+    if not movimentacoes:
+        return []
+
+    empresa, carteiras = _somar_efeitos(movimentacoes)
+    empresa = {pk: valor for pk, valor in empresa.items() if valor}
+    carteiras = {chave: valor for chave, valor in carteiras.items() if valor}
+
+    saldos_empresa, saldos_carteira = _carregar_saldos(empresa, carteiras, reserva_de)
+    _validar_lote(movimentacoes, empresa, carteiras, saldos_empresa, saldos_carteira)
+
+    try:
+        with transaction.atomic():
+            # Os UPDATEs conferem o saldo de novo: se alguém mexeu no estoque
+            # depois da validação, o lote inteiro volta atrás.
+            if (not _atualizar_empresa(empresa, saldos_empresa, reserva_de)
+                    or not _atualizar_carteiras(carteiras, saldos_carteira)):
+                raise _SaldoMudou
+            Movimentacao.objects.bulk_create(movimentacoes)
+            movimentacoes_lancadas.send(sender=Movimentacao, movimentacoes=movimentacoes)
+    except _SaldoMudou:
+        # Recarrega para mostrar a mensagem certa de qual item faltou
+        _validar_lote(movimentacoes, empresa, carteiras, *_carregar_saldos(empresa, carteiras, reserva_de))
+        raise ValidationError("O estoque mudou durante o lançamento. Tente novamente.")
+
+    return movimentacoes
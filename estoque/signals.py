@@ -0,0 +1,248 @@
+import contextvars
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .consumo import refazer_consumo, somar_consumo
+from .imagens import gerar_miniaturas
+from .models import MATRIZ, Conciliacao, Equipamento, EstoqueFilial, EstoqueTecnico, Filial, Movimentacao, Reserva
+
+# ==============================================================================
+# SINAIS DO ESTOQUE
+# ==============================================================================
+# Disparado pelo motor de saldos (saldos.py) sempre que movimentações entram,
+# seja uma por vez (Movimentacao.save) ou em lote (bulk_create não dispara post_save).
+# Argumento: movimentacoes = lista das Movimentacao gravadas.
+movimentacoes_lancadas = Signal()
+
+
+# ==============================================================================
+# VERSÃO DO ESTOQUE (Invalida o cache do painel)
+# ==============================================================================
+# Guarda o momento da última alteração. Serve de chave do cache do painel e de
+# Last-Modified/ETag: mudou o estoque, muda a versão, e o cache antigo é ignorado.
+CHAVE_VERSAO = 'estoque:versao'
+# Só o cadastro (nomes/tipos): muda quando um Equipamento é criado, editado ou apagado,
+# não a cada movimentação. Usada pelo índice do autocompletar (autocompletar.py).
+CHAVE_CATALOGO = 'estoque:catalogo'
+# Vencimentos das reservas (timestamps): reserva que vence muda o disponível sem
+# ninguém gravar nada, então a versão do estoque "pula" sozinha nesse momento
+CHAVE_VENCIMENTOS = 'estoque:vencimentos'
+# Versões já lidas na requisição atual ({chave: versão}), ver VersoesPorRequisicaoMiddleware.
+# None fora de uma requisição (comandos, SSE depois da resposta): lê sempre do cache.
+_lidas = contextvars.ContextVar('estoque_versoes_lidas', default=None)
+
+
+def _versao(chave):
+    versao = cache.get(chave)
+    if versao is None:
+        versao = timezone.now().timestamp()
+        cache.add(chave, versao, None)
+        versao = cache.get(chave, versao)
+    return versao
+
+
+def _ja_lida(chave, ler):
+    lidas = _lidas.get()
+    if lidas is None:
+        return ler()
+    if chave not in lidas:
+        lidas[chave] = ler()
+    return lidas[chave]
+
+
+def _esquecer(chave):
+    lidas = _lidas.get()
+    if lidas is not None:
+        lidas.pop(chave, None)
+
+
+def _nova_versao(chave):
+    # Só depois do COMMIT: antes disso outra requisição ainda leria o estoque antigo
+    # e guardaria no cache com a versão nova.
+    def gravar():
+        cache.set(chave, timezone.now().timestamp(), None)
+        _esquecer(chave)
+    transaction.on_commit(gravar)
+
+
+def _ler_versao_estoque():
+    versao = _versao(CHAVE_VERSAO)
+    agora = timezone.now().timestamp()
+    vencidas = [momento for momento in cache.get(CHAVE_VENCIMENTOS, ()) if momento <= agora]
+    return max([versao] + vencidas)
+
+
+def versao_estoque():
+    return _ja_lida(CHAVE_VERSAO, _ler_versao_estoque)
+
+
+def versao_catalogo():
+    return _ja_lida(CHAVE_CATALOGO, lambda: _versao(CHAVE_CATALOGO))
+
+
+# Com o FileBasedCache da produção cada leitura da versão é arquivo aberto no disco,
+# e uma página do painel pergunta várias vezes (ETag, Last-Modified, cache do
+# template, previsão). Aqui a requisição lê cada versão uma vez só; o que ela
+# mesma gravar (on_commit acima) é lido de novo. Streaming (SSE) continua lendo
+# do cache a cada evento: ele roda depois que a requisição "acabou".
+class VersoesPorRequisicaoMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _lidas.set({})
+        try:
+            return self.get_response(request)
+        finally:
+            _lidas.reset(token)
+
+
+def invalidar_estoque(**kwargs):
+    _nova_versao(CHAVE_VERSAO)
+
+
+def invalidar_catalogo(**kwargs):
+    _nova_versao(CHAVE_CATALOGO)
+
+
+# Guarda o vencimento de uma reserva nova (os que já passaram e ficaram para trás
+# da versão gravada saem da lista). Só depois do COMMIT, como a versão.
+def registrar_vencimento(momento):
+    def gravar():
+        versao = _versao(CHAVE_VERSAO)
+        vencimentos = [m for m in cache.get(CHAVE_VENCIMENTOS, ()) if m > versao]
+        cache.set(CHAVE_VENCIMENTOS, sorted(set(vencimentos + [momento.timestamp()])), None)
+        _esquecer(CHAVE_VERSAO)
+    transaction.on_commit(gravar)
+
+
+movimentacoes_lancadas.connect(invalidar_estoque, dispatch_uid='invalidar_estoque_lancamento')
+
+
+@receiver([post_save, post_delete], sender=Equipamento, dispatch_uid='invalidar_estoque_equipamento')
+@receiver([post_save, post_delete], sender=Movimentacao, dispatch_uid='invalidar_estoque_movimentacao')
+@receiver([post_save, post_delete], sender=EstoqueTecnico, dispatch_uid='invalidar_estoque_carteira')
+@receiver([post_save, post_delete], sender=EstoqueFilial, dispatch_uid='invalidar_estoque_filial')
+@receiver([post_save, post_delete], sender=Filial, dispatch_uid='invalidar_estoque_filiais')
+@receiver(post_delete, sender=Reserva, dispatch_uid='invalidar_estoque_reserva')
+def estoque_alterado(sender, **kwargs):
+    invalidar_estoque()
+
+
+@receiver([post_save, post_delete], sender=Equipamento, dispatch_uid='invalidar_catalogo_equipamento')
+def catalogo_alterado(sender, **kwargs):
+    invalidar_catalogo()
+
+
+# ==============================================================================
+# FILIAIS (Item cadastrado já com estoque)
+# ==============================================================================
+# O cadastro com quantidade inicial (admin, testes) é estoque da Matriz: a linha
+# nasce com o mesmo número, sem mexer no total (o gatilho do banco.py só conta UPDATE).
+@receiver(post_save, sender=Equipamento, dispatch_uid='saldo_inicial_matriz')
+def saldo_inicial(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw and instance.quantidade:
+        EstoqueFilial.objects.create(filial_id=MATRIZ, equipamento=instance, quantidade=instance.quantidade)
+
+
+# ==============================================================================
+# MINIATURAS (Geradas assim que a foto é enviada)
+# ==============================================================================
+# Só quando a foto muda (upload novo ou outro arquivo): salvar o item por outro
+# motivo não toca no disco. Foto nova sempre refaz as miniaturas, mesmo que já
+# existam com aquele nome (eram da foto de antes).
+@receiver(pre_save, sender=Equipamento, dispatch_uid='miniaturas_foto_nova')
+def marcar_foto_nova(sender, instance, raw=False, update_fields=None, **kwargs):
+    foto = instance.foto
+    if raw or not foto or (update_fields is not None and 'foto' not in update_fields):
+        instance._foto_nova = False
+    elif not foto._committed or instance.pk is None:
+        instance._foto_nova = True
+    else:
+        anterior = Equipamento.objects.filter(pk=instance.pk).values_list('foto', flat=True).first()
+        instance._foto_nova = foto.name != anterior
+
+
+@receiver(post_save, sender=Equipamento, dispatch_uid='gerar_miniaturas_equipamento')
+def gerar_miniaturas_da_foto(sender, instance, **kwargs):
+    if not getattr(instance, '_foto_nova', False):
+        return
+    instance._foto_nova = False
+    try:
+        gerar_miniaturas(instance.foto.path, forcar=True)
+    except (OSError, ValueError, NotImplementedError):
+        # Arquivo que não é imagem (ou sumiu), ou storage sem caminho local (S3):
+        # o card usa a foto original mesmo
+        pass
+
+
+# ==============================================================================
+# CONCILIAÇÃO (Histórico já conferido foi mexido)
+# ==============================================================================
+# Movimentação nova não muda nada (entra na próxima rodada). Editar ou apagar uma
+# que já foi somada invalida o ponto de parada: a próxima conciliação soma tudo de novo.
+@receiver(post_save, sender=Movimentacao, dispatch_uid='conciliacao_movimentacao_editada')
+@receiver(post_delete, sender=Movimentacao, dispatch_uid='conciliacao_movimentacao_apagada')
+def historico_alterado(sender, instance, created=False, **kwargs):
+    if created:
+        return
+    Conciliacao.objects.filter(valida=True, ultima_movimentacao__gte=instance.pk).update(valida=False)
+
+
+# ==============================================================================
+# CONSUMO DIÁRIO (Soma de cada dia, ver consumo.py)
+# ==============================================================================
+# Lançamento novo (avulso ou lote) soma direto. Editar/apagar refaz só aquele dia
+# daquele item (e do item antigo, se a edição trocou o item).
+@receiver(movimentacoes_lancadas, dispatch_uid='somar_consumo_lancamento')
+def consumo_lancado(sender, movimentacoes, **kwargs):
+    somar_consumo(movimentacoes)
+
+
+@receiver(pre_save, sender=Movimentacao, dispatch_uid='consumo_item_anterior')
+def guardar_item_anterior(sender, instance, **kwargs):
+    if instance.pk:
+        instance._equipamento_anterior = Movimentacao.objects.filter(pk=instance.pk).values_list(
+            'equipamento_id', flat=True).first()
+
+
+@receiver(post_save, sender=Movimentacao, dispatch_uid='consumo_movimentacao_editada')
+@receiver(post_delete, sender=Movimentacao, dispatch_uid='consumo_movimentacao_apagada')
+def consumo_alterado(sender, instance, created=False, **kwargs):
+    if created or instance.data is None:
+        return
+    dia = timezone.localtime(instance.data).date()
+    for equipamento_id in {instance.equipamento_id, getattr(instance, '_equipamento_anterior', None)} - {None}:
+        refazer_consumo(dia, dia, equipamento_id)
+
+
+# ==============================================================================
+# PAINEL AO VIVO (Saldos novos para quem está com o painel aberto, ver ao_vivo.py)
+# ==============================================================================
+# Depois do COMMIT (antes disso o saldo lido ainda pode voltar atrás num rollback).
+# Import dentro da função: ao_vivo.py importa este módulo.
+def publicar_depois_do_commit(equipamento_ids):
+    from .ao_vivo import publicar_saldos
+    transaction.on_commit(lambda: publicar_saldos(equipamento_ids))
+
+
+@receiver(movimentacoes_lancadas, dispatch_uid='painel_ao_vivo_lancamento')
+def saldos_lancados(sender, movimentacoes, **kwargs):
+    publicar_depois_do_commit({mov.equipamento_id for mov in movimentacoes})
+
+
+# Quantidade/mínimo editados direto no cadastro (admin)
+@receiver(post_save, sender=Equipamento, dispatch_uid='painel_ao_vivo_equipamento')
+def saldo_editado(sender, instance, created=False, **kwargs):
+    if not created:
+        publicar_depois_do_commit({instance.pk})
+
+
+# Estoque de uma filial acertado no admin
+@receiver([post_save, post_delete], sender=EstoqueFilial, dispatch_uid='painel_ao_vivo_filial')
+def saldo_filial_editado(sender, instance, **kwargs):
+    publicar_depois_do_commit({instance.equipamento_id})
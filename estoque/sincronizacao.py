@@ -0,0 +1,123 @@
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+
+from .filiais import anotar_saldo
+from .models import MATRIZ, Equipamento, EstoqueTecnico, Filial, Movimentacao
+from .saldos import lancar_movimentos
+
+# ==============================================================================
+# SINCRONIZAÇÃO DO APP DE CAMPO (Uma ida e volta por sincronização)
+# ==============================================================================
+# O celular junta o que o técnico lançou sem sinal e manda tudo de uma vez:
+#   {"token": 1234, "movimentos": [{"chave": "uuid", "equipamento": 7, "tipo": "BAIXA",
+#                                   "quantidade": 1, "obs": "OS 1040"}, ...]}
+# Cada movimento leva uma chave gerada no celular. Chave que já entrou (reenvio
+# depois de cair a conexão) é ignorada, então reenviar o lote inteiro é seguro.
+# Os novos entram juntos pelo motor de saldos: ou entram todos, ou nenhum.
+#
+# A resposta traz o token novo (última movimentação) e só os saldos que mudaram
+# desde o token que o celular mandou (sem token: tudo).
+# "filial" no corpo (id, padrão a Matriz): de onde saem as retiradas e para onde
+# voltam as devoluções; o "estoque" da resposta é o daquela filial.
+TAMANHO_MAXIMO = 500
+TIPOS_DO_CAMPO = ('SAIDA', 'DEVOLUCAO', 'BAIXA')
+TAMANHO_CHAVE = Movimentacao._meta.get_field('chave_idempotencia').max_length
+TAMANHO_OBS = Movimentacao._meta.get_field('obs').max_length
+
+
+def _conferir_movimentos(movimentos):
+    if not isinstance(movimentos, list):
+        raise ValidationError("'movimentos' precisa ser uma lista.")
+    if len(movimentos) > TAMANHO_MAXIMO:
+        raise ValidationError(f"No máximo {TAMANHO_MAXIMO} movimentos por sincronização.")
+
+    # Mesma chave repetida dentro do próprio lote: vale a primeira
+    unicos, erros = {}, []
+    for posicao, dados in enumerate(movimentos, start=1):
+        if not isinstance(dados, dict):
+            erros.append(f"Movimento {posicao}: formato inválido.")
+            continue
+        chave, quantidade = dados.get('chave'), dados.get('quantidade')
+        if not isinstance(chave, str) or not 0 < len(chave) <= TAMANHO_CHAVE:
+            erros.append(f"Movimento {posicao}: 'chave' precisa ter de 1 a {TAMANHO_CHAVE} letras.")
+        elif dados.get('tipo') not in TIPOS_DO_CAMPO:
+            erros.append(f"Movimento {posicao}: 'tipo' precisa ser {', '.join(TIPOS_DO_CAMPO)}.")
+        elif type(dados.get('equipamento')) is not int:
+            erros.append(f"Movimento {posicao}: 'equipamento' precisa ser o id do item.")
+        elif type(quantidade) is not int or quantidade <= 0:
+            erros.append(f"Movimento {posicao}: 'quantidade' precisa ser inteiro e positivo.")
+        else:
+            unicos.setdefault(chave, dados)
+    if erros:
+        raise ValidationError(erros)
+    return unicos
+
+
+def _lancar_novos(tecnico, unicos, filial):
+    ja_lancadas = set(
+        Movimentacao.objects.filter(chave_idempotencia__in=list(unicos)).values_list('chave_idempotencia', flat=True)
+    )
+    novos = {chave: dados for chave, dados in unicos.items() if chave not in ja_lancadas}
+
+    # Um SELECT para todos os itens do lote (o motor de saldos usa o nome nas mensagens)
+    equipamentos = Equipamento.objects.only('id', 'nome').in_bulk({dados['equipamento'] for dados in novos.values()})
+    faltando = sorted({dados['equipamento'] for dados in novos.values()} - equipamentos.keys())
+    if faltando:
+        raise ValidationError(f"Itens não cadastrados: {', '.join(map(str, faltando))}.")
+    if novos and not Filial.objects.filter(pk=filial).exists():
+        raise ValidationError(f"Filial não cadastrada: {filial}.")
+
+    lancar_movimentos([
+        Movimentacao(
+            tecnico=tecnico, autor_movimento=tecnico, equipamento=equipamentos[dados['equipamento']],
+            tipo=dados['tipo'], quantidade=dados['quantidade'], chave_idempotencia=chave, filial_id=filial,
+            obs=str(dados.get('obs') or '').strip()[:TAMANHO_OBS] or None,
+        )
+        for chave, dados in novos.items()
+    ])
+    return list(novos), sorted(ja_lancadas)
+
+
+def _mudancas_desde(tecnico, token, filial):
+    carteira = EstoqueTecnico.objects.filter(tecnico=tecnico)
+    estoque = anotar_saldo(Equipamento.objects.all(), filial)
+    if token:
+        # Só o que alguma movimentação depois do token mexeu (subconsulta, o banco resolve)
+        novas = Movimentacao.objects.filter(id__gt=token)
+        carteira = carteira.filter(equipamento_id__in=novas.filter(tecnico=tecnico).values('equipamento_id'))
+        estoque = estoque.filter(id__in=novas.filter(filial_id=filial).values('equipamento_id'))
+    return {
+        'carteira': [
+            {'equipamento': e, 'quantidade': q}
+            for e, q in carteira.order_by('equipamento_id').values_list('equipamento_id', 'quantidade')
+        ],
+        'estoque': [
+            {'id': pk, 'nome': nome, 'quantidade': q}
+            for pk, nome, q in estoque.order_by('id').values_list('id', 'nome', 'saldo')
+        ],
+    }
+
+
+# Devolve {'aplicadas': [chaves], 'repetidas': [chaves], 'token': id, 'carteira': [...], 'estoque': [...]}
+# Levanta ValidationError (nada é gravado) se algum movimento for inválido ou faltar saldo.
+def sincronizar(tecnico, movimentos, token=0, filial=MATRIZ):
+    unicos = _conferir_movimentos(movimentos)
+    if type(token) is not int or token < 0:
+        raise ValidationError("'token' precisa ser o número devolvido na última sincronização.")
+    if type(filial) is not int:
+        raise ValidationError("'filial' precisa ser o id da filial.")
+
+    for tentativa in range(2):
+        try:
+            with transaction.atomic():
+                aplicadas, repetidas = _lancar_novos(tecnico, unicos, filial) if unicos else ([], [])
+                novo_token = Movimentacao.objects.aggregate(ultima=Max('id'))['ultima'] or 0
+                resultado = {'aplicadas': aplicadas, 'repetidas': repetidas, 'token': novo_token}
+                resultado.update(_mudancas_desde(tecnico, token, filial))
+            return resultado
+        except IntegrityError:
+            # O mesmo lote chegou duas vezes ao mesmo tempo (celular reenviou antes da
+            # resposta): o índice único barrou este; na segunda volta as chaves já constam
+            if tentativa:
+                raise
@@ -0,0 +1,187 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .consumo import refazer_consumo
+from .filiais import saldos_iniciais
+from .models import Equipamento, EstoqueTecnico, Movimentacao
+from .signals import invalidar_catalogo, invalidar_estoque
+
+# ==============================================================================
+# DADOS SINTÉTICOS (Base de teste com cara de operação real)
+# ==============================================================================
+# Usado pelo comando "gerar_dados_sinteticos" e pela suíte de benchmarks.
+# Mesma semente = mesmos dados, então duas medições são comparáveis.
+#
+# O histórico é gerado em ordem de data e respeita os saldos: retirada só do que
+# a empresa tem, baixa/devolução só do que está na carteira do técnico. Faltou na
+# empresa? Entra uma compra antes. No fim, Equipamento.quantidade e as carteiras
+# ficam iguais à soma do histórico (a conciliação bate).
+#
+# Poucos itens saem muito (cabo, conector) e muitos saem pouco: a escolha do item
+# segue uma curva 1/posição, como no estoque de verdade.
+PRODUTOS = ('ONU', 'Roteador', 'Conector', 'Cabo Drop', 'Splitter', 'Antena', 'Rádio', 'Caixa CTO',
+            'Alicate', 'Fusão', 'Esticador', 'Fita', 'Patch Cord', 'Switch', 'PTO', 'Abraçadeira')
+MARCAS = ('Huawei', 'ZTE', 'Nokia', 'Intelbras', 'Ubiquiti', 'Mikrotik', 'TP-Link', 'Furukawa')
+TIPOS = [valor for valor, _ in Equipamento.TIPO_CHOICES]
+PREFIXO_TECNICO = 'sintetico'
+TAMANHO_LOTE = 5000
+
+# Chance de cada tipo de lançamento (o resto vira SAIDA)
+CHANCE_ENTRADA = 0.06
+CHANCE_BAIXA = 0.34
+CHANCE_DEVOLUCAO = 0.10
+
+
+@contextmanager
+def _datas_do_historico():
+    # Movimentacao.data é auto_now_add: sem isto, o bulk_create grava "agora" em tudo
+    campo = Movimentacao._meta.get_field('data')
+    campo.auto_now_add = False
+    try:
+        yield
+    finally:
+        campo.auto_now_add = True
+
+
+def _criar_itens(quantos, sorteio):
+    return Equipamento.objects.bulk_create(
+        Equipamento(
+            nome=f'{PRODUTOS[i % len(PRODUTOS)]} {MARCAS[i // len(PRODUTOS) % len(MARCAS)]} {i:05d}',
+            tipo=TIPOS[i % len(TIPOS)], quantidade=0, minimo=sorteio.randint(0, 20),
+            especificacoes=f'Modelo {sorteio.randint(100, 999)}' if i % 3 == 0 else None,
+        )
+        for i in range(quantos)
+    )
+
+
+def _criar_tecnicos(quantos):
+    senha = make_password(None)  # ninguém entra com estes usuários
+    return User.objects.bulk_create(
+        User(username=f'{PREFIXO_TECNICO}{i:04d}', password=senha) for i in range(quantos)
+    )
+
+
+# Gera o histórico em ordem de data, entregando cada movimentação para "gravar".
+# Devolve as carteiras finais {(técnico, item): quantidade} (posições nas listas).
+def _historico(itens, tecnicos, autor, quantas, dias, sorteio, gravar):
+    gerador = np.random.default_rng(sorteio.randint(0, 2 ** 32))
+    pesos = 1 / np.arange(1, len(itens) + 1)
+    escolhas_item = gerador.choice(len(itens), size=quantas, p=pesos / pesos.sum())
+    escolhas_tecnico = gerador.integers(0, len(tecnicos), size=quantas)
+    sorteios = gerador.random(quantas)
+
+    empresa = [0] * len(itens)
+    carteiras = {}
+    inicio = timezone.now() - timedelta(days=dias)
+    passo = timedelta(days=dias) / quantas
+    gerados = 0
+
+    def movimento(tipo, item, tecnico, quantidade, obs=None):
+        nonlocal gerados
+        gerados += 1
+        gravar(Movimentacao(
+            tecnico_id=tecnicos[tecnico].pk, equipamento_id=itens[item].pk, tipo=tipo, quantidade=quantidade,
+            obs=obs, data=inicio + passo * gerados, autor_movimento_id=autor.pk,
+        ))
+
+    # Últimos itens retirados por cada técnico: é deles que saem as baixas e devoluções
+    em_maos = [[] for _ in tecnicos]
+
+    while gerados < quantas:
+        posicao = gerados
+        item, tecnico, chance = int(escolhas_item[posicao]), int(escolhas_tecnico[posicao]), sorteios[posicao]
+
+        if chance < CHANCE_ENTRADA:
+            quantidade = sorteio.randint(20, 200)
+            empresa[item] += quantidade
+            movimento('ENTRADA', item, tecnico, quantidade, f'NF {sorteio.randint(10000, 99999)}')
+            continue
+
+        if chance < CHANCE_ENTRADA + CHANCE_BAIXA + CHANCE_DEVOLUCAO and em_maos[tecnico]:
+            usado = sorteio.choice(em_maos[tecnico])
+            carteira = carteiras.get((tecnico, usado), 0)
+            if carteira:
+                quantidade = sorteio.randint(1, carteira)
+                carteiras[(tecnico, usado)] = carteira - quantidade
+                if chance < CHANCE_ENTRADA + CHANCE_BAIXA:
+                    movimento('BAIXA', usado, tecnico, quantidade,
+                              f'OS {sorteio.randint(100000, 999999)} cliente {sorteio.randint(1, 5000)}')
+                else:
+                    empresa[usado] += quantidade
+                    movimento('DEVOLUCAO', usado, tecnico, quantidade)
+                continue
+
+        # Retirada (ou baixa sem nada na mão: o técnico retira primeiro)
+        quantidade = sorteio.randint(1, 10)
+        if empresa[item] < quantidade:
+            compra = quantidade * sorteio.randint(10, 40)
+            empresa[item] += compra
+            movimento('ENTRADA', item, tecnico, compra, f'NF {sorteio.randint(10000, 99999)}')
+        empresa[item] -= quantidade
+        carteiras[(tecnico, item)] = carteiras.get((tecnico, item), 0) + quantidade
+        movimento('SAIDA', item, tecnico, quantidade)
+        em_maos[tecnico].append(item)
+        if len(em_maos[tecnico]) > 40:
+            del em_maos[tecnico][:20]
+
+    # Saldos finais (iguais ao histórico)
+    for indice, quantidade in enumerate(empresa):
+        itens[indice].quantidade = quantidade
+    return carteiras
+
+
+# Grava tudo numa transação só. "avisar" recebe o andamento (texto).
+# Devolve {'itens', 'tecnicos', 'movimentacoes', 'carteiras', 'consumo'}.
+def gerar(itens=2000, tecnicos=200, movimentacoes=1_000_000, dias=365, semente=42, avisar=None):
+    avisar = avisar or (lambda texto: None)
+    sorteio = random.Random(semente)
+
+    with transaction.atomic(), _datas_do_historico():
+        lista_itens = _criar_itens(itens, sorteio)
+        lista_tecnicos = _criar_tecnicos(tecnicos)
+        autor, _ = User.objects.get_or_create(username=f'{PREFIXO_TECNICO}_secretaria',
+                                              defaults={'password': make_password(None)})
+        avisar(f"{itens} itens e {tecnicos} técnicos criados.")
+
+        lote, gravadas = [], 0
+
+        def gravar(movimentacao=None):
+            nonlocal lote, gravadas
+            if movimentacao is not None:
+                lote.append(movimentacao)
+                if len(lote) < TAMANHO_LOTE:
+                    return
+            if not lote:
+                return
+            Movimentacao.objects.bulk_create(lote)
+            gravadas, lote = gravadas + len(lote), []
+            if gravadas % (TAMANHO_LOTE * 40) == 0:
+                avisar(f"{gravadas} movimentações gravadas...")
+
+        carteiras = _historico(lista_itens, lista_tecnicos, autor, movimentacoes, dias, sorteio, gravar)
+        gravar()  # o que sobrou no último lote
+
+        Equipamento.objects.bulk_update(lista_itens, ['quantidade'], batch_size=500)
+        saldos_iniciais(lista_itens)  # tudo na Matriz
+        EstoqueTecnico.objects.bulk_create(
+            (EstoqueTecnico(tecnico_id=lista_tecnicos[tecnico].pk, equipamento_id=lista_itens[item].pk,
+                            quantidade=quantidade)
+             for (tecnico, item), quantidade in carteiras.items() if quantidade),
+            batch_size=TAMANHO_LOTE,
+        )
+        # Só o período gerado (o consumo de antes dele não mudou)
+        consumo = refazer_consumo(inicio=timezone.localdate() - timedelta(days=dias + 1))
+        invalidar_estoque()
+        invalidar_catalogo()
+
+    return {
+        'itens': itens, 'tecnicos': tecnicos, 'movimentacoes': gravadas,
+        'carteiras': sum(1 for quantidade in carteiras.values() if quantidade), 'consumo': consumo,
+    }
@@ -0,0 +1,29 @@
+// Filtros de Técnico/Equipamento do admin: busca digitando (select2 + autocomplete do Django)
+window.addEventListener('load', function () {
+    var $ = window.jQuery;
+    if (!$ || !$.fn.select2) return;
+
+    $('.filtro-autocomplete').not('.select2-hidden-accessible').each(function () {
+        var $campo = $(this);
+        $campo.select2({
+            ajax: {
+                url: $campo.data('url'),
+                dataType: 'json',
+                delay: 250,
+                data: function (params) { return {term: params.term, page: params.page}; }
+            },
+            allowClear: true,
+            placeholder: $campo.data('titulo'),
+            width: 'style'
+        });
+
+        // Só manda o filtro no formulário quando tem alguém escolhido
+        $campo.on('change', function () {
+            if ($campo.val()) {
+                $campo.attr('name', $campo.data('name'));
+            } else {
+                $campo.removeAttr('name');
+            }
+        }).trigger('change');
+    });
+});
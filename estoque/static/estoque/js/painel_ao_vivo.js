@@ -0,0 +1,71 @@
+// Painel ao vivo: recebe os saldos novos do servidor (SSE, ver estoque/ao_vivo.py)
+// e troca só o número dos cards afetados, sem recarregar a página.
+(function () {
+    var painel = document.getElementById('painel-estoque');
+    if (!painel || !window.EventSource) return;
+
+    var versao = Number(painel.dataset.versao);
+    var eventos = new EventSource(painel.dataset.eventos);
+
+    function recarregar() {
+        eventos.close();
+        // Proteção contra recarregar sem parar (ex.: processos com versões diferentes)
+        var ultima = Number(sessionStorage.getItem('painel-recarregado') || 0);
+        if (Date.now() - ultima < 30000) return;
+        sessionStorage.setItem('painel-recarregado', String(Date.now()));
+        location.reload();
+    }
+
+    function atualizarCard(item) {
+        var card = painel.querySelector('[data-equipamento-id="' + item.id + '"]');
+        if (!card) return;  // item de outra página/filtro
+
+        var numero = card.querySelector('.qtd-badge');
+        numero.textContent = item.quantidade;
+        numero.classList.toggle('qtd-low', item.baixo);
+        numero.classList.toggle('qtd-ok', !item.baixo);
+
+        var aviso = card.querySelector('.aviso-baixo');
+        if (item.baixo && !aviso) {
+            aviso = document.createElement('small');
+            aviso.className = 'aviso-baixo d-block text-danger text-center mt-1';
+            aviso.style.cssText = 'font-size: 0.6rem; font-weight: bold;';
+            aviso.textContent = 'BAIXO';
+            numero.after(aviso);
+        } else if (!item.baixo && aviso) {
+            aviso.remove();
+        }
+
+        // Quanto está segurado por lotes em rascunho
+        var reserva = card.querySelector('.aviso-reserva');
+        if (item.reservado && !reserva) {
+            reserva = document.createElement('small');
+            reserva.className = 'aviso-reserva d-block text-muted text-center mt-1';
+            reserva.style.cssText = 'font-size: 0.6rem;';
+            (card.querySelector('.aviso-baixo') || numero).after(reserva);
+        }
+        if (item.reservado) {
+            reserva.textContent = '🔒 ' + item.reservado + ' reserv.';
+        } else if (reserva) {
+            reserva.remove();
+        }
+
+        // Destaque rápido no número que mudou
+        numero.classList.add('atualizado');
+        setTimeout(function () { numero.classList.remove('atualizado'); }, 1500);
+    }
+
+    // Na (re)conexão: se o estoque mudou enquanto a conexão estava fechada, página nova
+    eventos.addEventListener('versao', function (e) {
+        if (JSON.parse(e.data).versao !== versao) recarregar();
+    });
+
+    eventos.addEventListener('saldos', function (e) {
+        var dados = JSON.parse(e.data);
+        versao = dados.versao;
+        dados.itens.forEach(atualizarCard);
+    });
+
+    // Ficou para trás (muitos eventos de uma vez): mais fácil pegar a página inteira
+    eventos.addEventListener('recarregar', recarregar);
+})();
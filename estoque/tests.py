@@ -1,3 +1,2153 @@
-from django.test import TestCase
+import io
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .models import (
+    Equipamento, EstoqueFilial, EstoqueTecnico, Fechamento, ItemOrdem, Movimentacao, OrdemMovimentacao,
+    SaldoConciliado,
+)
+
+
+# ==============================================================================
+# 1. MOTOR DE SALDOS (Movimentação individual)
+# ==============================================================================
+
+class MovimentacaoSaldoTests(TestCase):
+    def setUp(self):
+        self.tecnico = User.objects.create(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=10)
+
+    def movimentar(self, tipo, quantidade):
+        mov = Movimentacao(tecnico=self.tecnico, equipamento=self.onu, tipo=tipo, quantidade=quantidade,
+                          autor_movimento=self.tecnico)
+        mov.full_clean()
+        mov.save()
+        return mov
+
+    def saldos(self):
+        self.onu.refresh_from_db()
+        carteira = EstoqueTecnico.objects.get(tecnico=self.tecnico, equipamento=self.onu)
+        return self.onu.quantidade, carteira.quantidade
+
+    def test_saida_devolucao_baixa(self):
+        self.movimentar('SAIDA', 4)
+        self.assertEqual(self.saldos(), (6, 4))
+        self.movimentar('DEVOLUCAO', 1)
+        self.assertEqual(self.saldos(), (7, 3))
+        self.movimentar('BAIXA', 3)
+        self.assertEqual(self.saldos(), (7, 0))
+
+    def test_clean_nao_cria_carteira(self):
+        mov = Movimentacao(tecnico=self.tecnico, equipamento=self.onu, tipo='BAIXA', quantidade=1)
+        with self.assertRaises(ValidationError):
+            mov.full_clean()
+        self.assertFalse(EstoqueTecnico.objects.exists())
+
+    def test_clean_faz_uma_consulta_so(self):
+        mov = Movimentacao(tecnico=self.tecnico, equipamento=self.onu, tipo='SAIDA', quantidade=2)
+        with self.assertNumQueries(1):
+            mov.clean()
+
+    def test_save_sem_saldo_nao_grava_nada(self):
+        # Passa pelo clean, mas outro lançamento levou o estoque antes do save
+        mov = Movimentacao(tecnico=self.tecnico, equipamento=self.onu, tipo='SAIDA', quantidade=8,
+                          autor_movimento=self.tecnico)
+        mov.full_clean()
+        EstoqueFilial.objects.filter(equipamento=self.onu).update(quantidade=5)
+
+        with self.assertRaises(ValidationError):
+            mov.save()
+        self.assertFalse(Movimentacao.objects.exists())
+        self.assertFalse(EstoqueTecnico.objects.exists())
+        self.onu.refresh_from_db()
+        self.assertEqual(self.onu.quantidade, 5)
+
+
+class MovimentacaoConcorrenciaTests(TransactionTestCase):
+    # Várias secretárias lançando retiradas do mesmo item ao mesmo tempo
+    # O flush do fim apagaria a Matriz criada pela migração
+    serialized_rollback = True
+    ESCRITORES = 8
+    LANCAMENTOS = 10
+
+    def test_retiradas_simultaneas_nao_perdem_saldo(self):
+        onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=50)
+        tecnicos = [User.objects.create(username=f'tec{i}') for i in range(self.ESCRITORES)]
+        aceitos, recusados = [], []
+        largada = threading.Barrier(self.ESCRITORES)
+
+        def escritor(tecnico):
+            largada.wait()
+            try:
+                for _ in range(self.LANCAMENTOS):
+                    while True:
+                        try:
+                            mov = Movimentacao(
+                                tecnico=tecnico,
+                                equipamento=Equipamento.objects.get(pk=onu.pk),
+                                tipo='SAIDA',
+                                quantidade=1,
+                            )
+                            mov.save()
+                            aceitos.append(tecnico.pk)
+                        except ValidationError:
+                            recusados.append(tecnico.pk)
+                        except OperationalError:
+                            # SQLite travado por outro escritor: tenta de novo
+                            time.sleep(0.001)
+                            continue
+                        break
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=escritor, args=(t,)) for t in tecnicos]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        onu.refresh_from_db()
+        self.assertEqual(len(aceitos), 50)
+        self.assertEqual(len(recusados), self.ESCRITORES * self.LANCAMENTOS - 50)
+        self.assertEqual(onu.quantidade, 0)
+        self.assertEqual(Movimentacao.objects.count(), 50)
+        self.assertEqual(EstoqueTecnico.objects.aggregate(total=Sum('quantidade'))['total'], 50)
+        for tecnico in tecnicos:
+            self.assertEqual(
+                EstoqueTecnico.objects.filter(tecnico=tecnico).aggregate(total=Sum('quantidade'))['total'] or 0,
+                aceitos.count(tecnico.pk),
+            )
+
+
+# ==============================================================================
+# 2. LANÇAMENTO EM LOTE
+# ==============================================================================
+
+class LoteTests(TestCase):
+    def setUp(self):
+        self.tecnico = User.objects.create(username='natan')
+        self.secretaria = User.objects.create(username='secretaria')
+
+    def criar_lote(self, n_itens, tipo='SAIDA', estoque=100):
+        ordem = OrdemMovimentacao.objects.create(tecnico=self.tecnico, tipo=tipo, obs='Kit manhã')
+        for i in range(n_itens):
+            eqp = Equipamento.objects.create(nome=f'Item {i:03d} (lote {ordem.pk})', tipo='FIBRA', quantidade=estoque)
+            ItemOrdem.objects.create(ordem=ordem, equipamento=eqp, quantidade=2)
+        return ordem
+
+    def test_lote_atualiza_saldos(self):
+        ordem = self.criar_lote(3)
+        ordem.lancar(autor=self.secretaria)
+
+        self.assertTrue(OrdemMovimentacao.objects.get(pk=ordem.pk).lancado)
+        self.assertEqual(Movimentacao.objects.filter(obs__startswith=f'Lote #{ordem.pk}').count(), 3)
+        self.assertEqual(set(Equipamento.objects.values_list('quantidade', flat=True)), {98})
+        self.assertEqual(set(EstoqueTecnico.objects.values_list('quantidade', flat=True)), {2})
+
+    def test_lote_soma_itens_repetidos(self):
+        ordem = self.criar_lote(1, estoque=3)
+        ItemOrdem.objects.create(ordem=ordem, equipamento=Equipamento.objects.get(), quantidade=2)
+
+        with self.assertRaises(ValidationError):
+            ordem.lancar(autor=self.secretaria)
+        self.assertEqual(Equipamento.objects.get().quantidade, 3)
+
+    def test_lote_com_item_sem_saldo_nao_grava_nada(self):
+        ordem = self.criar_lote(5)
+        ruim = ordem.itemordem_set.order_by('pk').last()
+        EstoqueFilial.objects.filter(equipamento_id=ruim.equipamento_id).update(quantidade=1)
+
+        with self.assertRaises(ValidationError) as erro:
+            ordem.lancar(autor=self.secretaria)
+
+        self.assertEqual(len(erro.exception.messages), 1)
+        self.assertIn("Item 004", erro.exception.messages[0])
+        self.assertFalse(Movimentacao.objects.exists())
+        self.assertFalse(EstoqueTecnico.objects.exists())
+        self.assertFalse(OrdemMovimentacao.objects.get(pk=ordem.pk).lancado)
+
+    def test_numero_de_consultas_nao_cresce_com_o_lote(self):
+        consultas = []
+        for n_itens in (5, 60):
+            ordem = self.criar_lote(n_itens)
+            with CaptureQueriesContext(connection) as ctx:
+                ordem.lancar(autor=self.secretaria)
+            consultas.append(len(ctx.captured_queries))
+
+        self.assertEqual(consultas[0], consultas[1])
+
+        # Devolução e baixa do kit inteiro também têm custo fixo
+        for tipo in ('DEVOLUCAO', 'BAIXA'):
+            ordem = OrdemMovimentacao.objects.create(tecnico=self.tecnico, tipo=tipo)
+            ItemOrdem.objects.bulk_create(
+                ItemOrdem(ordem=ordem, equipamento=eqp, quantidade=1) for eqp in Equipamento.objects.all()
+            )
+            with CaptureQueriesContext(connection) as ctx:
+                ordem.lancar(autor=self.secretaria)
+            self.assertLessEqual(len(ctx.captured_queries), consultas[0])
+
+
+# ==============================================================================
+# 3. RELATÓRIO PDF
+# ==============================================================================
+
+def texto_do_pdf(conteudo):
+    # Junta o texto de todas as páginas (o fpdf comprime cada página com zlib)
+    paginas = re.findall(rb'stream\n(.*?)\nendstream', conteudo, re.S)
+    return b''.join(zlib.decompress(pagina) for pagina in paginas)
+
+
+class RelatorioPdfTests(TestCase):
+    def setUp(self):
+        # PDFs gerados na hora e guardados numa pasta temporária
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        ajuste = override_settings(RELATORIO_WORKERS=0, RELATORIOS_ROOT=pasta)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+        self.gestor = User.objects.create_user(username='gestor', password='x')
+        self.client.force_login(self.gestor)
+        self.natan = User.objects.create(username='natan')
+        self.carlos = User.objects.create(username='carlos')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=1000)
+
+    def lancar(self, tecnico, n, tipo='SAIDA'):
+        from .saldos import lancar_movimentos
+        lancar_movimentos(
+            Movimentacao(tecnico=tecnico, equipamento=self.onu, tipo=tipo, quantidade=1) for _ in range(n)
+        )
+
+    def baixar(self, **filtros):
+        response = self.client.get('/relatorio-pdf/', filtros)
+        self.assertEqual(response.status_code, 200)
+        conteudo = b''.join(response.streaming_content)
+        self.assertTrue(conteudo.startswith(b'%PDF'))
+        self.assertEqual(int(response['Content-Length']), len(conteudo))
+        return texto_do_pdf(conteudo)
+
+    def test_sem_filtro_mostra_ultimas_20(self):
+        self.lancar(self.natan, 30)
+        self.assertIn(b'Ultimos 20', self.baixar())
+
+    def test_historico_sem_consulta_por_linha(self):
+        self.lancar(self.natan, 5)
+        with CaptureQueriesContext(connection) as poucas:
+            self.baixar(tecnico='natan')
+        self.lancar(self.carlos, 5)
+        self.lancar(self.natan, 50)
+        with CaptureQueriesContext(connection) as muitas:
+            self.baixar(tecnico='natan')
+        self.assertEqual(len(poucas.captured_queries), len(muitas.captured_queries))
+
+    def test_filtros_e_partes(self):
+        from . import relatorios
+        self.lancar(self.natan, 7)
+        self.lancar(self.carlos, 3)
+
+        with mock.patch.object(relatorios, 'LINHAS_POR_PARTE', 4):
+            self.assertEqual(relatorios.total_de_partes({'tecnico': self.natan}), 2)
+            self.assertIn(b'Parte 2 de 2', self.baixar(tecnico='natan', parte=2))
+            self.assertEqual(relatorios.total_de_partes({'tecnico': self.carlos, 'tipo': 'SAIDA'}), 1)
+
+    def test_filtro_invalido(self):
+        response = self.client.get('/relatorio-pdf/', {'inicio': '2026-02-10', 'fim': '2026-02-01'})
+        self.assertEqual(response.status_code, 400)
+
+        # O valor inválido volta na mensagem, mas escapado
+        response = self.client.get('/relatorio-pdf/', {'tipo': '<script>alert(1)</script>'})
+        self.assertEqual(response.status_code, 400)
+        self.assertNotContains(response, '<script>', status_code=400)
+        self.assertContains(response, '&lt;script&gt;', status_code=400)
+
+    def test_clique_repetido_usa_o_pdf_guardado(self):
+        from . import relatorios
+        self.lancar(self.natan, 3)
+
+        with mock.patch.object(relatorios, 'gerar_pdf', wraps=relatorios.gerar_pdf) as gerar:
+            self.baixar()
+            self.baixar()
+            self.assertEqual(gerar.call_count, 1)
+
+            # Filtro diferente é outro relatório
+            self.baixar(tecnico='natan')
+            self.assertEqual(gerar.call_count, 2)
+
+            # Movimentação nova: o estoque mudou, gera de novo
+            self.lancar(self.natan, 1)
+            self.baixar()
+            self.assertEqual(gerar.call_count, 3)
+
+    def test_movimentacao_editada_ou_apagada_muda_a_chave(self):
+        from . import fila
+        self.lancar(self.natan, 3)
+
+        chaves = [fila.calcular_chave({}, 1)]
+        ultima = Movimentacao.objects.latest('id')
+        with self.captureOnCommitCallbacks(execute=True):
+            ultima.obs = 'corrigida'
+            ultima.save(update_fields=['obs'])
+        chaves.append(fila.calcular_chave({}, 1))
+
+        # Apagar a mais nova volta o MAX(id) para o de antes: mesmo assim é outra chave
+        with self.captureOnCommitCallbacks(execute=True):
+            ultima.delete()
+        chaves.append(fila.calcular_chave({}, 1))
+        self.assertEqual(len(set(chaves)), 3)
+
+    def test_fila_em_segundo_plano(self):
+        from . import fila
+        self.addCleanup(fila._trabalhos.clear)
+        with override_settings(RELATORIO_WORKERS=2), mock.patch.object(fila, '_pool_de_processos') as pool:
+            response = self.client.get('/relatorio-pdf/', {'tipo': 'BAIXA'})
+            self.assertEqual(response.status_code, 202)
+            self.assertTrue(pool.return_value.submit.called)
+
+            pool.return_value.submit.return_value.done.return_value = False
+            status_url = response.context['status_url']
+            self.assertEqual(self.client.get(status_url).json()['status'], 'gerando')
+
+            # O processo terminou: o arquivo aparece e a situação vira "pronto"
+            _, filtros, parte, destino = pool.return_value.submit.call_args.args
+            fila.renderizar(filtros, parte, destino)
+            dados = self.client.get(status_url).json()
+            self.assertEqual(dados['status'], 'pronto')
+            self.assertTrue(texto_do_pdf(b''.join(self.client.get(dados['url']).streaming_content)))
+
+    def test_arquivo_inexistente(self):
+        self.assertEqual(self.client.get('/relatorio-pdf/arquivo/' + 'a' * 40 + '/').status_code, 404)
+        self.assertEqual(self.client.get('/relatorio-pdf/status/..%2F..%2Fetc/').status_code, 404)
+
+    def test_arquivo_apagado_depois_de_pronto(self):
+        from . import fila
+
+        # A faxina apaga o PDF logo depois da conferência: volta para a fila, sem erro 500
+        with mock.patch.object(fila, 'situacao', return_value='pronto'), \
+                mock.patch.object(fila, 'enfileirar') as enfileirar:
+            response = self.client.get('/relatorio-pdf/')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(enfileirar.call_count, 2)
+
+    def test_parte_invalida(self):
+        from . import fila
+        self.baixar()
+        chave = fila.calcular_chave({}, 1)
+        self.assertEqual(self.client.get(f'/relatorio-pdf/arquivo/{chave}/', {'parte': 'abc'}).status_code, 404)
+        self.assertEqual(self.client.get(f'/relatorio-pdf/status/{chave}/', {'parte': '-1'}).status_code, 404)
+        response = self.client.get(f'/relatorio-pdf/arquivo/{chave}/', {'parte': '1'})
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        # No link principal, parte estranha continua sendo a primeira
+        self.assertEqual(self.client.get('/relatorio-pdf/', {'parte': 'abc'}).status_code, 200)
+
+
+# ==============================================================================
+# 4. PAINEL (index)
+# ==============================================================================
+
+class PainelTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.gestor = User.objects.create_user(username='gestor', password='x')
+        self.client.force_login(self.gestor)
+        Equipamento.objects.bulk_create(
+            Equipamento(nome=f'ONU {i:03d}', tipo='FIBRA', quantidade=i, minimo=5) for i in range(40)
+        )
+        Equipamento.objects.create(nome='Alicate', tipo='FERRAMENTA', quantidade=2, minimo=1)
+
+    def test_versao_lida_uma_vez_por_requisicao(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from . import signals
+
+        signals.versao_estoque()  # versão já gravada no cache
+        # FileBasedCache em produção: cada leitura é um arquivo aberto
+        with mock.patch.object(signals, 'cache', wraps=signals.cache) as cache:
+            self.client.get('/')
+            self.client.get('/', {'tipo': 'FIBRA'})
+        lidas = [chamada for chamada in cache.get.call_args_list if chamada.args[0] == signals.CHAVE_VERSAO]
+        self.assertEqual(len(lidas), 2)
+
+        # Gravou durante a requisição: a versão nova vale na mesma hora
+        antes = signals.versao_estoque()
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(seconds=5)):
+            token = signals._lidas.set({})
+            try:
+                signals.versao_estoque()
+                with self.captureOnCommitCallbacks(execute=True):
+                    signals.invalidar_estoque()
+                self.assertGreater(signals.versao_estoque(), antes)
+            finally:
+                signals._lidas.reset(token)
+
+    def test_paginacao_e_filtros(self):
+        response = self.client.get('/')
+        self.assertEqual(response.context['pagina'].paginator.count, 41)
+        self.assertEqual(len(response.context['pagina']), 30)
+        self.assertContains(response, 'Página 1 de 2')
+
+        response = self.client.get('/', {'tipo': 'FIBRA', 'baixo': '1'})
+        self.assertEqual([e.nome for e in response.context['pagina']], [f'ONU {i:03d}' for i in range(6)])
+        self.assertNotContains(response, 'Alicate')
+
+    def test_cache_e_invalidacao(self):
+        self.client.get('/')
+        # Segunda visita: o pedaço vem do cache, nenhuma consulta em Equipamento
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertContains(self.client.get('/'), 'ONU 000')
+        self.assertFalse([q for q in ctx.captured_queries if 'estoque_equipamento' in q['sql']])
+
+        # Mudou o estoque: a página é montada de novo
+        with self.captureOnCommitCallbacks(execute=True):
+            Equipamento.objects.filter(nome='ONU 000').update(nome='Alfa ONU')
+            Equipamento.objects.get(nome='Alfa ONU').save()
+        self.assertContains(self.client.get('/'), 'Alfa ONU')
+
+    def test_etag_304(self):
+        response = self.client.get('/')
+        self.assertTrue(response.has_header('ETag'))
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        igual = self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(igual.status_code, 304)
+
+        # Filtro diferente tem ETag diferente
+        outro = self.client.get('/', {'tipo': 'FIBRA'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(outro.status_code, 200)
+
+        tecnico = User.objects.create(username='natan')
+        with self.captureOnCommitCallbacks(execute=True):
+            Movimentacao(tecnico=tecnico, equipamento=Equipamento.objects.get(nome='Alicate'),
+                         tipo='SAIDA', quantidade=1).save()
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+
+# ==============================================================================
+# 5. MINIATURAS DAS FOTOS
+# ==============================================================================
+
+class MiniaturaTests(TestCase):
+    def setUp(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        ajuste = override_settings(MEDIA_ROOT=pasta)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+    def foto(self, nome='onu.jpg'):
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        # Foto "de celular": grande e com EXIF (modelo da câmera)
+        buffer = io.BytesIO()
+        exif = Image.Exif()
+        exif[0x0110] = 'Celular do Natan'
+        Image.new('RGB', (1200, 800), (200, 30, 30)).save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile(nome, buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_gera_miniaturas_sem_metadados(self):
+        from PIL import Image
+        from .imagens import nome_miniatura
+
+        eqp = Equipamento.objects.create(nome='ONU', tipo='FIBRA', foto=self.foto())
+
+        for extensao in ('webp', 'jpg'):
+            with Image.open(nome_miniatura(eqp.foto.path, extensao)) as mini:
+                self.assertEqual(mini.size, (160, 160))
+                self.assertFalse(mini.getexif())
+        self.assertTrue(eqp.foto_mini_webp.endswith('_mini.webp'))
+
+    def test_miniaturas_so_quando_a_foto_muda(self):
+        import os
+        from PIL import Image
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from .imagens import nome_miniatura
+
+        eqp = Equipamento.objects.create(nome='ONU', tipo='FIBRA', foto=self.foto())
+        mini = nome_miniatura(eqp.foto.path, 'jpg')
+
+        # Salvar por outro motivo (mínimo, nome) não mexe nas miniaturas
+        with mock.patch('estoque.signals.gerar_miniaturas') as gerar:
+            eqp.minimo = 5
+            eqp.save()
+            Equipamento.objects.get(pk=eqp.pk).save()
+        self.assertFalse(gerar.called)
+
+        # Foto nova com o mesmo nome (a antiga foi apagada, as miniaturas dela ficaram): refeitas
+        nome = eqp.foto.name
+        os.remove(eqp.foto.path)
+        azul = io.BytesIO()
+        Image.new('RGB', (400, 400), (20, 30, 220)).save(azul, 'JPEG')
+        eqp.foto = SimpleUploadedFile('onu.jpg', azul.getvalue(), content_type='image/jpeg')
+        eqp.save()
+        self.assertEqual(eqp.foto.name, nome)
+        with Image.open(mini) as imagem:
+            vermelho, _, azul = imagem.getpixel((80, 80))
+        self.assertGreater(azul, vermelho)
+
+        # Storage sem caminho local: sem miniatura, mas o cadastro salva
+        with mock.patch('estoque.signals.gerar_miniaturas', side_effect=NotImplementedError):
+            Equipamento.objects.create(nome='Cabo', tipo='FIBRA', foto=self.foto('cabo.jpg'))
+
+    def test_painel_usa_miniatura(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client.force_login(User.objects.create_user(username='gestor'))
+        eqp = Equipamento.objects.create(nome='ONU', tipo='FIBRA', foto=self.foto())
+
+        response = self.client.get('/')
+        self.assertContains(response, eqp.foto_mini_webp)
+        self.assertContains(response, 'width="80" height="80"')
+
+    def test_comando_gera_as_que_faltam(self):
+        import os
+        from django.core.management import call_command
+        from .imagens import nome_miniatura
+
+        eqp = Equipamento.objects.create(nome='ONU', tipo='FIBRA', foto=self.foto())
+        mini = nome_miniatura(eqp.foto.path, 'webp')
+        os.remove(mini)
+
+        call_command('gerar_miniaturas', processos=1, stdout=io.StringIO())
+        self.assertTrue(os.path.exists(mini))
+
+
+# ==============================================================================
+# 6. ÍNDICES (Plano de consulta das telas mais usadas)
+# ==============================================================================
+# Falha se uma consulta quente passar a varrer a tabela inteira ("SCAN tabela"
+# sem índice) ou a ordenar numa tabela temporária ("USE TEMP B-TREE").
+
+@skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN é do SQLite")
+class PlanoDeConsultaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.tecnico = User.objects.create(username='natan')
+        cls.onu = Equipamento.objects.create(nome='ONU', tipo='FIBRA', quantidade=100)
+        Movimentacao.objects.create(tecnico=cls.tecnico, equipamento=cls.onu, tipo='SAIDA', quantidade=1,
+                                    autor_movimento=cls.tecnico)
+
+    def plano(self, sql, params=()):
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return [linha[-1] for linha in cursor.fetchall()]
+
+    def assertUsaIndice(self, sql, params=()):
+        for passo in self.plano(sql, params):
+            tabela = re.match(r'SCAN (\w+)$', passo)
+            self.assertFalse(tabela and tabela.group(1).startswith('estoque_'), f"Varredura completa: {passo}\n{sql}")
+            self.assertNotIn('TEMP B-TREE', passo, sql)
+
+    def assertQuerysetUsaIndice(self, queryset):
+        self.assertUsaIndice(*queryset.query.sql_with_params())
+
+    def test_historico_do_admin_e_do_pdf(self):
+        from django.contrib import admin
+        from .relatorios import movimentacoes_do_relatorio
+
+        ordem = admin.site._registry[Movimentacao].get_ordering(None)
+        self.assertQuerysetUsaIndice(Movimentacao.objects.order_by(*ordem, '-pk')[:100])
+        self.assertQuerysetUsaIndice(movimentacoes_do_relatorio({})[:20])
+
+    def test_historico_filtrado(self):
+        from datetime import date
+        from .relatorios import movimentacoes_do_relatorio
+
+        periodo = {'inicio': date(2026, 1, 1), 'fim': date(2026, 1, 31)}
+        self.assertQuerysetUsaIndice(movimentacoes_do_relatorio(periodo))
+        self.assertQuerysetUsaIndice(movimentacoes_do_relatorio({**periodo, 'tecnico': self.tecnico}))
+        self.assertQuerysetUsaIndice(movimentacoes_do_relatorio({'tecnico': self.tecnico}))
+        self.assertQuerysetUsaIndice(Movimentacao.objects.filter(equipamento=self.onu).order_by('-data'))
+
+    def test_painel_e_carteiras(self):
+        self.assertQuerysetUsaIndice(Equipamento.objects.order_by('nome', 'id')[:30])
+        self.assertQuerysetUsaIndice(Equipamento.objects.filter(tipo='FIBRA').order_by('nome', 'id')[:30])
+        self.assertQuerysetUsaIndice(EstoqueTecnico.objects.filter(tecnico=self.tecnico))
+
+    def test_telas_nao_varrem_tabelas(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser(username='gestor'))
+        # Itens para uma segunda página de verdade (com OFFSET)
+        Equipamento.objects.bulk_create(Equipamento(nome=f'ONU {i:02d}', tipo='FIBRA') for i in range(40))
+
+        for url in ('/', '/?tipo=FIBRA&page=2', '/admin/estoque/movimentacao/', '/admin/estoque/equipamento/'):
+            with CaptureQueriesContext(connection) as consultas:
+                response = self.client.get(url)
+            if 'page=2' in url:
+                self.assertEqual(response.context['pagina'].number, 2)
+            for consulta in consultas.captured_queries:
+                if consulta['sql'].startswith('SELECT') and 'estoque_' in consulta['sql']:
+                    self.assertUsaIndice(consulta['sql'])
+
+
+# ==============================================================================
+# 7. PERFIL DO SQLITE (PRAGMAs na conexão)
+# ==============================================================================
+
+@skipUnless(connection.vendor == 'sqlite', "PRAGMAs são do SQLite")
+class PerfilSqliteTests(TestCase):
+    def pragma(self, nome):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {nome}")
+            return cursor.fetchone()[0]
+
+    def test_conexao_nova_recebe_pragmas(self):
+        from django.db.backends.signals import connection_created
+
+        original = self.pragma('cache_size')
+        self.addCleanup(lambda: connection.cursor().execute(f"PRAGMA cache_size = {original}"))
+
+        with override_settings(SQLITE_PRAGMAS={'cache_size': -1234, 'busy_timeout': 777}):
+            connection_created.send(sender=connection.__class__, connection=connection)
+        self.assertEqual(self.pragma('cache_size'), -1234)
+        self.assertEqual(self.pragma('busy_timeout'), 777)
+
+    def test_benchmark_roda_os_dois_perfis(self):
+        from django.core.management import call_command
+
+        saida = io.StringIO()
+        call_command('benchmark_sqlite', segundos=0.2, leitores=2, escritores=2, stdout=saida)
+        self.assertIn('padrao', saida.getvalue())
+        self.assertIn('producao', saida.getvalue())
+
+
+# ==============================================================================
+# 8. FECHAMENTOS (Saldo numa data passada)
+# ==============================================================================
+
+class FechamentoTests(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+
+        self.tecnico = User.objects.create(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU', tipo='FIBRA', quantidade=100)
+        self.inicio = timezone.now() - timedelta(days=10)
+        self.dia = lambda n: self.inicio + timedelta(days=n)
+
+    def lancar(self, tipo, quantidade, dia):
+        mov = Movimentacao.objects.create(tecnico=self.tecnico, equipamento=self.onu, tipo=tipo,
+                                          quantidade=quantidade, autor_movimento=self.tecnico)
+        Movimentacao.objects.filter(pk=mov.pk).update(data=self.dia(dia))
+
+    def fechar(self, dia):
+        from .fechamentos import gerar_fechamento
+
+        fechamento = gerar_fechamento()
+        Fechamento.objects.filter(pk=fechamento.pk).update(data=self.dia(dia))
+        return fechamento
+
+    def conferir(self, dia, empresa, tecnico):
+        from .fechamentos import saldo_em
+
+        self.assertEqual(saldo_em(self.dia(dia), self.onu), empresa)
+        self.assertEqual(saldo_em(self.dia(dia), self.onu, self.tecnico), tecnico)
+
+    def test_saldo_em_qualquer_data(self):
+        self.lancar('SAIDA', 5, dia=1)
+        self.fechar(dia=2)
+        self.lancar('SAIDA', 3, dia=3)
+        self.lancar('DEVOLUCAO', 2, dia=4)
+        self.lancar('BAIXA', 1, dia=8)
+
+        self.conferir(0, empresa=100, tecnico=0)   # Antes de tudo: desfaz a partir do fechamento
+        self.conferir(1.5, empresa=95, tecnico=5)
+        self.conferir(3.5, empresa=92, tecnico=8)  # Soma a partir do fechamento
+        self.conferir(5, empresa=94, tecnico=6)
+        self.conferir(9, empresa=94, tecnico=5)    # Mais perto do saldo atual
+
+    def test_fechamento_guarda_empresa_e_carteiras(self):
+        from .fechamentos import saldos_em
+
+        self.lancar('SAIDA', 4, dia=1)
+        fechamento = self.fechar(dia=2)
+
+        self.assertEqual(fechamento.saldos.get(tecnico__isnull=True).quantidade, 96)
+        self.assertEqual(fechamento.saldos.get(tecnico=self.tecnico).quantidade, 4)
+        self.assertEqual(saldos_em(self.dia(2), self.tecnico), {self.onu.pk: 4})
+
+    def test_consultas_nao_dependem_do_historico(self):
+        from .fechamentos import saldos_em
+
+        self.fechar(dia=1)
+        for _ in range(30):
+            self.lancar('SAIDA', 1, dia=2)
+
+        with CaptureQueriesContext(connection) as consultas:
+            saldos = saldos_em(self.dia(1.5))
+        self.assertEqual(saldos[self.onu.pk], 100)
+        self.assertLessEqual(len(consultas), 5)
+
+    def test_comando_um_por_dia(self):
+        from django.core.management import call_command
+
+        call_command('gerar_fechamento', stdout=io.StringIO())
+        call_command('gerar_fechamento', stdout=io.StringIO())
+        self.assertEqual(Fechamento.objects.count(), 1)
+        call_command('gerar_fechamento', forcar=True, stdout=io.StringIO())
+        self.assertEqual(Fechamento.objects.count(), 2)
+
+
+# ==============================================================================
+# 9. CONCILIAÇÃO (Carteiras x Histórico)
+# ==============================================================================
+
+class ConciliacaoTests(TestCase):
+    def setUp(self):
+        self.tecnico = User.objects.create(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU', tipo='FIBRA', quantidade=100)
+        self.cabo = Equipamento.objects.create(nome='Cabo', tipo='FIBRA', quantidade=100)
+
+    def lancar(self, equipamento, tipo, quantidade):
+        return Movimentacao.objects.create(tecnico=self.tecnico, equipamento=equipamento, tipo=tipo,
+                                           quantidade=quantidade, autor_movimento=self.tecnico)
+
+    def test_historico_correto_nao_acusa_nada(self):
+        from .conciliacao import conciliar
+
+        self.lancar(self.onu, 'SAIDA', 5)
+        self.lancar(self.onu, 'BAIXA', 2)
+        primeira = conciliar()
+        self.assertEqual(primeira['divergencias'], [])
+        self.assertTrue(primeira['completa'])
+
+        self.lancar(self.cabo, 'SAIDA', 3)
+        segunda = conciliar()
+        self.assertEqual(segunda['divergencias'], [])
+        self.assertFalse(segunda['completa'])  # Só somou a movimentação nova
+        self.assertEqual(SaldoConciliado.objects.get(equipamento=self.cabo).quantidade, 3)
+
+    def test_movimentacao_apagada_e_editada(self):
+        from .conciliacao import conciliar
+
+        saida = self.lancar(self.onu, 'SAIDA', 5)
+        baixa = self.lancar(self.cabo, 'SAIDA', 4)
+        conciliar()
+
+        saida.quantidade = 7
+        saida.save()  # Edição no admin: carteira não acompanha
+        baixa.delete()
+
+        resultado = conciliar()
+        self.assertTrue(resultado['completa'])
+        self.assertEqual(resultado['divergencias'], [
+            (self.tecnico.pk, self.onu.pk, 7, 5),
+            (self.tecnico.pk, self.cabo.pk, 0, 4),
+        ])
+
+    def test_reparar(self):
+        from django.core.management import call_command
+
+        self.lancar(self.onu, 'SAIDA', 5)
+        EstoqueTecnico.objects.filter(equipamento=self.onu).update(quantidade=9)
+
+        saida = io.StringIO()
+        call_command('conciliar', stdout=saida)
+        self.assertIn('carteira 9, histórico 5', saida.getvalue())
+        self.assertEqual(EstoqueTecnico.objects.get(equipamento=self.onu).quantidade, 9)
+
+        call_command('conciliar', reparar=True, stdout=io.StringIO())
+        self.assertEqual(EstoqueTecnico.objects.get(equipamento=self.onu).quantidade, 5)
+        saida = io.StringIO()
+        call_command('conciliar', stdout=saida)
+        self.assertIn('batem com o histórico', saida.getvalue())
+
+
+# ==============================================================================
+# 10. ADMIN (Listas com número fixo de consultas)
+# ==============================================================================
+
+class AdminListasTests(TestCase):
+    def setUp(self):
+        self.gestor = User.objects.create_superuser(username='gestor')
+        self.client.force_login(self.gestor)
+
+    def lancar(self, quantas):
+        for _ in range(quantas):
+            tecnico = User.objects.create(username=f'tec{Movimentacao.objects.count()}')
+            onu = Equipamento.objects.create(nome=f'ONU {tecnico.username}', tipo='FIBRA', quantidade=10)
+            Movimentacao.objects.create(tecnico=tecnico, equipamento=onu, tipo='SAIDA', quantidade=1,
+                                        autor_movimento=self.gestor)
+
+    def consultas(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [consulta['sql'] for consulta in ctx.captured_queries]
+
+    def test_orcamento_de_consultas_por_pagina(self):
+        for url in ('/admin/estoque/movimentacao/', '/admin/estoque/estoquetecnico/'):
+            self.lancar(3)
+            poucas = self.consultas(url)
+            self.lancar(30)
+            muitas = self.consultas(url)
+            self.assertEqual(len(poucas), len(muitas), url)
+            self.assertLessEqual(len(muitas), 10, url)
+
+            # Filtros não carregam a lista inteira de técnicos/itens
+            for sql in muitas:
+                self.assertFalse(re.search(r'FROM "(auth_user|estoque_equipamento)"(?!.*WHERE)', sql), sql)
+
+    def test_filtro_autocomplete(self):
+        self.lancar(2)
+        tecnico = User.objects.get(username='tec0')
+
+        response = self.client.get(f'/admin/estoque/movimentacao/?tecnico__id__exact={tecnico.pk}')
+        self.assertContains(response, 'filtro-autocomplete')
+        self.assertContains(response, f'<option value="{tecnico.pk}" selected>tec0</option>', html=True)
+        self.assertNotContains(response, '>tec1</option>')
+
+        busca = self.client.get('/admin/autocomplete/', {
+            'app_label': 'estoque', 'model_name': 'movimentacao', 'field_name': 'tecnico', 'term': 'tec1',
+        })
+        self.assertEqual([r['text'] for r in busca.json()['results']], ['tec1'])
+
+    def test_contagem_estimada_sem_filtro(self):
+        from django.contrib import admin
+        from .admin import PaginadorEstimado
+
+        self.lancar(5)
+        Movimentacao.objects.filter(pk=Movimentacao.objects.order_by('id')[2].pk).delete()
+        modelo_admin = admin.site._registry[Movimentacao]
+
+        with mock.patch.object(PaginadorEstimado, 'LIMITE_CONTAGEM', 2):
+            self.assertEqual(modelo_admin.get_paginator(None, Movimentacao.objects.order_by('-data'), 100).count, 5)
+            filtradas = Movimentacao.objects.filter(tipo='SAIDA').order_by('-data')
+            self.assertEqual(modelo_admin.get_paginator(None, filtradas, 100).count, 4)
+        self.assertEqual(modelo_admin.get_paginator(None, Movimentacao.objects.order_by('-data'), 100).count, 4)
+
+    def test_navegacao_por_data_sem_distinct(self):
+        from datetime import datetime
+        from django.utils import timezone
+
+        self.lancar(3)
+        fuso = timezone.get_current_timezone()
+        for mov, momento in zip(Movimentacao.objects.order_by('id'), ((2024, 11, 30), (2025, 1, 15), (2025, 3, 2))):
+            Movimentacao.objects.filter(pk=mov.pk).update(data=datetime(*momento, 12, tzinfo=fuso))
+
+        sqls = self.consultas('/admin/estoque/movimentacao/')
+        self.assertFalse([sql for sql in sqls if 'DISTINCT' in sql])
+        response = self.client.get('/admin/estoque/movimentacao/')
+        self.assertContains(response, 'data__year=2024')
+        self.assertContains(response, 'data__year=2025')
+
+        response = self.client.get('/admin/estoque/movimentacao/?data__year=2025')
+        for mes in (1, 2, 3):
+            self.assertContains(response, f'data__month={mes}')
+        self.assertNotContains(response, 'data__month=4')
+
+
+# ==============================================================================
+# 11. IMPORTAÇÃO DE PLANILHA (CSV/XLSX)
+# ==============================================================================
+
+class ImportacaoTests(TestCase):
+    def setUp(self):
+        self.secretaria = User.objects.create_superuser(username='secretaria')
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta)
+
+    def csv(self, conteudo):
+        import os
+        caminho = os.path.join(self.pasta, 'fornecedor.csv')
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(conteudo)
+        return caminho
+
+    def test_comando_cria_atualiza_e_lanca_entrada(self):
+        from django.core.management import call_command
+
+        onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=10, minimo=3)
+        caminho = self.csv(
+            "nome;tipo;quantidade;minimo\n"
+            "ONU Huawei;FIBRA;5;\n"             # Já existe: só soma a entrada (mínimo vazio não apaga)
+            "Cabo Drop;Fibra Óptica;100;20\n"   # Tipo pelo nome da tela
+            "Cabo Drop;FIBRA;50;\n"             # Repetido: soma
+            ";FIBRA;1;\n"
+            "Antena;SATELITE;1;\n"
+            "Alicate;FERRAMENTA;-2;\n"
+        )
+        erros = io.StringIO()
+        call_command('importar_equipamentos', caminho, usuario='secretaria', stdout=io.StringIO(), stderr=erros)
+
+        onu.refresh_from_db()
+        self.assertEqual((onu.quantidade, onu.minimo), (15, 3))
+        cabo = Equipamento.objects.get(nome='Cabo Drop')
+        self.assertEqual((cabo.tipo, cabo.quantidade, cabo.minimo), ('FIBRA', 150, 20))
+        self.assertFalse(Equipamento.objects.filter(nome__in=['Antena', 'Alicate']).exists())
+
+        # Entrada fica no histórico, mas não vai para a carteira de ninguém
+        self.assertEqual(Movimentacao.objects.filter(tipo='ENTRADA').aggregate(total=Sum('quantidade'))['total'], 155)
+        self.assertFalse(EstoqueTecnico.objects.exists())
+        for linha in ('Linha 5', 'Linha 6', 'Linha 7'):
+            self.assertIn(linha, erros.getvalue())
+
+    def test_lotes_grandes_com_numero_fixo_de_consultas(self):
+        from . import importacao
+
+        linhas = "".join(f"Item {i};RADIO;{i % 7}\n" for i in range(120))
+        with open(self.csv("nome;tipo;quantidade\n" + linhas), 'rb') as arquivo, \
+                mock.patch.object(importacao, 'TAMANHO_LOTE', 50), \
+                CaptureQueriesContext(connection) as consultas:
+            resultado = importacao.importar_planilha(arquivo, 'fornecedor.csv', self.secretaria)
+
+        self.assertEqual((resultado['criados'], resultado['erros']), (120, []))
+        self.assertEqual(Equipamento.objects.aggregate(total=Sum('quantidade'))['total'], sum(i % 7 for i in range(120)))
+        self.assertLess(len(consultas), 3 * 15)  # 3 lotes, nunca 1 consulta por linha
+
+    def test_csv_sem_separador_no_admin(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        self.client.force_login(self.secretaria)
+        response = self.client.post('/admin/estoque/equipamento/importar/', {
+            'arquivo': SimpleUploadedFile('entrega.csv', b'nome\nONU\nCabo\n'),
+        })
+        self.assertContains(response, 'separador das colunas')
+        self.assertFalse(Equipamento.objects.exists())
+
+    def test_arquivo_que_estraga_no_meio(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        from . import importacao
+
+        # Excel salvou em cp1252: o "ã" lá embaixo não é UTF-8, mas os lotes de cima já entraram
+        linhas = "".join(f"Item {i:04d};RADIO;1\n" for i in range(1500)) + "Conexão;RADIO;1\nDepois;RADIO;1\n"
+        conteudo = ("nome;tipo;quantidade\n" + linhas).encode('cp1252')
+        self.client.force_login(self.secretaria)
+        with mock.patch.object(importacao, 'TAMANHO_LOTE', 100):
+            response = self.client.post('/admin/estoque/equipamento/importar/', {
+                'arquivo': SimpleUploadedFile('entrega.csv', conteudo),
+            })
+        self.assertEqual(response.status_code, 200)
+        importados = Equipamento.objects.count()
+        self.assertGreater(importados, 0)
+        # Tudo antes da linha avisada entrou; dali em diante, nada
+        self.assertContains(response, f'A leitura parou na linha {importados + 2}')
+        self.assertContains(response, 'UTF-8')
+        self.assertEqual(Movimentacao.objects.filter(tipo='ENTRADA').count(), importados)
+        self.assertFalse(Equipamento.objects.filter(nome='Depois').exists())
+
+        # Nada lido ainda (arquivo ruim desde o começo): erro do formulário, nada gravado
+        with self.assertRaisesMessage(ValueError, 'UTF-8'):
+            importacao.importar_planilha(io.BytesIO('nome;tipo\nAção;RADIO\n'.encode('cp1252') * 2000),
+                                         'ruim.csv', self.secretaria)
+
+    def test_upload_xlsx_no_admin(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from openpyxl import Workbook
+
+        planilha = Workbook()
+        planilha.active.append(['Nome', 'Tipo', 'Quantidade'])
+        planilha.active.append(['Conector SC', 'FIBRA', 30])
+        planilha.active.append(['Sem tipo', '', 1])
+        conteudo = io.BytesIO()
+        planilha.save(conteudo)
+
+        self.client.force_login(self.secretaria)
+        self.assertContains(self.client.get('/admin/estoque/equipamento/'), 'Importar planilha')
+        response = self.client.post('/admin/estoque/equipamento/importar/', {
+            'arquivo': SimpleUploadedFile('entrega.xlsx', conteudo.getvalue()),
+        })
+        self.assertContains(response, 'Tipo desconhecido')
+        self.assertEqual(Equipamento.objects.get(nome='Conector SC').quantidade, 30)
+
+
+# ==============================================================================
+# 12. EXPORTAÇÃO DO HISTÓRICO (CSV / NDJSON)
+# ==============================================================================
+
+class ExportacaoTests(TestCase):
+    def setUp(self):
+        self.secretaria = User.objects.create_user(username='secretaria')
+        self.natan = User.objects.create(username='natan')
+        self.joao = User.objects.create(username='joao')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=100)
+        self.client.force_login(self.secretaria)
+
+    def lancar(self, tecnico, quantidade=1, obs=None):
+        return Movimentacao.objects.create(tecnico=tecnico, equipamento=self.onu, tipo='SAIDA', quantidade=quantidade,
+                                           obs=obs, autor_movimento=self.secretaria)
+
+    def baixar(self, **parametros):
+        response = self.client.get('/exportar/movimentacoes/', parametros)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode('utf-8')
+
+    def test_csv_com_nomes_e_filtros(self):
+        import csv
+        primeira = self.lancar(self.natan, 2, obs='OS 10; urgente')
+        self.lancar(self.joao)
+
+        response, conteudo = self.baixar(tecnico='natan')
+        linhas = list(csv.reader(io.StringIO(conteudo.lstrip('\ufeff')), delimiter=';'))
+        self.assertEqual(linhas[0][:6], ['id', 'data', 'tipo', 'quantidade', 'tecnico', 'equipamento'])
+        self.assertEqual(len(linhas), 2)
+        self.assertEqual(linhas[1][0], str(primeira.pk))
+        self.assertEqual(linhas[1][4:], ['natan', 'ONU Huawei', 'FIBRA', 'OS 10; urgente', 'secretaria', 'Matriz'])
+        self.assertIn('attachment; filename="movimentacoes_', response['Content-Disposition'])
+
+        self.assertEqual(self.client.get('/exportar/movimentacoes/', {'formato': 'xml'}).status_code, 400)
+
+    def test_ndjson_continua_do_ultimo_id(self):
+        import json
+        self.lancar(self.natan)
+        response, conteudo = self.baixar(formato='ndjson')
+        ultimo = int(response['X-Ultimo-Id'])
+        self.assertEqual(len(conteudo.splitlines()), 1)
+
+        nova = self.lancar(self.joao, 3)
+        _, conteudo = self.baixar(formato='ndjson', desde=ultimo)
+        registros = [json.loads(linha) for linha in conteudo.splitlines()]
+        self.assertEqual([(r['id'], r['tecnico'], r['quantidade']) for r in registros], [(nova.pk, 'joao', 3)])
+
+    def test_consultas_nao_dependem_do_tamanho(self):
+        from . import exportacao
+
+        self.lancar(self.natan)
+        with CaptureQueriesContext(connection) as poucas:
+            self.baixar()
+        for _ in range(25):
+            self.lancar(self.joao)
+        with mock.patch.object(exportacao, 'TAMANHO_PEDACO', 100), CaptureQueriesContext(connection) as muitas:
+            self.baixar()
+        self.assertEqual(len(poucas), len(muitas))
+
+    def test_comando_com_marcador(self):
+        import os
+        from django.core.management import call_command
+
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        saida, marcador = os.path.join(pasta, 'mov.ndjson'), os.path.join(pasta, 'ultimo.txt')
+        exportar = lambda: call_command('exportar_movimentacoes', formato='ndjson', saida=saida, marcador=marcador,
+                                        stderr=io.StringIO())
+
+        self.lancar(self.natan)
+        self.lancar(self.joao)
+        exportar()
+        with open(saida, encoding='utf-8') as arquivo:
+            self.assertEqual(len(arquivo.readlines()), 2)
+
+        self.lancar(self.natan, 5)
+        exportar()
+        with open(saida, encoding='utf-8') as arquivo:
+            self.assertEqual(len(arquivo.readlines()), 1)
+        with open(marcador) as arquivo:
+            self.assertEqual(int(arquivo.read()), Movimentacao.objects.latest('id').pk)
+
+
+# ==============================================================================
+# 13. API JSON (Cursor, campos e ETag)
+# ==============================================================================
+
+class ApiTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.gestor = User.objects.create_user(username='gestor')
+        self.natan = User.objects.create(username='natan')
+        Equipamento.objects.bulk_create(
+            Equipamento(nome=f'ONU {i:03d}', tipo='FIBRA', quantidade=i, minimo=5) for i in range(25)
+        )
+        self.alicate = Equipamento.objects.create(nome='Alicate', tipo='FERRAMENTA', quantidade=2, minimo=1)
+        self.client.force_login(self.gestor)
+
+    def buscar(self, url, **parametros):
+        response = self.client.get(url, parametros)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_paginas_pelo_cursor(self):
+        vistos, cursor, paginas = [], None, 0
+        while True:
+            parametros = {'limite': 10, 'campos': 'id,nome'}
+            if cursor:
+                parametros['cursor'] = cursor
+            dados = self.buscar('/api/equipamentos/', **parametros)
+            vistos += dados['resultados']
+            paginas += 1
+            cursor = dados['proximo']
+            if not cursor:
+                break
+        self.assertEqual(paginas, 3)
+        self.assertEqual(len(vistos), 26)
+        self.assertEqual(set(vistos[0]), {'id', 'nome'})
+        self.assertEqual([item['id'] for item in vistos], sorted(item['id'] for item in vistos))
+
+    def test_campos_e_filtros(self):
+        dados = self.buscar('/api/equipamentos/', tipo='FIBRA', baixo='1', campos='nome,quantidade')
+        self.assertEqual(dados['resultados'][0], {'nome': 'ONU 000', 'quantidade': 0})
+        self.assertEqual(len(dados['resultados']), 6)
+
+        Movimentacao.objects.create(tecnico=self.natan, equipamento=self.alicate, tipo='SAIDA', quantidade=1,
+                                    autor_movimento=self.gestor)
+        dados = self.buscar('/api/carteiras/', tecnico='natan', pendentes='1')
+        self.assertEqual(dados['resultados'][0]['equipamento_nome'], 'Alicate')
+        dados = self.buscar('/api/movimentacoes/', tipo='SAIDA', campos='tecnico,autor,quantidade')
+        self.assertEqual(dados['resultados'], [{'tecnico': 'natan', 'autor': 'gestor', 'quantidade': 1}])
+
+        self.assertEqual(self.client.get('/api/equipamentos/', {'campos': 'nome,senha'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/equipamentos/', {'cursor': '!!'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/movimentacoes/', {'tipo': 'ROUBO'}).status_code, 400)
+
+    def test_etag_304_sem_consultar_o_banco(self):
+        response = self.client.get('/api/equipamentos/')
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        with CaptureQueriesContext(connection) as ctx:
+            igual = self.client.get('/api/equipamentos/', HTTP_IF_NONE_MATCH=response['ETag'])
+            # Sem If-None-Match: mesmo conteúdo, vindo do cache
+            repetida = self.client.get('/api/equipamentos/')
+        self.assertEqual(igual.status_code, 304)
+        self.assertEqual(repetida.content, response.content)
+        self.assertFalse([q for q in ctx.captured_queries if 'estoque_' in q['sql']])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Movimentacao.objects.create(tecnico=self.natan, equipamento=self.alicate, tipo='SAIDA', quantidade=1)
+        mudou = self.client.get('/api/equipamentos/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(mudou.status_code, 200)
+        self.assertNotEqual(mudou.content, response.content)
+
+    def test_consultas_nao_dependem_da_pagina(self):
+        from django.core.cache import cache
+        from . import saldos
+
+        saldos.lancar_movimentos([
+            Movimentacao(tecnico=self.gestor, equipamento=self.alicate, tipo='ENTRADA', quantidade=1) for _ in range(30)
+        ])
+        primeira = self.buscar('/api/movimentacoes/', limite=5)
+        cursor = primeira['proximo']
+        for _ in range(4):
+            cursor = self.buscar('/api/movimentacoes/', limite=5, cursor=cursor)['proximo']
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            dados = self.buscar('/api/movimentacoes/', limite=5, cursor=cursor)
+        self.assertEqual(len(dados['resultados']), 5)
+        self.assertIsNone(dados['proximo'])
+        # Uma consulta só no histórico, continuando pelo id (sem OFFSET)
+        consultas = [q['sql'] for q in ctx.captured_queries if 'estoque_movimentacao' in q['sql']]
+        self.assertEqual(len(consultas), 1)
+        self.assertNotIn('OFFSET', consultas[0])
+
+    def test_exige_login(self):
+        self.client.logout()
+        response = self.client.get('/api/carteiras/')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('erro', response.json())
+
+
+# ==============================================================================
+# 14. SINCRONIZAÇÃO DO APP DE CAMPO (Chave de idempotência)
+# ==============================================================================
+
+class SincronizacaoTests(TestCase):
+    def setUp(self):
+        self.natan = User.objects.create_user(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=10)
+        self.cabo = Equipamento.objects.create(nome='Cabo Drop', tipo='FIBRA', quantidade=5)
+        self.client.force_login(self.natan)
+
+    def enviar(self, movimentos, token=0, status=200):
+        import json
+        response = self.client.post('/api/sincronizar/', json.dumps({'token': token, 'movimentos': movimentos}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status, response.content)
+        return response.json()
+
+    def test_reenvio_nao_duplica(self):
+        lote = [
+            {'chave': 'a1', 'equipamento': self.onu.pk, 'tipo': 'SAIDA', 'quantidade': 3},
+            {'chave': 'a2', 'equipamento': self.onu.pk, 'tipo': 'BAIXA', 'quantidade': 1, 'obs': 'OS 1040'},
+            {'chave': 'a1', 'equipamento': self.onu.pk, 'tipo': 'SAIDA', 'quantidade': 3},
+        ]
+        primeira = self.enviar(lote)
+        self.assertEqual(primeira['aplicadas'], ['a1', 'a2'])
+        self.assertEqual(primeira['carteira'], [{'equipamento': self.onu.pk, 'quantidade': 2}])
+
+        # Conexão caiu antes da resposta: o celular manda o mesmo lote de novo
+        segunda = self.enviar(lote, token=primeira['token'])
+        self.assertEqual((segunda['aplicadas'], segunda['repetidas']), ([], ['a1', 'a2']))
+        self.assertEqual(Movimentacao.objects.count(), 2)
+        self.onu.refresh_from_db()
+        self.assertEqual(self.onu.quantidade, 7)
+        self.assertEqual(Movimentacao.objects.get(chave_idempotencia='a2').obs, 'OS 1040')
+
+    def test_mudancas_desde_o_token(self):
+        token = self.enviar([{'chave': 'b1', 'equipamento': self.onu.pk, 'tipo': 'SAIDA', 'quantidade': 1}])['token']
+        # Outra movimentação (feita no admin) mexe só no cabo
+        Movimentacao.objects.create(tecnico=self.natan, equipamento=self.cabo, tipo='SAIDA', quantidade=2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            dados = self.enviar([], token=token)
+        self.assertEqual(dados['carteira'], [{'equipamento': self.cabo.pk, 'quantidade': 2}])
+        self.assertEqual(dados['estoque'], [{'id': self.cabo.pk, 'nome': 'Cabo Drop', 'quantidade': 3}])
+        self.assertGreater(dados['token'], token)
+        self.assertLessEqual(len([q for q in ctx.captured_queries if 'estoque_' in q['sql']]), 3)
+
+    def test_lote_com_erro_nao_grava_nada(self):
+        dados = self.enviar([
+            {'chave': 'c1', 'equipamento': self.onu.pk, 'tipo': 'SAIDA', 'quantidade': 1},
+            {'chave': 'c2', 'equipamento': self.cabo.pk, 'tipo': 'DEVOLUCAO', 'quantidade': 1},
+        ], status=409)
+        self.assertIn('Cabo Drop', dados['detalhes'][0])
+        self.assertFalse(Movimentacao.objects.exists())
+
+        self.enviar([{'chave': 'c3', 'equipamento': self.onu.pk, 'tipo': 'ENTRADA', 'quantidade': 1}], status=409)
+        self.enviar([{'chave': 'c4', 'equipamento': 999, 'tipo': 'SAIDA', 'quantidade': 1}], status=409)
+        self.assertEqual(self.client.post('/api/sincronizar/', 'x', content_type='application/json').status_code, 400)
+
+    def test_chave_unica_no_banco(self):
+        from django.db import IntegrityError, transaction
+        Movimentacao.objects.create(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=1,
+                                    chave_idempotencia='d1')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Movimentacao.objects.create(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=1,
+                                        chave_idempotencia='d1')
+        # O saldo do lançamento barrado voltou atrás junto
+        self.onu.refresh_from_db()
+        self.assertEqual(self.onu.quantidade, 9)
+
+
+# ==============================================================================
+# 15. ESTOQUE BAIXO (Coluna calculada, índice parcial e alertas)
+# ==============================================================================
+
+class EstoqueBaixoTests(TestCase):
+    def setUp(self):
+        self.gestor = User.objects.create_superuser(username='gestor', password='x')
+        self.natan = User.objects.create(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=7, minimo=5)
+        self.cabo = Equipamento.objects.create(nome='Cabo Drop', tipo='FIBRA', quantidade=20, minimo=5)
+        self.client.force_login(self.gestor)
+
+    def alertas(self):
+        from .models import AlertaEstoque
+        return list(AlertaEstoque.objects.order_by('id').values_list('equipamento__nome', 'tipo', 'quantidade'))
+
+    def test_alerta_quando_cruza_o_minimo(self):
+        from .saldos import lancar_movimentos
+
+        Movimentacao.objects.create(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=1)
+        self.assertEqual(self.alertas(), [])  # 6 > 5: ainda normal
+
+        # Lote (UPDATE direto no banco, sem save): o gatilho pega do mesmo jeito
+        lancar_movimentos([
+            Movimentacao(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=2),
+            Movimentacao(tecnico=self.natan, equipamento=self.cabo, tipo='SAIDA', quantidade=1),
+        ])
+        Movimentacao.objects.create(tecnico=self.natan, equipamento=self.onu, tipo='DEVOLUCAO', quantidade=3)
+        self.assertEqual(self.alertas(), [('ONU Huawei', 'ENTROU', 4), ('ONU Huawei', 'SAIU', 7)])
+
+        # Mudar o mínimo no cadastro também conta
+        Equipamento.objects.filter(pk=self.cabo.pk).update(minimo=30)
+        self.assertEqual(self.alertas()[-1], ('Cabo Drop', 'ENTROU', 19))
+        self.assertEqual(list(Equipamento.objects.filter(estoque_baixo=True).values_list('nome', flat=True)),
+                         ['Cabo Drop'])
+
+    def test_lista_de_baixo_pelo_indice_parcial(self):
+        consultas = Equipamento.objects.filter(estoque_baixo=True).order_by('nome', 'id')
+        self.assertIn('eqp_baixo_nome_idx', consultas.explain())
+
+        Equipamento.objects.filter(pk=self.onu.pk).update(quantidade=1)
+        response = self.client.get('/admin/estoque/estoquebaixo/')
+        self.assertContains(response, 'ONU Huawei')
+        self.assertNotContains(response, 'Cabo Drop')
+        self.assertContains(self.client.get('/admin/estoque/alertaestoque/'), 'ONU Huawei')
+
+    def test_api_de_alertas_e_baixo(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        Equipamento.objects.filter(pk=self.onu.pk).update(quantidade=2)
+        dados = self.client.get('/api/alertas/', {'campos': 'equipamento_nome,tipo,quantidade'}).json()
+        self.assertEqual(dados['resultados'], [{'equipamento_nome': 'ONU Huawei', 'tipo': 'ENTROU', 'quantidade': 2}])
+        dados = self.client.get('/api/equipamentos/', {'baixo': '1', 'campos': 'nome,estoque_baixo'}).json()
+        self.assertEqual(dados['resultados'], [{'nome': 'ONU Huawei', 'estoque_baixo': True}])
+
+
+# ==============================================================================
+# 16. CONSUMO DIÁRIO E PREVISÃO (Dias de estoque)
+# ==============================================================================
+
+class ConsumoPrevisaoTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.gestor = User.objects.create_user(username='gestor')
+        self.natan = User.objects.create(username='natan')
+        self.joao = User.objects.create(username='joao')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=100, minimo=5)
+        self.cabo = Equipamento.objects.create(nome='Cabo Drop', tipo='FIBRA', quantidade=50, minimo=5)
+
+    def hoje(self):
+        from django.utils import timezone
+        return timezone.localdate()
+
+    def consumo(self):
+        from .models import ConsumoDiario
+        return sorted(ConsumoDiario.objects.values_list('dia', 'equipamento_id', 'tecnico_id', 'tipo', 'quantidade',
+                                                        'movimentos'))
+
+    def test_soma_a_cada_lancamento_igual_ao_recalculo(self):
+        from .consumo import refazer_consumo
+        from .saldos import lancar_movimentos
+
+        Movimentacao.objects.create(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=3)
+        lancar_movimentos([
+            Movimentacao(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=2),
+            Movimentacao(tecnico=self.joao, equipamento=self.onu, tipo='SAIDA', quantidade=4),
+            Movimentacao(tecnico=self.natan, equipamento=self.cabo, tipo='SAIDA', quantidade=1),
+        ])
+        Movimentacao.objects.create(tecnico=self.natan, equipamento=self.onu, tipo='BAIXA', quantidade=1)
+        incremental = self.consumo()
+        hoje = self.hoje()
+        self.assertIn((hoje, self.onu.pk, self.natan.pk, 'SAIDA', 5, 2), incremental)
+
+        self.assertEqual(refazer_consumo(), len(incremental))
+        self.assertEqual(self.consumo(), incremental)
+
+        # Editar/apagar no admin refaz aquele dia
+        mov = Movimentacao.objects.filter(tecnico=self.joao).get()
+        mov.equipamento = self.cabo
+        mov.save()
+        Movimentacao.objects.filter(tipo='BAIXA').get().delete()
+        editado = self.consumo()
+        refazer_consumo()
+        self.assertEqual(self.consumo(), editado)
+        self.assertNotIn('BAIXA', [linha[3] for linha in editado])
+
+    def test_previsao_vetorizada(self):
+        from datetime import timedelta
+        from .models import ConsumoDiario
+        from .previsao import calcular_dias_restantes
+
+        hoje = self.hoje()
+        itens = Equipamento.objects.bulk_create(
+            Equipamento(nome=f'Item {i:03d}', tipo='FERRAMENTA', quantidade=30, minimo=1) for i in range(200)
+        )
+        # Cada item sai 3 por dia (2 técnicos) nos últimos 10 dias; o cabo só recebe devolução
+        ConsumoDiario.objects.bulk_create(
+            [ConsumoDiario(dia=hoje - timedelta(days=d), equipamento=item, tecnico=tecnico, tipo='SAIDA', quantidade=q,
+                           movimentos=1)
+             for item in itens for d in range(10) for tecnico, q in ((self.natan, 2), (self.joao, 1))]
+            + [ConsumoDiario(dia=hoje, equipamento=self.cabo, tecnico=self.natan, tipo='DEVOLUCAO', quantidade=5)]
+        )
+
+        with CaptureQueriesContext(connection) as ctx:
+            previsao = calcular_dias_restantes(hoje, janela=10, meia_vida=10 ** 9)
+        self.assertEqual(len(ctx), 2)  # consumo da janela + saldos, para os 200 itens juntos
+        # Saldos pela subconsulta da janela, não por um IN com 200 ids (limite de parâmetros do SQLite)
+        self.assertIn('"estoque_consumodiario"', ctx[1]['sql'])
+        self.assertLess(len(ctx[1]['sql']), 1000)
+        self.assertEqual(len(previsao), 200)
+        self.assertAlmostEqual(previsao[itens[0].pk], 10.0)  # 30 em estoque / 3 por dia
+        self.assertNotIn(self.cabo.pk, previsao)
+        self.assertNotIn(self.onu.pk, previsao)
+
+    def test_painel_e_comando(self):
+        from django.core.management import call_command
+        from .models import ConsumoDiario
+
+        self.client.force_login(self.gestor)
+        Movimentacao.objects.create(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=6)
+        self.assertContains(self.client.get('/'), 'dias</small>')
+
+        ConsumoDiario.objects.all().delete()
+        saida = io.StringIO()
+        call_command('recalcular_consumo', stdout=saida)
+        self.assertIn('1 linhas', saida.getvalue())
+        self.assertEqual(ConsumoDiario.objects.get().quantidade, 6)
+
+
+# ==============================================================================
+# 17. BUSCA TEXTUAL (Índice FTS5 com gatilhos)
+# ==============================================================================
+
+class BuscaTextualTests(TestCase):
+    def setUp(self):
+        self.gestor = User.objects.create_superuser(username='gestor', password='x')
+        self.natan = User.objects.create(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=50,
+                                              especificacoes='GPON, botão WPS')
+        self.cabo = Equipamento.objects.create(nome='Cabo Drop', tipo='FIBRA', quantidade=50)
+        self.os1040 = Movimentacao.objects.create(tecnico=self.natan, equipamento=self.cabo, tipo='SAIDA',
+                                                  quantidade=1, obs='OS 1040 - Dona Maria')
+        Movimentacao.objects.create(tecnico=self.natan, equipamento=self.cabo, tipo='SAIDA', quantidade=1,
+                                    obs='OS 2000')
+        self.client.force_login(self.gestor)
+
+    def ids(self, queryset):
+        return sorted(queryset.values_list('id', flat=True))
+
+    def test_busca_e_gatilhos(self):
+        from .busca import buscar_equipamentos, buscar_movimentacoes
+
+        self.assertEqual(self.ids(buscar_movimentacoes(Movimentacao.objects.all(), 'OS 1040')), [self.os1040.pk])
+        self.assertEqual(self.ids(buscar_movimentacoes(Movimentacao.objects.all(), 'maria')), [self.os1040.pk])
+        # Sem acento, pelo começo da palavra e pela especificação
+        self.assertEqual(self.ids(buscar_equipamentos(Equipamento.objects.all(), 'botao')), [self.onu.pk])
+        self.assertEqual(self.ids(buscar_equipamentos(Equipamento.objects.all(), 'huaw')), [self.onu.pk])
+
+        # Índice acompanha edição e exclusão
+        Movimentacao.objects.filter(pk=self.os1040.pk).update(obs='OS 1041')
+        self.assertEqual(self.ids(buscar_movimentacoes(Movimentacao.objects.all(), '1040')), [])
+        self.assertEqual(self.ids(buscar_movimentacoes(Movimentacao.objects.all(), '1041')), [self.os1040.pk])
+        Equipamento.objects.filter(pk=self.onu.pk).update(nome='ONU ZTE')
+        self.assertEqual(self.ids(buscar_equipamentos(Equipamento.objects.all(), 'huawei')), [])
+        self.assertEqual(self.ids(buscar_equipamentos(Equipamento.objects.all(), 'zte')), [self.onu.pk])
+        self.onu.delete()
+        self.assertEqual(self.ids(buscar_equipamentos(Equipamento.objects.all(), 'gpon')), [])
+
+        # Pelo item e pelo técnico (nome do item entra só pela coluna nome)
+        todas = self.ids(Movimentacao.objects.all())
+        self.assertEqual(self.ids(buscar_movimentacoes(Movimentacao.objects.all(), 'drop')), todas)
+        self.assertEqual(self.ids(buscar_movimentacoes(Movimentacao.objects.all(), 'natan')), todas)
+
+    def test_mesmo_resultado_sem_fts(self):
+        from . import busca
+
+        termos = ('OS 1040', 'maria', 'drop', 'huawei gpon', '"1040" OR *', 'natan drop', 'drop 1040', 'natan zte')
+        com_fts = [self.ids(busca.buscar_movimentacoes(Movimentacao.objects.all(), t)) for t in termos]
+        # Palavras em campos diferentes (técnico + item, item + OBS) também valem juntas
+        self.assertEqual(com_fts[5], self.ids(Movimentacao.objects.all()))
+        self.assertEqual(com_fts[6:], [[self.os1040.pk], []])
+        with mock.patch.object(busca, 'busca_textual_ativa', return_value=False):
+            sem_fts = [self.ids(busca.buscar_movimentacoes(Movimentacao.objects.all(), t)) for t in termos]
+            self.assertEqual(self.ids(busca.buscar_equipamentos(Equipamento.objects.all(), 'huawei gpon')),
+                             [self.onu.pk])
+        self.assertEqual(com_fts, sem_fts)
+
+    def test_admin_e_painel(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get('/admin/estoque/movimentacao/', {'q': 'OS 1040'})
+        self.assertContains(response, 'Dona Maria')
+        self.assertNotContains(response, 'OS 2000')
+        busca = [q['sql'] for q in ctx.captured_queries if 'MATCH' in q['sql']]
+        self.assertTrue(busca)
+        self.assertNotIn('LIKE', busca[0].split('auth_user')[0])
+
+        self.assertContains(self.client.get('/admin/estoque/equipamento/', {'q': 'botao'}), 'ONU Huawei')
+        response = self.client.get('/', {'q': 'huawei'})
+        self.assertContains(response, 'ONU Huawei')
+        self.assertNotContains(response, 'Cabo Drop')
+
+
+# ==============================================================================
+# 18. AUTOCOMPLETAR DO LOTE (Índice de prefixos em memória)
+# ==============================================================================
+
+class AutocompletarTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.gestor = User.objects.create_superuser(username='gestor', password='x')
+        self.natan = User.objects.create(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=10)
+        self.botao = Equipamento.objects.create(nome='Botão de Rede', tipo='FERRAMENTA', quantidade=3)
+        Equipamento.objects.bulk_create(
+            Equipamento(nome=f'Conector {i:02d}', tipo='FIBRA', quantidade=i) for i in range(30)
+        )
+        self.client.force_login(self.gestor)
+
+    def buscar(self, termo, **parametros):
+        response = self.client.get('/admin/estoque/equipamento/autocompletar/', {'term': termo, **parametros})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefixo_de_qualquer_palavra_com_estoque(self):
+        dados = self.buscar('hua')
+        self.assertEqual(dados['results'], [
+            {'id': str(self.onu.pk), 'text': 'ONU Huawei (Qtd: 10)', 'tipo': 'FIBRA', 'quantidade': 10},
+        ])
+        self.assertEqual([r['text'] for r in self.buscar('BOTAO DE')['results']], ['Botão de Rede (Qtd: 3)'])
+        self.assertEqual(self.buscar('xyz')['results'], [])
+
+        # Paginação no formato do Select2
+        primeira, segunda = self.buscar('conector'), self.buscar('conector', page=2)
+        self.assertEqual((len(primeira['results']), primeira['pagination']['more']), (20, True))
+        self.assertEqual((len(segunda['results']), segunda['pagination']['more']), (10, False))
+
+    def test_sem_consulta_ao_banco_e_invalidacao(self):
+        self.buscar('onu')
+        with CaptureQueriesContext(connection) as ctx:
+            self.buscar('onu h')
+            self.buscar('conector 1')
+        self.assertFalse([q for q in ctx.captured_queries if 'estoque_equipamento' in q['sql']])
+
+        # Movimentação: só as quantidades são recarregadas
+        with self.captureOnCommitCallbacks(execute=True):
+            Movimentacao.objects.create(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=4)
+        self.assertEqual(self.buscar('onu')['results'][0]['quantidade'], 6)
+
+        # Cadastro: índice refeito
+        with self.captureOnCommitCallbacks(execute=True):
+            self.onu.nome = 'ONU ZTE'
+            self.onu.save()
+        self.assertEqual(self.buscar('huawei')['results'], [])
+        self.assertEqual(self.buscar('zte')['results'][0]['text'], 'ONU ZTE (Qtd: 6)')
+
+    def test_limites_do_cache(self):
+        from .autocompletar import IndicePrefixo
+
+        indice = IndicePrefixo(ttl=60, max_consultas=3)
+        for termo in ('a', 'b', 'c', 'd', 'co'):
+            indice.buscar(termo)
+        self.assertEqual(list(indice._indice[4]), ['c', 'd', 'co'])
+
+        Equipamento.objects.filter(pk=self.onu.pk).update(nome='ONU Nokia')  # sem sinal nenhum
+        self.assertEqual(indice.buscar('nokia')[0], [])
+        with mock.patch('estoque.autocompletar.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual([item[1] for item in indice.buscar('nokia')[0]], ['ONU Nokia'])
+
+    def test_inline_do_lote_usa_o_autocompletar(self):
+        response = self.client.get('/admin/estoque/ordemmovimentacao/add/')
+        self.assertContains(response, 'data-ajax--url="/admin/estoque/equipamento/autocompletar/"')
+
+        self.client.logout()
+        self.client.force_login(User.objects.create_user(username='visitante', is_staff=True))
+        self.assertEqual(self.client.get('/admin/estoque/equipamento/autocompletar/').status_code, 403)
+
+
+# ==============================================================================
+# 19. MÉTRICAS (Middleware e /metrics)
+# ==============================================================================
+
+class MetricasTests(TestCase):
+    def setUp(self):
+        from .metricas import registro
+
+        self.registro = registro
+        registro.zerar()
+        self.gestor = User.objects.create_user(username='gestor', password='x', is_staff=True)
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=10)
+
+    def metricas(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        return response.content.decode()
+
+    def test_tempo_e_consultas_por_rota(self):
+        self.client.force_login(self.gestor)
+        self.client.get('/')
+        self.client.get(f'/admin/estoque/equipamento/{self.onu.pk}/change/')
+        self.client.get('/nao-existe/')
+        texto = self.metricas()
+
+        self.assertIn('estoque_http_segundos_count{rota="/",metodo="GET"} 1', texto)
+        self.assertIn('estoque_http_segundos_bucket{rota="/",metodo="GET",le="+Inf"} 1', texto)
+        # Rota é o padrão da URL, não o endereço com o id
+        self.assertIn('rota="/admin/estoque/equipamento/<path:object_id>/change/"', texto)
+        self.assertIn('estoque_http_respostas_total{rota="(sem rota)",metodo="GET",status="4xx"} 1', texto)
+        consultas = re.search(r'estoque_sql_consultas_sum\{rota="/"\} (\S+)', texto)
+        self.assertGreater(float(consultas.group(1)), 0)
+        self.assertRegex(texto, r'estoque_sql_segundos_total\{rota="/"\} \d')
+
+    def test_tempo_do_pdf(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        self.client.force_login(self.gestor)
+        with override_settings(RELATORIO_WORKERS=0, RELATORIOS_ROOT=pasta):
+            self.assertEqual(self.client.get('/relatorio-pdf/').status_code, 200)
+        self.assertIn('estoque_relatorio_pdf_segundos_count 1', self.metricas())
+
+    @override_settings(METRICAS_LIMITE_REPETICOES=3)
+    def test_n_mais_1_vai_para_o_log(self):
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+
+        from .metricas import MetricasMiddleware
+
+        def view_com_n_mais_1(request):
+            for _ in range(3):
+                Equipamento.objects.get(pk=self.onu.pk)
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        with self.assertLogs('estoque.metricas', 'WARNING') as logs:
+            MetricasMiddleware(view_com_n_mais_1)(request)
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn('3 consultas iguais', logs.output[0])
+        self.assertIn('estoque_n_mais_1_total{rota="(sem rota)"} 1', self.registro.texto())
+
+        # Abaixo do limite: nada no log
+        request = RequestFactory().get('/')
+        with self.assertNoLogs('estoque.metricas', 'WARNING'):
+            MetricasMiddleware(lambda r: HttpResponse(Equipamento.objects.count()))(request)
+
+    @override_settings(METRICAS_LIMITE_REPETICOES=3)
+    def test_importacao_em_lotes_nao_e_n_mais_1(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        from . import importacao
+
+        # 12 lotes: o mesmo INSERT, UPDATE agrupado e SELECT ... IN (lote) doze vezes
+        linhas = "".join(f"Item {i};RADIO;{i % 7 + 1}\n" for i in range(600))
+        self.client.force_login(User.objects.create_superuser(username='secretaria'))
+        with mock.patch.object(importacao, 'TAMANHO_LOTE', 50), \
+                self.assertNoLogs('estoque.metricas', 'WARNING'):
+            response = self.client.post('/admin/estoque/equipamento/importar/', {
+                'arquivo': SimpleUploadedFile('entrega.csv', ("nome;tipo;quantidade\n" + linhas).encode()),
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('estoque_n_mais_1_total{', self.registro.texto())
+
+    def test_acesso(self):
+        # O cliente de teste vem de 127.0.0.1 (liberado em settings)
+        self.metricas()
+        with override_settings(METRICAS_IPS_PERMITIDOS=[]):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.client.force_login(User.objects.create_user(username='natan'))
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.client.force_login(self.gestor)
+            self.metricas()
+
+
+# ==============================================================================
+# 20. PAINEL AO VIVO (SSE)
+# ==============================================================================
+
+class PainelAoVivoTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+        self.gestor = User.objects.create_user(username='gestor', password='x')
+        self.natan = User.objects.create(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=10, minimo=5)
+        self.cabo = Equipamento.objects.create(nome='Cabo Drop', tipo='FIBRA', quantidade=50, minimo=5)
+
+    def lancar(self, quantidade):
+        from .saldos import lancar_movimentos
+        with self.captureOnCommitCallbacks(execute=True):
+            lancar_movimentos([Movimentacao(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA',
+                                            quantidade=quantidade)])
+
+    async def test_lancamento_chega_no_painel(self):
+        import asyncio
+        import json
+
+        from asgiref.sync import sync_to_async
+
+        from .ao_vivo import canal
+
+        await self.async_client.aforce_login(self.gestor)
+        response = await self.async_client.get('/eventos/estoque/')
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        eventos = aiter(response.streaming_content)
+        self.assertEqual(await anext(eventos), b'retry: 5000\n\n')
+        self.assertTrue((await anext(eventos)).startswith(b'event: versao\n'))
+        self.assertEqual(len(canal), 1)
+
+        # Só o item lançado, com o saldo e a marca de baixo já atualizados
+        await sync_to_async(self.lancar)(6)
+        evento = (await asyncio.wait_for(anext(eventos), 5)).decode()
+        nome, dados = evento.strip().split('\n')
+        self.assertEqual(nome, 'event: saldos')
+        self.assertEqual(json.loads(dados.removeprefix('data: '))['itens'],
+                         [{'id': self.onu.pk, 'quantidade': 4, 'reservado': 0, 'baixo': True}])
+
+        # Navegador fechou: o servidor cancela a transmissão parada e ela sai da lista
+        esperando = asyncio.ensure_future(anext(eventos))
+        await asyncio.sleep(0)
+        esperando.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await esperando
+        self.assertEqual(len(canal), 0)
+
+    async def test_cliente_lento_recebe_recarregar(self):
+        import asyncio
+
+        from .ao_vivo import RECARREGAR, TAMANHO_FILA, canal
+
+        assinante = canal.assinar()
+        self.addCleanup(canal.cancelar, assinante)
+        for i in range(TAMANHO_FILA + 1):
+            canal.publicar(f'evento {i}')
+        await asyncio.sleep(0)
+        _, fila = assinante
+        self.assertEqual((fila.qsize(), fila.get_nowait()), (1, RECARREGAR))
+
+    def test_sem_ninguem_ouvindo_nao_consulta(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.lancar(1)
+        self.assertFalse([q for q in ctx.captured_queries if 'estoque_baixo' in q['sql']])
+
+    def test_wsgi_responde_204_e_painel_marca_os_cards(self):
+        self.client.force_login(self.gestor)
+        # Sem servidor ASGI o navegador não fica preso numa thread
+        self.assertEqual(self.client.get('/eventos/estoque/').status_code, 204)
+
+        response = self.client.get('/')
+        self.assertContains(response, f'data-equipamento-id="{self.onu.pk}"')
+        self.assertContains(response, 'data-eventos="/eventos/estoque/"')
+        self.assertContains(response, 'painel_ao_vivo.js')
+
+
+# ==============================================================================
+# 21. DADOS SINTÉTICOS E LINHA DE BASE DOS BENCHMARKS
+# ==============================================================================
+
+class DadosSinteticosTests(TestCase):
+    def gerar(self):
+        from .sinteticos import gerar
+        return gerar(itens=30, tecnicos=5, movimentacoes=2000, dias=30, semente=7)
+
+    def historico(self):
+        return list(Movimentacao.objects.order_by('id').values_list('tipo', 'quantidade', 'obs'))
+
+    def test_historico_bate_com_os_saldos_e_se_repete(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from .conciliacao import conciliar
+        from .models import ConsumoDiario
+
+        resumo = self.gerar()
+        self.assertGreaterEqual(resumo['movimentacoes'], 2000)
+        self.assertEqual(Movimentacao.objects.count(), resumo['movimentacoes'])
+        self.assertEqual(set(Movimentacao.objects.values_list('tipo', flat=True)),
+                         {'ENTRADA', 'SAIDA', 'BAIXA', 'DEVOLUCAO'})
+        self.assertFalse(Equipamento.objects.filter(quantidade__lt=0).exists())
+        self.assertEqual(conciliar()['divergencias'], [])
+        self.assertTrue(ConsumoDiario.objects.exists())
+
+        # Datas espalhadas pelo período, não "agora" em tudo
+        primeira = Movimentacao.objects.order_by('id').first().data
+        self.assertGreater(timezone.now() - primeira, timedelta(days=29))
+
+        # Mesma semente, mesmo histórico
+        antes = self.historico()
+        Movimentacao.objects.all().delete()
+        Equipamento.objects.all().delete()
+        User.objects.filter(username__startswith='sintetico').delete()
+        self.gerar()
+        self.assertEqual(self.historico(), antes)
+
+    def test_comando_pede_confirmacao(self):
+        from django.core.management import CommandError, call_command
+
+        with self.assertRaisesMessage(CommandError, '--confirmar'):
+            call_command('gerar_dados_sinteticos', movimentacoes=10)
+        call_command('gerar_dados_sinteticos', itens=5, tecnicos=2, movimentacoes=50, confirmar=True,
+                     stdout=io.StringIO())
+        with self.assertRaisesMessage(CommandError, 'já tem dados sintéticos'):
+            call_command('gerar_dados_sinteticos', movimentacoes=10, confirmar=True)
+
+    def test_comparacao_com_a_linha_de_base(self):
+        from .desempenho import comparar, resumir, rodada
+
+        medida = resumir([10.0] * 28 + [30.0, 90.0], [5] * 30)
+        self.assertEqual((medida['p50_ms'], medida['p95_ms'], medida['p99_ms']), (10.0, 30.0, 90.0))
+
+        escala = {'movimentacoes': 1000}
+        base = rodada(escala, {'painel': medida})
+        # Ruído dentro da tolerância (25% + 2 ms) passa; pico isolado no p95 também
+        self.assertEqual(comparar(base, rodada(escala, {'painel': {**medida, 'p50_ms': 14.4, 'p95_ms': 80}})), [])
+
+        pioras = comparar(base, rodada(escala, {'painel': {**medida, 'p50_ms': 15.0, 'consultas': 6}}))
+        self.assertEqual(len(pioras), 2)
+        self.assertIn('p50 15.0 ms (base 10.0, limite 14.5)', pioras[0])
+        self.assertIn('6 consultas (base 5)', pioras[1])
+
+        self.assertIn('outra escala', comparar(base, rodada({'movimentacoes': 5}, {}))[0])
+
+
+# ==============================================================================
+# 22. ARQUIVO DO HISTÓRICO (Meses antigos fora do banco)
+# ==============================================================================
+
+class ArquivoHistoricoTests(TestCase):
+    def setUp(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta, ignore_errors=True)
+        ajuste = override_settings(ARQUIVO_ROOT=self.pasta)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+
+        self.tecnico = User.objects.create(username='natan')
+        self.onu = Equipamento.objects.create(nome='ONU', tipo='FIBRA', quantidade=100)
+        self.dias_atras = lambda n: timezone.now() - timedelta(days=n)
+        # Dois meses bem antes do corte de 12 meses e uma retirada de hoje
+        self.antigas = [
+            self.lancar('SAIDA', 5, dias=420, obs='OS 111'),
+            self.lancar('DEVOLUCAO', 2, dias=410),
+        ]
+        self.nova = self.lancar('SAIDA', 3)
+
+    def lancar(self, tipo, quantidade, dias=0, obs=None):
+        mov = Movimentacao.objects.create(tecnico=self.tecnico, equipamento=self.onu, tipo=tipo,
+                                          quantidade=quantidade, obs=obs, autor_movimento=self.tecnico)
+        if dias:
+            Movimentacao.objects.filter(pk=mov.pk).update(data=self.dias_atras(dias))
+        return mov
+
+    def arquivar(self):
+        from .arquivo import arquivar
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return arquivar(meses=12)
+
+    def test_tira_do_banco_e_mantem_os_saldos(self):
+        import os
+
+        from .conciliacao import conciliar
+        from .fechamentos import saldo_em
+        from .models import Conciliacao, SaldoArquivado
+
+        conciliar()
+        resultado = self.arquivar()
+
+        self.assertEqual(resultado['movimentacoes'], 2)
+        self.assertEqual(list(Movimentacao.objects.values_list('id', flat=True)), [self.nova.pk])
+        self.assertEqual(sum(arquivo.linhas for arquivo in resultado['arquivos']), 2)
+        self.assertTrue(all(os.path.exists(os.path.join(self.pasta, a.arquivo)) for a in resultado['arquivos']))
+        self.assertFalse([nome for nome in os.listdir(self.pasta) if nome.endswith('.parcial')])
+        self.assertEqual(resultado['fechamento'].saldos.get(tecnico=self.tecnico).quantidade, 6)
+        self.assertFalse(Movimentacao.objects.filter(obs='OS 111').exists())
+
+        # Saldos atuais iguais; carteira arquivada guardada para a conciliação
+        self.onu.refresh_from_db()
+        self.assertEqual(self.onu.quantidade, 94)
+        self.assertEqual(SaldoArquivado.objects.get(tecnico=self.tecnico, equipamento=self.onu).quantidade, 3)
+        self.assertEqual(conciliar()['divergencias'], [])
+        Conciliacao.objects.update(valida=False)
+        resultado = conciliar()
+        self.assertTrue(resultado['completa'])
+        self.assertEqual(resultado['divergencias'], [])
+
+        # Saldo num dia arquivado: fechamento + banco + arquivo
+        self.assertEqual(saldo_em(self.dias_atras(415), self.onu), 95)
+        self.assertEqual(saldo_em(self.dias_atras(415), self.onu, self.tecnico), 5)
+
+        # Nada mais para arquivar
+        self.assertEqual(self.arquivar()['movimentacoes'], 0)
+
+    def test_relatorio_e_exportacao_juntam_banco_e_arquivo(self):
+        import json
+        from datetime import timedelta
+
+        from . import relatorios
+        from .exportacao import exportar, ultimo_id
+
+        self.arquivar()
+
+        registros = [json.loads(linha) for linha in exportar('ndjson', {})]
+        self.assertEqual([r['id'] for r in registros], [m.pk for m in self.antigas] + [self.nova.pk])
+        self.assertEqual(registros[0]['obs'], 'OS 111')
+        self.assertEqual(registros[0]['tecnico'], 'natan')
+        continuacao = [json.loads(r)['id'] for r in exportar('ndjson', {}, desde_id=self.antigas[0].pk)]
+        self.assertEqual(continuacao, [self.antigas[1].pk, self.nova.pk])
+        self.assertEqual(ultimo_id(), self.nova.pk)
+
+        # Período só no arquivo; relatório em partes passando do banco para o arquivo
+        dia = self.dias_atras(420).date()
+        periodo = {'inicio': dia - timedelta(days=1), 'fim': dia + timedelta(days=1)}
+        self.assertEqual([json.loads(r)['id'] for r in exportar('ndjson', periodo)], [self.antigas[0].pk])
+        with mock.patch.object(relatorios, 'LINHAS_POR_PARTE', 2):
+            self.assertEqual(relatorios.total_de_partes({'tecnico': self.tecnico}), 2)
+        from .historico import pagina
+
+        vivas = relatorios.movimentacoes_do_relatorio({'tecnico': self.tecnico})
+        self.assertEqual([l.id for l in pagina(vivas, {'tecnico': self.tecnico}, 0, 2)],
+                         [self.nova.pk, self.antigas[1].pk])
+        self.assertEqual([l.id for l in pagina(vivas, {'tecnico': self.tecnico}, 2, 2)], [self.antigas[0].pk])
+
+    def test_consumo_dos_meses_arquivados_fica(self):
+        from .consumo import refazer_consumo
+        from .models import ConsumoDiario
+
+        refazer_consumo()  # as datas foram mudadas direto no banco
+        antes = ConsumoDiario.objects.count()
+        self.assertEqual(antes, 3)
+        self.arquivar()
+        refazer_consumo()
+        self.assertEqual(ConsumoDiario.objects.count(), antes)
+
+    def test_falha_no_meio_nao_perde_nada(self):
+        import os
+
+        from . import arquivo
+
+        with mock.patch.object(arquivo, '_apagar', side_effect=OperationalError('disco cheio')):
+            with self.assertRaises(OperationalError):
+                self.arquivar()
+        self.assertEqual(Movimentacao.objects.count(), 3)
+        self.assertEqual(os.listdir(self.pasta), [])
+
+    def test_comando_so_arquiva_com_confirmacao(self):
+        from django.core.management import call_command
+
+        saida = io.StringIO()
+        call_command('arquivar_movimentacoes', stdout=saida)
+        self.assertIn('2 movimentações', saida.getvalue())
+        self.assertEqual(Movimentacao.objects.count(), 3)
+
+        saida = io.StringIO()
+        call_command('arquivar_movimentacoes', confirmar=True, stdout=saida)
+        self.assertIn('2 movimentações arquivadas', saida.getvalue())
+        self.assertEqual(Movimentacao.objects.count(), 1)
+
+
+# ==============================================================================
+# 23. RESERVAS (Lotes em rascunho seguram o estoque)
+# ==============================================================================
+
+class ReservaTests(TestCase):
+    def setUp(self):
+        self.natan = User.objects.create(username='natan')
+        self.carlos = User.objects.create(username='carlos')
+        self.onu = Equipamento.objects.create(nome='ONU', tipo='FIBRA', quantidade=10, minimo=1)
+
+    def lote(self, tecnico, quantidade, rascunho=True):
+        ordem = OrdemMovimentacao.objects.create(tecnico=tecnico, tipo='SAIDA', rascunho=rascunho)
+        ItemOrdem.objects.create(ordem=ordem, equipamento=self.onu, quantidade=quantidade)
+        return ordem
+
+    def reservar(self, ordem):
+        from .reservas import reservar
+
+        with self.captureOnCommitCallbacks(execute=True):
+            return reservar(ordem)
+
+    def test_reserva_vale_para_avulsa_e_lote(self):
+        from .reservas import disponivel
+
+        kit = self.lote(self.natan, 6)
+        self.reservar(kit)
+        self.assertEqual(disponivel(self.onu.pk), 4)
+        self.assertEqual(disponivel(self.onu.pk, exceto_ordem=kit.pk), 10)
+
+        # Avulsa: barrada no formulário e no próprio UPDATE
+        avulsa = Movimentacao(tecnico=self.carlos, equipamento=self.onu, tipo='SAIDA', quantidade=5,
+                              autor_movimento=self.carlos)
+        with self.assertRaisesMessage(ValidationError, 'só tem 4 unidades'):
+            avulsa.full_clean()
+        with self.assertRaises(ValidationError):
+            avulsa.save()
+
+        # Outro lote: só o que sobrou
+        with self.assertRaisesMessage(ValidationError, 'só tem 4 unidades'):
+            self.lote(self.carlos, 5, rascunho=False).lancar(autor=self.carlos)
+        self.lote(self.carlos, 4, rascunho=False).lancar(autor=self.carlos)
+
+        # O dono da reserva lança o que segurou, e a reserva acaba
+        kit.lancar(autor=self.natan)
+        self.onu.refresh_from_db()
+        self.assertEqual(self.onu.quantidade, 0)
+        self.assertFalse(kit.reservas.exists())
+        self.assertFalse(OrdemMovimentacao.objects.get(pk=kit.pk).rascunho)
+
+    def test_segunda_reserva_sem_disponivel_nao_grava(self):
+        from .models import Reserva
+
+        self.reservar(self.lote(self.natan, 6))
+        outro = self.lote(self.carlos, 6)
+        with self.assertRaisesMessage(ValidationError, 'Só há 4 unidades disponíveis'):
+            self.reservar(outro)
+        self.assertFalse(outro.reservas.exists())
+
+        # Reservar de novo o mesmo lote troca a reserva (não soma)
+        kit = OrdemMovimentacao.objects.get(tecnico=self.natan)
+        kit.itemordem_set.update(quantidade=3)
+        self.reservar(kit)
+        self.assertEqual(list(Reserva.objects.values_list('quantidade', flat=True)), [3])
+
+    def test_reserva_vencida_libera_e_muda_a_versao(self):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from .reservas import disponivel
+        from .signals import versao_estoque
+
+        kit = self.lote(self.natan, 6)
+        self.reservar(kit)
+        antes = versao_estoque()
+        self.assertEqual(disponivel(self.onu.pk), 4)
+
+        vencimento = timezone.now() + timedelta(minutes=1)
+        with mock.patch('django.utils.timezone.now', return_value=vencimento + timedelta(hours=3)):
+            self.assertEqual(disponivel(self.onu.pk), 10)
+            # Ninguém gravou nada, mas o painel em cache não vale mais
+            self.assertGreater(versao_estoque(), antes)
+
+    def test_painel_mostra_o_disponivel(self):
+        self.client.force_login(User.objects.create_superuser('admin', password='x'))
+        self.reservar(self.lote(self.natan, 6))
+
+        response = self.client.get('/')
+        self.assertEqual(response.context['pagina'][0].disponivel, 4)
+        self.assertContains(response, '🔒 6 reserv.')
+
+    @skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN é do SQLite")
+    def test_disponivel_numa_consulta_pelo_indice(self):
+        from .reservas import disponiveis
+
+        self.reservar(self.lote(self.natan, 2))
+        with CaptureQueriesContext(connection) as ctx:
+            disponiveis([self.onu.pk])
+        self.assertEqual(len(ctx.captured_queries), 1)
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {ctx.captured_queries[0]['sql']}")
+            plano = ' '.join(linha[-1] for linha in cursor.fetchall())
+        self.assertIn('reserva_ativa_idx', plano)
+
+
+# ==============================================================================
+# 24. FILIAIS (Saldo por local e transferência pelo histórico)
+# ==============================================================================
+
+class FilialTests(TestCase):
+    def setUp(self):
+        from .models import Filial
+
+        self.natan = User.objects.create(username='natan')
+        self.gestor = User.objects.create_superuser('gestor', password='x')
+        self.centro = Filial.objects.create(nome='Centro')
+        self.onu = Equipamento.objects.create(nome='ONU Huawei', tipo='FIBRA', quantidade=10, minimo=3)
+
+    def saldo(self, filial_id):
+        linha = EstoqueFilial.objects.filter(filial_id=filial_id, equipamento=self.onu).first()
+        return linha.quantidade if linha else 0
+
+    def transferir(self, quantidade, origem=None, destino=None):
+        from .models import MATRIZ
+
+        ordem = OrdemMovimentacao.objects.create(
+            tecnico=self.natan, tipo='TRANSFERENCIA', filial_id=origem or MATRIZ,
+            filial_destino=destino or self.centro,
+        )
+        ItemOrdem.objects.create(ordem=ordem, equipamento=self.onu, quantidade=quantidade)
+        return ordem.lancar(autor=self.gestor)
+
+    def test_transferencia_sao_duas_movimentacoes_e_o_total_nao_muda(self):
+        from .models import MATRIZ
+
+        # Centro ainda não tem nada: a retirada de lá é barrada
+        with self.assertRaisesMessage(ValidationError, 'só tem 0 unidades'):
+            Movimentacao(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=1,
+                         filial=self.centro).save()
+
+        movimentacoes = self.transferir(4)
+        self.assertEqual([(m.tipo, m.filial_id) for m in movimentacoes],
+                         [('TRANSF_SAIDA', MATRIZ), ('TRANSF_ENTRADA', self.centro.pk)])
+        self.assertEqual((self.saldo(MATRIZ), self.saldo(self.centro.pk)), (6, 4))
+        self.onu.refresh_from_db()
+        self.assertEqual(self.onu.quantidade, 10)
+
+        # Retirada no Centro: sai de lá, e o total da empresa acompanha (gatilho)
+        Movimentacao(tecnico=self.natan, equipamento=self.onu, tipo='SAIDA', quantidade=3,
+                     filial=self.centro).save()
+        self.onu.refresh_from_db()
+        self.assertEqual((self.saldo(MATRIZ), self.saldo(self.centro.pk), self.onu.quantidade), (6, 1, 7))
+        self.assertEqual(EstoqueTecnico.objects.get(tecnico=self.natan).quantidade, 3)
+
+        # Mais do que a origem tem: nada é gravado
+        with self.assertRaises(ValidationError):
+            self.transferir(2, origem=self.centro.pk, destino=self.centro.__class__.objects.get(pk=MATRIZ))
+        self.assertEqual(self.saldo(self.centro.pk), 1)
+
+    def test_ordem_de_transferencia_pede_destino_diferente(self):
+        from .models import MATRIZ
+
+        ordem = OrdemMovimentacao(tecnico=self.natan, tipo='TRANSFERENCIA', filial_id=MATRIZ)
+        with self.assertRaisesMessage(ValidationError, 'Escolha a filial'):
+            ordem.clean()
+        ordem.filial_destino_id = MATRIZ
+        with self.assertRaisesMessage(ValidationError, 'mesma de origem'):
+            ordem.clean()
+        ordem.tipo, ordem.filial_destino = 'SAIDA', self.centro
+        with self.assertRaisesMessage(ValidationError, 'só para transferência'):
+            ordem.clean()
+
+    def test_painel_api_e_pdf_por_filial(self):
+        from .models import MATRIZ
+
+        self.transferir(2)
+        self.client.force_login(self.gestor)
+
+        response = self.client.get('/', {'filial': self.centro.pk})
+        item = response.context['pagina'][0]
+        self.assertEqual((item.saldo, item.baixo), (2, True))
+        self.assertContains(response, 'Centro')
+        self.assertEqual(self.client.get('/').context['pagina'][0].saldo, 10)
+
+        dados = self.client.get('/api/equipamentos/', {'filial': self.centro.pk, 'campos': 'nome,quantidade'}).json()
+        self.assertEqual(dados['resultados'], [{'nome': 'ONU Huawei', 'quantidade': 2}])
+        self.assertEqual(self.client.get('/api/equipamentos/', {'filial': 'x'}).status_code, 400)
+
+        movimentacoes = self.client.get('/api/movimentacoes/', {'filial': MATRIZ, 'campos': 'tipo,filial'}).json()
+        self.assertEqual(movimentacoes['resultados'], [{'tipo': 'TRANSF_SAIDA', 'filial': MATRIZ}])
+
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta)
+        with override_settings(RELATORIO_WORKERS=0, RELATORIOS_ROOT=pasta):
+            response = self.client.get('/relatorio-pdf/', {'filial': self.centro.pk})
+            texto = texto_do_pdf(b''.join(response.streaming_content))
+        self.assertIn(b'Filial Centro', texto)
+        self.assertIn(b'TRANSF_ENTRA', texto)  # coluna Acao corta em 12 letras
+        self.assertNotIn(b'TRANSF_SAIDA', texto)
+
+    def test_admin_por_filial(self):
+        self.transferir(2)
+        self.client.force_login(self.gestor)
+
+        response = self.client.get('/admin/estoque/equipamento/', {'filial': self.centro.pk})
+        self.assertEqual(response.context['cl'].result_list[0].saldo, 2)
+        response = self.client.get('/admin/estoque/estoquebaixo/', {'filial': self.centro.pk})
+        self.assertContains(response, 'ONU Huawei')
+        self.assertNotContains(self.client.get('/admin/estoque/estoquebaixo/'), 'ONU Huawei')
+        self.assertContains(self.client.get('/admin/estoque/estoquefilial/'), 'Centro')
+
+        # Ajuste de inventário numa filial corrige o total da empresa
+        linha = EstoqueFilial.objects.get(filial=self.centro, equipamento=self.onu)
+        linha.quantidade = 5
+        linha.save()
+        self.onu.refresh_from_db()
+        self.assertEqual(self.onu.quantidade, 13)
+
+    @skipUnless(connection.vendor == 'sqlite', "EXPLAIN QUERY PLAN é do SQLite")
+    def test_saldo_da_filial_pelo_indice(self):
+        from .filiais import anotar_saldo
+
+        consulta = anotar_saldo(Equipamento.objects.all(), self.centro.pk).values_list('nome', 'saldo')
+        sql, params = consulta.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plano = ' '.join(linha[-1] for linha in cursor.fetchall())
+        # UniqueConstraint no SQLite vira o autoindex da tabela: uma busca por (filial, item)
+        self.assertIn('USING INDEX sqlite_autoindex_estoque_estoquefilial_1 (filial_id=? AND equipamento_id=?)', plano)
@@ -1,114 +1,193 @@
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.paginator import Paginator
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import FileResponse, Http404, HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.utils.functional import SimpleLazyObject
+from django.utils.html import escape
+from django.views.decorators.http import condition
 from django.contrib.auth.decorators import login_required # <--- IMPORTANTE: O Cadeado
-from .models import Equipamento, Movimentacao
-from fpdf import FPDF
-from datetime import datetime
+from . import exportacao, fila
+from .busca import buscar_equipamentos
+from .filiais import anotar_saldo, filial_pedida
+from .forms import FiltroMovimentacaoForm
+from .models import Equipamento, Filial
+from .previsao import dias_restantes
+from .reservas import expressao_reservado
+from .signals import versao_estoque
+
+# Quantos cards por página no celular
+ITENS_POR_PAGINA = 30
+
+
+# ETag/Last-Modified do painel: saem da versão do estoque (cache), sem tocar no banco.
+# Se nada mudou desde a última visita, o celular recebe só um 304.
+def _etag_painel(request):
+    return f"{versao_estoque()}-{request.GET.urlencode()}"
+
+
+def _ultima_alteracao(request):
+    return datetime.fromtimestamp(versao_estoque(), tz=dt_timezone.utc)
+
 
 # Tela Inicial (Agora Protegida)
 # Se não estiver logado, manda para o login do Admin
-@login_required(login_url='/admin/login/') 
+# Filtros: ?tipo=FIBRA, ?baixo=1 (só os que estão no mínimo), ?q=huawei (busca), ?filial=2 e ?page=2
+# Sem ?filial o painel mostra a empresa toda (soma das filiais).
+@login_required(login_url='/admin/login/')
+@condition(etag_func=_etag_painel, last_modified_func=_ultima_alteracao)
 def index(request):
-    equipamentos = Equipamento.objects.all().order_by('nome')
-    return render(request, 'estoque/index.html', {'equipamentos': equipamentos})
-
-# Nova Classe do PDF (Configuração Visual)
-class PDF(FPDF):
-    def header(self):
-        # Título em Arial Negrito 14
-        self.set_font('Arial', 'B', 14)
-        self.cell(0, 10, 'FUTURANET - Controle de Estoque (Filial)', 0, 1, 'C')
-        self.ln(5) # Pula linha
-
-    def footer(self):
-        # Rodapé com número da página
-        self.set_y(-15)
-        self.set_font('Arial', 'I', 8)
-        self.cell(0, 10, f'Pagina {self.page_no()}', 0, 0, 'C')
+    tipo = request.GET.get('tipo', '')
+    baixo = request.GET.get('baixo') == '1'
+    busca = request.GET.get('q', '').strip()
+    filial = filial_pedida(request.GET)
+
+    # Só as colunas que o card mostra (+ o saldo da filial e o reservado pelos lotes em rascunho, no mesmo SELECT)
+    equipamentos = anotar_saldo(Equipamento.objects.only(
+        'nome', 'tipo', 'especificacoes', 'foto', 'quantidade', 'minimo', 'estoque_baixo'
+    ), filial).annotate(reservado=expressao_reservado(filial=filial)).order_by('nome', 'id')
+    if tipo:
+        equipamentos = equipamentos.filter(tipo=tipo)
+    if baixo and filial is None:
+        # Coluna calculada + índice parcial: só lê os itens que estão no mínimo
+        equipamentos = equipamentos.filter(estoque_baixo=True)
+    elif baixo:
+        equipamentos = equipamentos.filter(baixo=True)
+    if busca:
+        equipamentos = buscar_equipamentos(equipamentos, busca)
+
+    # A página só é montada (COUNT + SELECT + previsão) se o pedaço não estiver no cache do template.
+    # O total do topo usa só o COUNT do paginador.
+    paginador = SimpleLazyObject(lambda: Paginator(equipamentos, ITENS_POR_PAGINA))
+
+    def montar_pagina():
+        pagina = paginador.get_page(request.GET.get('page'))
+        previsao = dias_restantes(filial=filial)
+        for item in pagina:
+            item.dias_restantes = previsao.get(item.pk)
+            item.disponivel = item.saldo - item.reservado
+        return pagina
+
+    pagina = SimpleLazyObject(montar_pagina)
+
+    filtros = request.GET.copy()
+    filtros.pop('page', None)
+    # Links que trocam só um filtro (tipo/baixo mantêm a filial; a filial mantém o resto)
+    outros_filtros = filtros.copy()
+    outros_filtros.pop('filial', None)
+
+    response = render(request, 'estoque/index.html', {
+        'pagina': pagina,
+        'paginador': paginador,
+        'versao': versao_estoque(),
+        'tipos': Equipamento.TIPO_CHOICES,
+        'tipo': tipo,
+        'baixo': baixo,
+        'busca': busca,
+        'filial': filial,
+        # Lista só consultada se o pedaço do seletor não estiver no cache
+        'filiais': SimpleLazyObject(lambda: list(Filial.objects.all())),
+        'filial_url': f'filial={filial}&' if filial else '',
+        'sem_filial_url': outros_filtros.urlencode(),
+        'filtros_url': filtros.urlencode(),
+        'pagina_pedida': request.GET.get('page', '1'),
+        'filtro_relatorio': FiltroMovimentacaoForm(),
+    })
+    # O navegador sempre pergunta antes de reaproveitar (e ganha 304 se nada mudou)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+# ?parte= da URL: número a partir de 1, ou None se veio outra coisa
+def _parte_pedida(request):
+    parte = request.GET.get('parte') or '1'
+    return int(parte) if parte.isdigit() and int(parte) >= 1 else None
+
 
 # Relatório PDF (Também Protegido)
+# Aceita filtros na URL: ?inicio=2026-01-01&fim=2026-01-31&tecnico=natan&tipo=SAIDA&parte=2
+# O PDF é gerado na fila (fila.py). Se já existe um pronto para o mesmo estoque, sai na hora.
 @login_required(login_url='/admin/login/')
 def gerar_relatorio_pdf(request):
-    # Cria o objeto PDF
-    pdf = PDF()
-    pdf.add_page()
-    pdf.set_font("Arial", size=10)
-
-    # --- SEÇÃO 1: ESTOQUE ATUAL ---
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 10, "1. Posicao de Estoque Atual", 0, 1, 'L')
-    
-    # Cabeçalho da Tabela
-    pdf.set_fill_color(200, 220, 255) # Azul claro
-    pdf.set_font("Arial", 'B', 9)
-    pdf.cell(80, 8, "Produto", 1, 0, 'L', 1)
-    pdf.cell(40, 8, "Tipo", 1, 0, 'C', 1)
-    pdf.cell(30, 8, "Qtd", 1, 0, 'C', 1)
-    pdf.cell(40, 8, "Status", 1, 1, 'C', 1)
-
-    # Dados da Tabela
-    pdf.set_font("Arial", size=9)
-    equipamentos = Equipamento.objects.all().order_by('nome')
-    
-    for item in equipamentos:
-        # Tenta pegar nome seguro, caso tenha erro de caractere
-        try:
-            nome_prod = item.nome[:35].encode('latin-1', 'ignore').decode('latin-1')
-        except:
-            nome_prod = item.nome[:35]
-
-        pdf.cell(80, 8, nome_prod, 1) 
-        pdf.cell(40, 8, item.get_tipo_display(), 1, 0, 'C')
-        pdf.cell(30, 8, str(item.quantidade), 1, 0, 'C')
-        
-        # Lógica para mostrar se está baixo
-        status = "BAIXO" if item.quantidade <= item.minimo else "Normal"
-        pdf.cell(40, 8, status, 1, 1, 'C')
-
-    pdf.ln(10) # Espaço grande
-
-    # --- SEÇÃO 2: ÚLTIMAS MOVIMENTAÇÕES ---
-    pdf.set_font("Arial", 'B', 12)
-    pdf.cell(0, 10, "2. Historico Recente (Ultimos 20)", 0, 1, 'L')
-
-    # Cabeçalho
-    pdf.set_fill_color(230, 230, 230) # Cinza
-    pdf.set_font("Arial", 'B', 8)
-    pdf.cell(35, 8, "Data/Hora", 1, 0, 'L', 1)
-    pdf.cell(40, 8, "Tecnico", 1, 0, 'L', 1)
-    pdf.cell(20, 8, "Acao", 1, 0, 'C', 1)
-    pdf.cell(60, 8, "Item", 1, 0, 'L', 1)
-    pdf.cell(35, 8, "Obs", 1, 1, 'L', 1)
-
-    # Dados
-    pdf.set_font("Arial", size=8)
-    movimentacoes = Movimentacao.objects.all().order_by('-data')[:20]
-    
-    for mov in movimentacoes:
-        data_fmt = mov.data.strftime("%d/%m %H:%M")
-        
-        # Tratamento de caracteres para evitar erro no PDF
-        nome_tec = mov.tecnico.username
-        nome_eqp = mov.equipamento.nome[:30]
-        obs_texto = mov.obs if mov.obs else "-"
-        
+    form = FiltroMovimentacaoForm(request.GET)
+    if not form.is_valid():
+        # A mensagem de escolha inválida repete o valor da URL: escapado, não vira HTML
+        erros = "; ".join(erro for lista in form.errors.values() for erro in lista)
+        return HttpResponseBadRequest(escape(f"Filtro inválido: {erros}"))
+
+    parte = _parte_pedida(request) or 1
+
+    # Só os filtros preenchidos, em texto, do jeito que vieram na URL
+    filtros = {campo: request.GET[campo] for campo in form.fields if request.GET.get(campo)}
+    chave = fila.calcular_chave(filtros, parte)
+    fila.enfileirar(chave, filtros, parte)
+
+    if fila.situacao(chave) == 'pronto':
         try:
-            nome_eqp = nome_eqp.encode('latin-1', 'ignore').decode('latin-1')
-            obs_texto = obs_texto.encode('latin-1', 'ignore').decode('latin-1')
-        except:
-            pass
-
-        pdf.cell(35, 8, data_fmt, 1)
-        pdf.cell(40, 8, nome_tec, 1)
-        pdf.cell(20, 8, mov.tipo, 1, 0, 'C')
-        pdf.cell(60, 8, nome_eqp, 1)
-        pdf.cell(35, 8, obs_texto[:20], 1, 1)
-
-    # Gerar e Retornar o PDF
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename="relatorio_estoque.pdf"'
-    
-    pdf_output = pdf.output(dest='S').encode('latin-1', 'ignore')
-    response.write(pdf_output)
-    
+            return _arquivo_pdf(chave, parte)
+        except FileNotFoundError:
+            # A faxina da fila apagou o arquivo entre a conferência e o open(): gera de novo
+            fila.enfileirar(chave, filtros, parte)
+
+    # Ainda gerando: tela de espera que consulta a situação até o PDF ficar pronto
+    return render(request, 'estoque/relatorio_aguarde.html', {
+        'status_url': reverse('relatorio_status', args=[chave]) + f'?parte={parte}',
+    }, status=202)
+
+
+@login_required(login_url='/admin/login/')
+def status_relatorio(request, chave):
+    parte = _parte_pedida(request)
+    if not fila.chave_valida(chave) or parte is None:
+        raise Http404
+    return JsonResponse({
+        'status': fila.situacao(chave),
+        'url': reverse('relatorio_arquivo', args=[chave]) + f'?parte={parte}',
+    })
+
+
+# FileNotFoundError se o arquivo já saiu da pasta (os mais antigos são apagados, ver fila.py)
+def _arquivo_pdf(chave, parte):
+    nome = "relatorio_estoque.pdf" if parte == 1 else f"relatorio_estoque_parte{parte}.pdf"
+    # FileResponse manda o arquivo do disco em pedaços (não carrega tudo na memória)
+    return FileResponse(
+        open(fila.caminho_arquivo(chave), 'rb'), as_attachment=True, filename=nome, content_type='application/pdf'
+    )
+
+
+@login_required(login_url='/admin/login/')
+def baixar_relatorio(request, chave):
+    parte = _parte_pedida(request)
+    if not fila.chave_valida(chave) or parte is None:
+        raise Http404
+    try:
+        return _arquivo_pdf(chave, parte)
+    except FileNotFoundError:
+        raise Http404
+
+
+# Exportação do histórico completo para a contabilidade (CSV ou NDJSON)
+# Mesmos filtros do PDF + ?formato=csv|ndjson e ?desde=<último id já recebido>
+# O cabeçalho X-Ultimo-Id diz até onde esta exportação vai (guarde para a próxima).
+@login_required(login_url='/admin/login/')
+def exportar_movimentacoes(request):
+    form = FiltroMovimentacaoForm(request.GET)
+    formato = request.GET.get('formato', 'csv')
+    if not form.is_valid() or formato not in exportacao.FORMATOS:
+        return HttpResponseBadRequest("Filtro inválido: use formato=csv ou ndjson e datas no formato AAAA-MM-DD.")
+    try:
+        desde = max(int(request.GET.get('desde') or 0), 0)
+    except ValueError:
+        return HttpResponseBadRequest("'desde' precisa ser o número da última movimentação recebida.")
+
+    ultimo = exportacao.ultimo_id()
+    tipo_conteudo, extensao = exportacao.FORMATOS[formato]
+    # StreamingHttpResponse: cada pedaço vai para o navegador assim que sai do banco
+    response = StreamingHttpResponse(
+        exportacao.exportar(formato, form.filtros(), desde, ultimo), content_type=tipo_conteudo
+    )
+    response['Content-Disposition'] = f'attachment; filename="movimentacoes_{timezone.localdate():%Y%m%d}.{extensao}"'
+    response['X-Ultimo-Id'] = str(ultimo)
     return response
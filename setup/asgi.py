@@ -5,6 +5,9 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
+
+O painel ao vivo (/eventos/estoque/, ver estoque/ao_vivo.py) só funciona por aqui:
+    uvicorn setup.asgi:application
 """
 
 import os
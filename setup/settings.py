@@ -37,6 +37,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Primeiro da lista: mede a requisição inteira (ver estoque/metricas.py)
+    'estoque.metricas.MetricasMiddleware',
+    # Versão do estoque lida uma vez por requisição (ver estoque/signals.py)
+    'estoque.signals.VersoesPorRequisicaoMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,6 +80,54 @@ DATABASES = {
     }
 }
 
+# Perfil do servidor: ESTOQUE_PERFIL=producao (padrão: desenvolvimento)
+ESTOQUE_PERFIL = os.environ.get('ESTOQUE_PERFIL', 'desenvolvimento')
+
+# PRAGMAs aplicados em toda conexão nova do SQLite (estoque/banco.py)
+# - WAL: leitura não trava escrita (e vice-versa)
+# - synchronous NORMAL: seguro com WAL, bem menos fsync por COMMIT
+# - busy_timeout: espera a vez em vez de "database is locked"
+# - cache_size negativo = KiB (64 MB), mmap_size em bytes (256 MB)
+SQLITE_PRAGMAS_PRODUCAO = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+SQLITE_PRAGMAS = {}
+
+if ESTOQUE_PERFIL == 'producao':
+    SQLITE_PRAGMAS = SQLITE_PRAGMAS_PRODUCAO
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,          # Reaproveita a conexão entre requisições
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # BEGIN IMMEDIATE: a transação pega a vez de escrever logo no começo,
+            # então o busy timeout funciona (com DEFERRED o SQLite desiste na hora)
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+    })
+
+
+# Cache (painel e versão do estoque)
+# LocMem serve para um processo só (runserver no celular). Com vários processos
+# (gunicorn etc.) troque por um cache compartilhado, senão cada um vê uma versão.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+if ESTOQUE_PERFIL == 'producao':
+    # Em produção roda mais de um processo: todos leem a mesma pasta
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
@@ -119,6 +171,31 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 
+# Relatórios PDF (Gerados numa fila local de processos, sem broker externo)
+# 0 = gera dentro da própria requisição
+RELATORIO_WORKERS = 2
+RELATORIOS_ROOT = os.path.join(BASE_DIR, 'relatorios_cache')
+
+
+# Reservas dos lotes em rascunho ("Só reservar", ver estoque/reservas.py)
+# Passado o prazo sem lançar, os itens voltam a ficar disponíveis para todos.
+RESERVA_MINUTOS = 120
+
+
+# Arquivo do histórico (comando "arquivar_movimentacoes", ver estoque/arquivo.py)
+# Meses inteiros mais velhos que isso saem do banco para .ndjson.gz nesta pasta.
+# Guarde a pasta no backup junto com o db.sqlite3: é a única cópia desses meses.
+ARQUIVO_MESES = 12
+ARQUIVO_ROOT = os.path.join(BASE_DIR, 'arquivo_movimentacoes')
+
+
+# Métricas (/metrics no formato do Prometheus, ver estoque/metricas.py)
+# Staff logado sempre vê; o coletor (sem login) precisa estar nesta lista de IPs.
+METRICAS_IPS_PERMITIDOS = ['127.0.0.1']
+# Mesma consulta repetida tantas vezes numa requisição = aviso de N+1 no log
+METRICAS_LIMITE_REPETICOES = 10
+
+
 # Configuração Visual do Painel Admin (Jazzmin)
 JAZZMIN_SETTINGS = {
     "site_title": "Futuranet Admin",
@@ -126,7 +203,8 @@ JAZZMIN_SETTINGS = {
     "site_brand": "Futuranet Estoque",
     "welcome_sign": "Bem-vindo ao Sistema Futuranet",
     "copyright": "Futuranet Telecom",
-    "search_model": "estoque.Equipamento",
+    # Busca do topo: itens e histórico (as duas pelo índice de palavras, ver estoque/busca.py)
+    "search_model": ["estoque.Equipamento", "estoque.Movimentacao"],
     "show_ui_builder": False,
     
     # 1. Menu do Topo (Para Computador)
@@ -2,12 +2,28 @@ from django.contrib import admin
 from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static
-from estoque.views import index, gerar_relatorio_pdf # <--- Importe a nova função
+from estoque.views import index, gerar_relatorio_pdf, status_relatorio, baixar_relatorio, exportar_movimentacoes # <--- Importe a nova função
+from estoque.api import api_equipamentos, api_carteiras, api_movimentacoes, api_alertas, api_sincronizar
+from estoque.metricas import metricas
+from estoque.ao_vivo import eventos_estoque
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', index, name='index'),
     path('relatorio-pdf/', gerar_relatorio_pdf, name='relatorio_pdf'), # <--- Nova rota
+    path('relatorio-pdf/status/<slug:chave>/', status_relatorio, name='relatorio_status'),
+    path('relatorio-pdf/arquivo/<slug:chave>/', baixar_relatorio, name='relatorio_arquivo'),
+    path('exportar/movimentacoes/', exportar_movimentacoes, name='exportar_movimentacoes'),
+    # Painel ao vivo (SSE, só no servidor ASGI)
+    path('eventos/estoque/', eventos_estoque, name='eventos_estoque'),
+    # API JSON somente leitura (app de campo / BI)
+    path('api/equipamentos/', api_equipamentos, name='api_equipamentos'),
+    path('api/carteiras/', api_carteiras, name='api_carteiras'),
+    path('api/movimentacoes/', api_movimentacoes, name='api_movimentacoes'),
+    path('api/alertas/', api_alertas, name='api_alertas'),
+    path('api/sincronizar/', api_sincronizar, name='api_sincronizar'),
+    # Métricas para o Prometheus (staff ou IP liberado)
+    path('metrics', metricas, name='metricas'),
 ]
 
 if settings.DEBUG: